@@ -0,0 +1,175 @@
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TypeVar
+import random
+
+from spacy.language import Language
+from spacy.tokens import Doc
+
+from config import BUCKET_WINDOW, BUCKET_WINDOW_TOKENS
+
+T = TypeVar("T")
+
+
+def iter_windows(
+    items: Iterable[T],
+    window: int,
+    length: Optional[Callable[[T], int]] = None,
+    max_tokens: Optional[int] = None,
+) -> Iterator[List[T]]:
+    """Splits a stream into lists of up to `window` items. Given `length` and
+    `max_tokens`, a list also ends before its items' lengths add up to more than
+    `max_tokens`. An item longer than that gets a list to itself"""
+    if length is None or max_tokens is None:
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, window))
+            if not chunk:
+                return
+            yield chunk
+
+    chunk: List[T] = []
+    num_tokens = 0
+    for item in items:
+        item_tokens = length(item)
+        if chunk and (len(chunk) == window or num_tokens + item_tokens > max_tokens):
+            yield chunk
+            chunk = []
+            num_tokens = 0
+        chunk.append(item)
+        num_tokens += item_tokens
+    if chunk:
+        yield chunk
+
+
+def length_bucketed_batches(
+    items: Iterable[T],
+    length: Callable[[T], int],
+    token_budget: int,
+    max_batch_size: Optional[int] = None,
+    window: int = BUCKET_WINDOW,
+    shuffle_seed: Optional[int] = None,
+    max_window_tokens: Optional[int] = None,
+) -> Iterator[List[T]]:
+    """Batches items of similar length together, so the transformer pads each
+    sequence as little as possible. A batch's padded size, its number of items
+    times its longest item, stays within the token budget. Items longer than the
+    budget get a batch to themselves.
+
+    Items are sorted by length a window at a time, so the stream is never held in
+    memory at once.
+
+    Lengths are whatever `length` counts, spaCy tokens for Docs and Examples.
+    spacy-transformers re-tokenizes each doc into wordpieces and splits it into
+    strided spans of 128 wordpieces, and pads those spans to the longest in the
+    batch. The transformer therefore sees less padding than `padding_stats`
+    counts over these lengths, and the padding saved overstates the gain. Only
+    the measured throughput shows the real effect.
+
+    Args:
+        items (Iterable[T]): The items to batch, e.g. Examples or Docs
+        length (Callable[[T], int]): The number of tokens in an item
+        token_budget (int): The maximum padded size of a batch
+        max_batch_size (Optional[int]): The maximum number of items in a batch
+        window (int): The number of items sorted by length at a time
+        shuffle_seed (Optional[int]): If given, each window's batches are shuffled,
+            so training doesn't see them in order of length
+        max_window_tokens (Optional[int]): If given, a window also ends before its
+            items add up to more than this many tokens
+
+    Yields:
+        List[T]: The batches
+    """
+    rng = random.Random(shuffle_seed)
+
+    for chunk in iter_windows(items, window, length, max_window_tokens):
+        lengths = [length(item) for item in chunk]
+        batches = []
+        batch: List[T] = []
+
+        for i in sorted(range(len(chunk)), key=lengths.__getitem__):
+            # Sorted by length, so each new item is the longest in its batch
+            over_budget = (len(batch) + 1) * lengths[i] > token_budget
+            if batch and (over_budget or len(batch) == max_batch_size):
+                batches.append(batch)
+                batch = []
+            batch.append(chunk[i])
+
+        if batch:
+            batches.append(batch)
+        if shuffle_seed is not None:
+            rng.shuffle(batches)
+        yield from batches
+
+
+def pipe_length_bucketed(
+    nlp: Language,
+    texts: Iterable[str],
+    token_budget: int,
+    max_batch_size: Optional[int] = None,
+    window: int = BUCKET_WINDOW,
+    max_window_tokens: int = BUCKET_WINDOW_TOKENS,
+) -> Iterator[Doc]:
+    """Equivalent of `nlp.pipe` that runs the pipeline on length-bucketed batches.
+    Docs are still yielded in the order of the texts, each as soon as it and every
+    doc before it has been processed. Processed docs waiting on an earlier one are
+    held, so windows are capped in tokens as well as in texts
+
+    Args:
+        nlp (Language): The pipeline to run
+        texts (Iterable[str]): The texts to process
+        token_budget (int): The maximum padded size of a batch
+        max_batch_size (Optional[int]): The maximum number of docs in a batch
+        window (int): The number of texts sorted by length at a time
+        max_window_tokens (int): The maximum number of tokens in a window
+
+    Yields:
+        Doc: The processed docs
+    """
+    for docs in iter_windows(
+        (nlp.make_doc(text) for text in texts), window, len, max_window_tokens
+    ):
+        processed: List[Optional[Doc]] = [None] * len(docs)
+        num_yielded = 0
+
+        for batch in length_bucketed_batches(
+            range(len(docs)),
+            lambda i: len(docs[i]),
+            token_budget,
+            max_batch_size,
+            window=len(docs),
+        ):
+            batch_docs = nlp.pipe([docs[i] for i in batch], batch_size=len(batch))
+            for i, doc in zip(batch, batch_docs):
+                processed[i] = doc
+
+            while num_yielded < len(docs) and processed[num_yielded] is not None:
+                yield processed[num_yielded]
+                # Only the caller keeps the doc and its transformer output now
+                processed[num_yielded] = docs[num_yielded] = None
+                num_yielded += 1
+
+
+def padding_stats(batch_lengths: Iterable[List[int]]) -> Dict[str, float]:
+    """Counts the real and padded tokens in a set of batches
+
+    Args:
+        batch_lengths (Iterable[List[int]]): The length of each item in each batch
+
+    Returns:
+        Dict[str, float]: The number of batches, real tokens, padding tokens and
+            the fraction of the padded batches that is padding
+    """
+    num_batches = num_tokens = num_padded = 0
+    for lengths in batch_lengths:
+        num_batches += 1
+        num_tokens += sum(lengths)
+        num_padded += max(lengths, default=0) * len(lengths)
+
+    return {
+        "batches": num_batches,
+        "tokens": num_tokens,
+        "padding_tokens": num_padded - num_tokens,
+        "padding_fraction": (
+            (num_padded - num_tokens) / num_padded if num_padded else 0.0
+        ),
+    }
@@ -0,0 +1,820 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import tracemalloc
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import spacy
+from spacy.training import Example
+from spacy.util import compounding, minibatch
+
+from batching import length_bucketed_batches, padding_stats, pipe_length_bucketed
+from config import BUCKET_WINDOW_TOKENS, EXTRACTION_BATCH_SIZE, INFERENCE_TOKEN_BUDGET
+from config import SIMPLE_SENTENCE_SEGMENTER, TRAIN_TOKEN_BUDGET
+from fixtures import DEFINITIONS, filler, write_fixture_corpus
+from main import get_abbreviations
+from metrics import peak_rss_mb
+from models import BertAbbreviationExtractor, SimpleAbbreviationExtractor
+from rules import RegexAbbreviationExtractor, match_abbreviation
+from sinks import open_sink
+from utils import clean_data, load_articles, process_PLOD
+
+SENTENCE_SEGMENTERS = ["full", "parser", "senter", "sentencizer"]
+
+# CLI invocations whose startup is timed. None is a bare interpreter, the floor
+STARTUP_COMMANDS = {
+    "python": None,
+    "extract": ["extract"],
+    "rule_based_regex": ["rule-based", "--engine", "regex"],
+    "rule_based_spacy": ["rule-based", "--engine", "spacy"],
+    "ml": ["ml"],
+    "train": ["train"],
+    "prep_conll": ["prep-conll"],
+}
+STARTUP_RUNS = 3
+
+# Libraries that dominate startup when they are imported
+HEAVY_MODULES = ["spacy", "torch", "transformers", "pandas", "pyarrow"]
+
+
+def run_isolated(func, *args):
+    """Runs a function in a freshly spawned process, so that its timings and
+    memory usage are not affected by anything loaded earlier in the benchmark"""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(1, mp_context=context) as executor:
+        return executor.submit(func, *args).result()
+
+
+def load_texts(articles_path: str, limit: int) -> List[str]:
+    """Loads up to `limit` abstracts to benchmark the extractors on"""
+    return list(clean_data(load_articles(articles_path))["abstract"][:limit])
+
+
+def stage_result(num_items: int, seconds: float, **extra) -> Dict:
+    """Formats a stage's timings along with the process' peak memory"""
+    return {
+        "items": num_items,
+        "seconds": seconds,
+        "items_per_second": num_items / seconds if seconds else None,
+        **extra,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def benchmark_load_articles(articles_path: str) -> Dict:
+    """Times `utils.load_articles`. Items are articles"""
+    start = time.perf_counter()
+    articles = load_articles(articles_path)
+    return stage_result(len(articles), time.perf_counter() - start)
+
+
+def benchmark_clean_data(articles_path: str) -> Dict:
+    """Times `utils.clean_data` on already-loaded articles. Items are articles"""
+    articles = load_articles(articles_path)
+    start = time.perf_counter()
+    clean_data(articles)
+    return stage_result(len(articles), time.perf_counter() - start)
+
+
+def benchmark_pipeline_extractor(extractor, texts: List[str], batch_size: int) -> Dict:
+    """Times a spaCy-based extractor over the texts, counting sentences as well as
+    documents. Equivalent to `find_abbreviations_batch`. Items are abstracts"""
+    num_sentences = 0
+    num_abbreviations = 0
+
+    start = time.perf_counter()
+    for processed_text in extractor.nlp.pipe(texts, batch_size=batch_size):
+        num_sentences += sum(1 for _ in processed_text.sents)
+        num_abbreviations += len(extractor.abbreviations_from_doc(processed_text))
+    seconds = time.perf_counter() - start
+
+    return stage_result(
+        len(texts),
+        seconds,
+        sentences_per_second=num_sentences / seconds if seconds else None,
+        abbreviations=num_abbreviations,
+        pipeline=list(extractor.nlp.pipe_names),
+    )
+
+
+def benchmark_simple_extractor(
+    articles_path: str,
+    limit: int,
+    batch_size: int,
+    sentence_segmenter: str = SIMPLE_SENTENCE_SEGMENTER,
+) -> Dict:
+    """Times loading and running `SimpleAbbreviationExtractor`"""
+    texts = load_texts(articles_path, limit)
+
+    start = time.perf_counter()
+    extractor = SimpleAbbreviationExtractor(sentence_segmenter)
+    load_seconds = time.perf_counter() - start
+
+    return {
+        "sentence_segmenter": sentence_segmenter,
+        "load_seconds": load_seconds,
+        **benchmark_pipeline_extractor(extractor, texts, batch_size),
+    }
+
+
+def benchmark_bert_extractor(
+    articles_path: str, model_path: str, limit: int, batch_size: int
+) -> Dict:
+    """Times loading and running `BertAbbreviationExtractor` with the given model"""
+    texts = load_texts(articles_path, limit)
+
+    start = time.perf_counter()
+    extractor = BertAbbreviationExtractor(model_path)
+    load_seconds = time.perf_counter() - start
+
+    return {
+        "model": model_path,
+        "load_seconds": load_seconds,
+        **benchmark_pipeline_extractor(extractor, texts, batch_size),
+    }
+
+
+def benchmark_match_abbreviation(num_calls: int, seed: int = 0) -> Dict:
+    """Times `match_abbreviation` alone, on synthetic candidates. Three in ten
+    candidates have no matching long form. Items are calls"""
+    rng = random.Random(seed)
+    candidates = []
+    for _ in range(num_calls):
+        long_form, short_form = rng.choice(DEFINITIONS)
+        context = filler(rng, 2, 8)
+        if rng.random() >= 0.3:
+            context = f"{context} {long_form}"
+        candidates.append((short_form, context))
+
+    start = time.perf_counter()
+    num_matched = sum(
+        match_abbreviation(short_form, context) is not None
+        for short_form, context in candidates
+    )
+    return stage_result(num_calls, time.perf_counter() - start, matched=num_matched)
+
+
+def benchmark_process_plod(plod_path: str) -> Dict:
+    """Times `utils.process_PLOD`. Items are segments kept"""
+    start = time.perf_counter()
+    formatted_data = process_PLOD(plod_path)
+    return stage_result(len(formatted_data), time.perf_counter() - start)
+
+
+def timed_pairs(extractor, texts: List[str], batch_size: int):
+    """Runs an extractor over the texts, returning each text's (short form,
+    long form) pairs and the time taken"""
+    start = time.perf_counter()
+    pairs = [
+        Counter((abbrev.short_form, abbrev.long_form) for abbrev in abbrevs)
+        for abbrevs in extractor.find_abbreviations_batch(texts, batch_size)
+    ]
+    return pairs, time.perf_counter() - start
+
+
+def benchmark_rule_engines(articles_path: str, limit: int, batch_size: int) -> Dict:
+    """Compares the regex rule-based engine against the spaCy one. Reports the
+    speedup, and how closely the regex engine's pairs match the spaCy engine's
+
+    Args:
+        articles_path (str): The articles to extract abbreviations from
+        limit (int): The maximum number of abstracts to use
+        batch_size (int): The number of abstracts passed to nlp.pipe at a time
+
+    Returns:
+        Dict: The benchmark results
+    """
+    texts = load_texts(articles_path, limit)
+    reference_pairs, reference_seconds = timed_pairs(
+        SimpleAbbreviationExtractor(), texts, batch_size
+    )
+    regex_pairs, regex_seconds = timed_pairs(
+        RegexAbbreviationExtractor(short_form_first=False), texts, batch_size
+    )
+
+    matched = sum(
+        sum((reference & regex).values())
+        for reference, regex in zip(reference_pairs, regex_pairs)
+    )
+    num_reference = sum(sum(pairs.values()) for pairs in reference_pairs)
+    num_regex = sum(sum(pairs.values()) for pairs in regex_pairs)
+
+    return {
+        "docs": len(texts),
+        "spacy_docs_per_second": len(texts) / reference_seconds,
+        "regex_docs_per_second": len(texts) / regex_seconds,
+        "speedup": reference_seconds / regex_seconds,
+        "identical_docs": sum(
+            reference == regex for reference, regex in zip(reference_pairs, regex_pairs)
+        )
+        / len(texts),
+        "pair_precision": matched / max(num_regex, 1),
+        "pair_recall": matched / max(num_reference, 1),
+    }
+
+
+def legacy_result_assembly(abbrevs_per_abstract, cleaned_articles) -> pd.DataFrame:
+    """The result assembly `main.get_abbreviations` used before the columnar
+    AbbreviationTable: per-row arrays, np.insert per abstract and a merge on PMID.
+    Kept only as a baseline for `benchmark_result_assembly`"""
+    abbreviations_with_ids = []
+    for pmid, abbrevs in zip(cleaned_articles["PMID"], abbrevs_per_abstract):
+        abbrevs = np.array([np.array(abbrev[:3]) for abbrev in abbrevs])
+        if abbrevs.size == 0:
+            continue
+        abbrevs = np.insert(abbrevs, abbrevs.shape[1], pmid, axis=1)
+        abbreviations_with_ids.append(abbrevs)
+
+    abbreviations_with_ids = [
+        item for sublist in abbreviations_with_ids for item in sublist
+    ]
+    return pd.DataFrame(
+        abbreviations_with_ids, columns=["sentence", "short_form", "long_form", "PMID"]
+    ).merge(cleaned_articles[["PMID", "article_title"]], how="left", on="PMID")[
+        ["article_title", "PMID", "sentence", "short_form", "long_form"]
+    ]
+
+
+class PrecomputedExtractor:
+    """Replays already-extracted abbreviations, so result assembly can be
+    measured without the cost of extraction"""
+
+    def __init__(self, abbrevs_per_abstract) -> None:
+        self.abbrevs_per_abstract = abbrevs_per_abstract
+
+    def find_abbreviations_batch(self, texts, batch_size=1):
+        return iter(self.abbrevs_per_abstract)
+
+
+def get_abbreviations_quietly(
+    abbrevs_per_abstract, cleaned_articles, layout="full", sentences=False
+):
+    """Assembles precomputed abbreviations with `main.get_abbreviations`"""
+    return get_abbreviations(
+        PrecomputedExtractor(abbrevs_per_abstract),
+        cleaned_articles,
+        show_progress=False,
+        layout=layout,
+        sentences=sentences,
+    )
+
+
+def traced_peak_mb(func, *args):
+    """Runs a function, returning its result and its peak traced allocation in MB"""
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak / 2**20
+
+
+def benchmark_result_assembly(articles_path: str, limit: int, batch_size: int) -> Dict:
+    """Compares the peak memory and time of assembling the output dataframe with
+    the columnar AbbreviationTable against the previous array-based assembly
+
+    Args:
+        articles_path (str): The articles to extract abbreviations from
+        limit (int): The maximum number of articles to use
+        batch_size (int): The number of abstracts passed to nlp.pipe at a time
+
+    Returns:
+        Dict: The benchmark results
+    """
+    cleaned_articles = clean_data(load_articles(articles_path))[:limit]
+    abbrevs_per_abstract = list(
+        SimpleAbbreviationExtractor().find_abbreviations_batch(
+            cleaned_articles["abstract"], batch_size
+        )
+    )
+
+    results = {}
+    for name, assemble in [
+        ("legacy", legacy_result_assembly),
+        ("columnar", get_abbreviations_quietly),
+    ]:
+        start = time.perf_counter()
+        output, peak_mb = traced_peak_mb(
+            assemble, abbrevs_per_abstract, cleaned_articles
+        )
+        results[name] = {
+            "rows": len(output),
+            "seconds": time.perf_counter() - start,
+            "peak_traced_mb": peak_mb,
+            "frame_mb": float(output.memory_usage(deep=True).sum()) / 2**20,
+        }
+    return results
+
+
+def output_mb(path: Path) -> float:
+    """The size of an output file, or of all the files in an output directory"""
+    if path.is_dir():
+        return sum(part.stat().st_size for part in path.iterdir()) / 2**20
+    return path.stat().st_size / 2**20
+
+
+def benchmark_output_layouts(articles_path: str, limit: int, batch_size: int) -> Dict:
+    """Compares the full output layout, which repeats each row's sentence, against
+    the offsets layout with and without its sentence table: the peak memory and
+    size of the assembled dataframe, and the size of the written output
+
+    Args:
+        articles_path (str): The articles to extract abbreviations from
+        limit (int): The maximum number of articles to use
+        batch_size (int): The number of abstracts passed to nlp.pipe at a time
+
+    Returns:
+        Dict: The benchmark results
+    """
+    cleaned_articles = clean_data(load_articles(articles_path))[:limit]
+    abbrevs_per_abstract = list(
+        SimpleAbbreviationExtractor().find_abbreviations_batch(
+            cleaned_articles["abstract"], batch_size
+        )
+    )
+
+    results = {}
+    for name, layout, sentences in [
+        ("full", "full", False),
+        ("offsets", "offsets", False),
+        ("offsets_with_sentences", "offsets", True),
+    ]:
+        start = time.perf_counter()
+        output, peak_mb = traced_peak_mb(
+            get_abbreviations_quietly,
+            abbrevs_per_abstract,
+            cleaned_articles,
+            layout,
+            sentences,
+        )
+        results[name] = {
+            "rows": len(output),
+            "seconds": time.perf_counter() - start,
+            "peak_traced_mb": peak_mb,
+            "frame_mb": float(output.memory_usage(deep=True).sum()) / 2**20,
+        }
+
+        with tempfile.TemporaryDirectory() as output_dir:
+            for output_format, extension in (("tsv", ".tsv"), ("parquet", "")):
+                paths = [
+                    Path(output_dir) / f"{name}{extension}",
+                    Path(output_dir) / f"{name}_sentences{extension}",
+                ]
+                with open_sink(
+                    str(paths[0]),
+                    output_format,
+                    layout=layout,
+                    sentences_path=str(paths[1]) if sentences else None,
+                ) as sink:
+                    sink.write(output)
+                results[name][f"{output_format}_mb"] = sum(
+                    output_mb(path) for path in paths if path.exists()
+                )
+
+    return results
+
+
+def time_inference(nlp, texts: List[str], batches, pipe) -> Dict:
+    """Times running the pipeline over the texts, and counts the padding in the
+    batches it would use"""
+    start = time.perf_counter()
+    entities = [[(ent.start, ent.end, ent.label_) for ent in doc.ents] for doc in pipe]
+    seconds = time.perf_counter() - start
+
+    lengths = [len(nlp.make_doc(text)) for text in texts]
+    return {
+        "seconds": seconds,
+        "docs_per_second": len(texts) / seconds,
+        **padding_stats([lengths[i] for i in batch] for batch in batches),
+    }, entities
+
+
+def time_training_epoch(model_path: str, examples: List[Example], batcher) -> Dict:
+    """Times a training epoch of a freshly loaded copy of the model, and counts the
+    padding in its batches"""
+    nlp = spacy.load(model_path)
+    optimizer = nlp.resume_training()
+    batches = list(batcher(examples))
+
+    start = time.perf_counter()
+    for batch in batches:
+        nlp.update(batch, drop=0.5, sgd=optimizer)
+    seconds = time.perf_counter() - start
+
+    return {
+        "seconds": seconds,
+        "examples_per_second": len(examples) / seconds,
+        **padding_stats([len(eg.predicted) for eg in batch] for batch in batches),
+    }
+
+
+def benchmark_length_bucketing(
+    articles_path: str,
+    plod_path: str,
+    model_path: str,
+    limit: int,
+    batch_size: int,
+) -> Dict:
+    """Compares length-bucketed batching under a token budget against the fixed
+    doc-count batches used before, for inference and for a training epoch.
+    Reports the padding tokens and wall time of each
+
+    Args:
+        articles_path (str): The articles to run inference on
+        plod_path (str): The PLOD segments to train on
+        model_path (str): An NER model whose encoder pays for padding, like the
+            stand-in fixture model
+        limit (int): The maximum number of abstracts and of segments to use
+        batch_size (int): The fixed batch size, and the cap on bucketed batches
+
+    Returns:
+        Dict: The benchmark results
+    """
+    texts = load_texts(articles_path, limit)
+    nlp = spacy.load(model_path)
+    list(nlp.pipe(texts[:batch_size]))  # Warm up
+
+    positions = range(len(texts))
+    fixed, fixed_entities = time_inference(
+        nlp,
+        texts,
+        minibatch(positions, batch_size),
+        nlp.pipe(texts, batch_size=batch_size),
+    )
+    bucketed, bucketed_entities = time_inference(
+        nlp,
+        texts,
+        length_bucketed_batches(
+            positions,
+            lambda i: len(nlp.make_doc(texts[i])),
+            INFERENCE_TOKEN_BUDGET,
+            batch_size,
+            max_window_tokens=BUCKET_WINDOW_TOKENS,
+        ),
+        pipe_length_bucketed(nlp, texts, INFERENCE_TOKEN_BUDGET, batch_size),
+    )
+
+    examples = [
+        Example.from_dict(nlp.make_doc(text), annots)
+        for text, annots in process_PLOD(plod_path)[:limit]
+    ]
+    random.Random(0).shuffle(examples)
+
+    return {
+        "inference": {
+            "docs": len(texts),
+            "token_budget": INFERENCE_TOKEN_BUDGET,
+            "fixed": fixed,
+            "bucketed": bucketed,
+            "speedup": fixed["seconds"] / bucketed["seconds"],
+            "identical_entities": fixed_entities == bucketed_entities,
+        },
+        "training": {
+            "examples": len(examples),
+            "token_budget": TRAIN_TOKEN_BUDGET,
+            "compounding": time_training_epoch(
+                model_path,
+                examples,
+                lambda examples: minibatch(examples, compounding(32, 128, 1.002)),
+            ),
+            "bucketed": time_training_epoch(
+                model_path,
+                examples,
+                lambda examples: length_bucketed_batches(
+                    examples,
+                    lambda example: len(example.predicted),
+                    TRAIN_TOKEN_BUDGET,
+                    shuffle_seed=0,
+                ),
+            ),
+        },
+    }
+
+
+def pipe_names(model_path: str) -> List[str]:
+    return spacy.load(model_path).pipe_names
+
+
+def time_ml_backend(
+    articles_path: str,
+    model_path: str,
+    onnx_path: Optional[str],
+    limit: int,
+    batch_size: int,
+) -> Tuple[Dict, List, List]:
+    """Times `BertAbbreviationExtractor` with spaCy's transformer, or with an ONNX
+    export of it. Equivalent to `find_abbreviations_batch`. Items are abstracts
+
+    Returns:
+        Tuple[Dict, List, List]: The timings, and the entities and abbreviations
+            found in each abstract
+    """
+    texts = load_texts(articles_path, limit)
+    extractor = BertAbbreviationExtractor(model_path, onnx_path=onnx_path)
+    list(extractor.nlp.pipe(texts[:batch_size]))  # Warm up
+
+    entities = []
+    abbreviations = []
+    start = time.perf_counter()
+    for doc in pipe_length_bucketed(
+        extractor.nlp, texts, extractor.token_budget, max_batch_size=batch_size
+    ):
+        entities.append(
+            [(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents]
+        )
+        abbreviations.append(extractor.abbreviations_from_doc(doc))
+    result = stage_result(len(texts), time.perf_counter() - start)
+
+    return result, entities, abbreviations
+
+
+def entity_parity(reference: List[List], entities: List[List]) -> Dict:
+    """Compares the entities found in each doc against the reference backend's"""
+    num_matched = sum(
+        len(set(expected) & set(found)) for expected, found in zip(reference, entities)
+    )
+    num_expected = sum(map(len, reference))
+    num_found = sum(map(len, entities))
+    return {
+        "identical_docs": sum(
+            expected == found for expected, found in zip(reference, entities)
+        )
+        / max(len(reference), 1),
+        "entity_precision": num_matched / num_found if num_found else 1.0,
+        "entity_recall": num_matched / num_expected if num_expected else 1.0,
+    }
+
+
+def run_onnx_backends(paths: Dict[str, str], args) -> Dict:
+    """Compares the ML extractor on spaCy's transformer against ONNX Runtime, with
+    and without int8 quantization: docs/sec, and whether the same SF/LF entities
+    and abbreviations are found. Needs onnxruntime and a spacy-transformers model,
+    such as the fine-tuned RoBERTa model, passed with --model"""
+    if importlib.util.find_spec("onnxruntime") is None:
+        return {"skipped": "onnxruntime is not installed"}
+    if "transformer" not in run_isolated(pipe_names, paths["model"]):
+        return {"skipped": "the model has no transformer to export"}
+
+    from onnx_inference import export_onnx
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        onnx_paths = {
+            "onnx": str(Path(export_dir) / "model.onnx"),
+            "onnx_int8": str(Path(export_dir) / "model-int8.onnx"),
+        }
+        for backend, onnx_path in onnx_paths.items():
+            quantize = backend == "onnx_int8"
+            # Unchecked: this suite measures how closely the entities agree
+            run_isolated(export_onnx, paths["model"], onnx_path, quantize, None)
+
+        reference, reference_entities, reference_abbreviations = run_isolated(
+            time_ml_backend,
+            paths["articles"],
+            paths["model"],
+            None,
+            args.limit,
+            args.batch_size,
+        )
+        results = {"spacy": reference}
+        for backend, onnx_path in onnx_paths.items():
+            result, entities, abbreviations = run_isolated(
+                time_ml_backend,
+                paths["articles"],
+                paths["model"],
+                onnx_path,
+                args.limit,
+                args.batch_size,
+            )
+            results[backend] = {
+                **result,
+                "model_mb": Path(onnx_path).stat().st_size / 2**20,
+                "speedup": reference["seconds"] / result["seconds"],
+                **entity_parity(reference_entities, entities),
+                "identical_abbreviations": abbreviations == reference_abbreviations,
+            }
+
+    return results
+
+
+class ImportTime(NamedTuple):
+    """One entry of `python -X importtime` output"""
+
+    module: str
+    self_us: int
+    cumulative_us: int
+    # 0 for the modules imported directly, 1 for their imports, and so on
+    depth: int
+
+
+def parse_importtime(stderr: str) -> List[ImportTime]:
+    """Reads every entry of `python -X importtime` output, nested imports
+    included, in the order the imports finished. Nested imports are indented two
+    spaces per level below the import that pulled them in"""
+    entries = []
+    for line in stderr.splitlines():
+        fields = line.split("|")
+        if not line.startswith("import time:") or len(fields) != 3:
+            continue
+        self_us = fields[0][len("import time:") :].strip()
+        cumulative_us = fields[1].strip()
+        if not (self_us.isdigit() and cumulative_us.isdigit()):
+            continue  # The header
+        name = fields[2][1:]
+        module = name.lstrip(" ")
+        depth = (len(name) - len(module)) // 2
+        entries.append(ImportTime(module, int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def top_level_imports(entries: List[ImportTime]) -> Dict[str, str]:
+    """Maps each imported module to the top-level import that first pulled it in.
+    Nested imports finish before the import that needs them, so that is the next
+    entry at depth 0. Each module is imported, and listed, only once"""
+    imported_by: Dict[str, str] = {}
+    top_level = None
+    for entry in reversed(entries):
+        if entry.depth == 0:
+            top_level = entry.module
+        imported_by[entry.module] = top_level
+    return imported_by
+
+
+def time_startup(command: Optional[List[str]], num_runs: int) -> Dict:
+    """Times starting the CLI with a subcommand, up to the point where it would
+    start work, and reports which modules made it slow. Heavy modules are looked
+    for among every module loaded, however indirectly, along with the top-level
+    import that pulled each one in"""
+    if command is None:
+        argv = [sys.executable, "-X", "importtime", "-c", "pass"]
+    else:
+        cli_path = str(Path(__file__).with_name("cli.py"))
+        argv = [sys.executable, "-X", "importtime", cli_path, "--import-only", *command]
+
+    wall_seconds = []
+    for _ in range(num_runs):
+        start = time.perf_counter()
+        process = subprocess.run(argv, capture_output=True, text=True)
+        wall_seconds.append(time.perf_counter() - start)
+        if process.returncode != 0:
+            errors = [
+                line
+                for line in process.stderr.splitlines()
+                if not line.startswith("import time:")
+            ]
+            return {"error": errors[-1] if errors else process.returncode}
+
+    entries = parse_importtime(process.stderr)
+    top_level = [entry for entry in entries if entry.depth == 0]
+    slowest = sorted(top_level, key=lambda entry: -entry.cumulative_us)[:10]
+    imported_by = top_level_imports(entries)
+    heavy_imported_by = {}
+    for module in HEAVY_MODULES:
+        # A failed import is listed too, as when spaCy tries for an optional torch
+        if importlib.util.find_spec(module) is None:
+            continue
+        loaded = [
+            entry.module for entry in entries if entry.module.split(".")[0] == module
+        ]
+        if loaded:
+            heavy_imported_by[module] = imported_by[loaded[0]]
+
+    return {
+        "seconds": min(wall_seconds),
+        "import_seconds": sum(entry.cumulative_us for entry in top_level) / 1e6,
+        "modules_loaded": len(entries),
+        "slowest_imports": {
+            entry.module: entry.cumulative_us / 1e6 for entry in slowest
+        },
+        "heavy_modules": list(heavy_imported_by),
+        "heavy_modules_imported_by": heavy_imported_by,
+    }
+
+
+def run_startup(paths: Dict[str, str], args) -> Dict:
+    """Times how long each CLI subcommand takes to start, with
+    `python -X importtime`. Subcommands only import what they run, so e.g. the
+    regex rule-based extractor starts without spaCy or torch"""
+    return {
+        name: time_startup(command, STARTUP_RUNS)
+        for name, command in STARTUP_COMMANDS.items()
+    }
+
+
+def run_stages(paths: Dict[str, str], args) -> Dict:
+    """Runs each pipeline stage's benchmark in its own process"""
+    return {
+        "load_articles": run_isolated(benchmark_load_articles, paths["articles"]),
+        "clean_data": run_isolated(benchmark_clean_data, paths["articles"]),
+        "simple_extractor": run_isolated(
+            benchmark_simple_extractor, paths["articles"], args.limit, args.batch_size
+        ),
+        "match_abbreviation": run_isolated(
+            benchmark_match_abbreviation, args.match_calls
+        ),
+        "bert_extractor": run_isolated(
+            benchmark_bert_extractor,
+            paths["articles"],
+            paths["model"],
+            args.limit,
+            args.batch_size,
+        ),
+        "process_PLOD": run_isolated(benchmark_process_plod, paths["plod"]),
+    }
+
+
+def run_sentence_segmenters(paths: Dict[str, str], args) -> List[Dict]:
+    """Compares the rule-based extractor's sentence segmenter modes"""
+    return [
+        run_isolated(
+            benchmark_simple_extractor,
+            paths["articles"],
+            args.limit,
+            args.batch_size,
+            segmenter,
+        )
+        for segmenter in SENTENCE_SEGMENTERS
+    ]
+
+
+SUITES = {
+    "stages": run_stages,
+    "sentence_segmenters": run_sentence_segmenters,
+    "rule_engines": lambda paths, args: run_isolated(
+        benchmark_rule_engines, paths["articles"], args.limit, args.batch_size
+    ),
+    "result_assembly": lambda paths, args: run_isolated(
+        benchmark_result_assembly, paths["articles"], args.limit, args.batch_size
+    ),
+    "length_bucketing": lambda paths, args: run_isolated(
+        benchmark_length_bucketing,
+        paths["articles"],
+        paths["plod"],
+        paths["model"],
+        args.limit,
+        args.batch_size,
+    ),
+    "output_layouts": lambda paths, args: run_isolated(
+        benchmark_output_layouts, paths["articles"], args.limit, args.batch_size
+    ),
+    "onnx_backend": run_onnx_backends,
+    "startup": run_startup,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the extraction pipeline. Runs offline on CPU, on a "
+        "synthetic fixture corpus unless input files are given"
+    )
+    parser.add_argument("--articles", help="MEDLINE XML file (default: synthetic)")
+    parser.add_argument("--plod", help="PLOD TSV file (default: synthetic)")
+    parser.add_argument("--model", help="spaCy NER model (default: tiny stand-in)")
+    parser.add_argument("--num-articles", type=int, default=2000)
+    parser.add_argument("--num-segments", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--match-calls", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=EXTRACTION_BATCH_SIZE)
+    parser.add_argument("--suites", nargs="+", choices=SUITES, default=list(SUITES))
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as fixture_dir:
+        paths = write_fixture_corpus(fixture_dir, args.num_articles, args.num_segments)
+        paths.update(
+            {
+                name: path
+                for name, path in [
+                    ("articles", args.articles),
+                    ("plod", args.plod),
+                    ("model", args.model),
+                ]
+                if path is not None
+            }
+        )
+
+        results = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "spacy": spacy.__version__,
+            "platform": platform.platform(),
+            "settings": vars(args),
+            **{suite: SUITES[suite](paths, args) for suite in args.suites},
+        }
+
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(results, indent=2))
@@ -0,0 +1,208 @@
+from hashlib import sha256
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+import json
+import sqlite3
+import time
+
+
+from config import EXTRACTION_BATCH_SIZE, RESULT_CACHE_MAX_MB
+from results import Abbreviation, to_array
+
+# SQLite's default limit on the number of parameters in a single query
+MAX_QUERY_PARAMETERS = 900
+
+CREATE_RESULTS_TABLE = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    abbreviations TEXT NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID
+"""
+CREATE_LAST_USED_INDEX = """
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)
+"""
+
+
+# Bumped whenever the stored rows change shape, so older results are not reused
+RESULT_FORMAT = "2"
+
+
+def cache_key(extractor_version: str, text: str) -> str:
+    """Content address of an extractor's result for a text"""
+    key = f"{RESULT_FORMAT}\x00{extractor_version}\x00{text}"
+    return sha256(key.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of extractor results, stored in SQLite and addressed by the
+    hash of the abstract text and the extractor version. Once the database grows
+    past `max_mb`, the least recently used results are evicted.
+
+    Several processes can share a cache; SQLite serialises their writes.
+    """
+
+    def __init__(self, path: str, max_mb: int = RESULT_CACHE_MAX_MB) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # The pipeline creates caches on the main thread and uses them from an
+        # extractor's thread, one thread at a time
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(CREATE_RESULTS_TABLE)
+        self.connection.execute(CREATE_LAST_USED_INDEX)
+        self.connection.commit()
+
+        self.max_bytes = max_mb * 2**20
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[Abbreviation]]:
+        """Looks up cached results, marking the ones found as recently used
+
+        Args:
+            keys (List[str]): The cache keys to look up
+
+        Returns:
+            Dict[str, List[Abbreviation]]: The cached results that were found
+        """
+        found = {}
+        for start in range(0, len(keys), MAX_QUERY_PARAMETERS):
+            batch = keys[start : start + MAX_QUERY_PARAMETERS]
+            rows = self.connection.execute(
+                "SELECT key, abbreviations FROM results "
+                f"WHERE key IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            for key, abbreviations in rows:
+                found[key] = [
+                    Abbreviation(*abbrev) for abbrev in json.loads(abbreviations)
+                ]
+
+        if found:
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE results SET last_used = ? WHERE key = ?",
+                    ((time.time(), key) for key in found),
+                )
+
+        num_hits = sum(key in found for key in keys)
+        self.hits += num_hits
+        self.misses += len(keys) - num_hits
+        return found
+
+    def put_many(self, results: Dict[str, List[Abbreviation]]) -> None:
+        """Stores results, then evicts old ones if the cache is over its size"""
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                (
+                    (key, json.dumps(abbreviations), now)
+                    for key, abbreviations in results.items()
+                ),
+            )
+        self.evict()
+
+    def size_bytes(self) -> int:
+        """The space used by the database, excluding pages freed by evictions"""
+        page_size = self.connection.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self.connection.execute("PRAGMA page_count").fetchone()[0]
+        free_pages = self.connection.execute("PRAGMA freelist_count").fetchone()[0]
+        return (page_count - free_pages) * page_size
+
+    def evict(self) -> None:
+        """Deletes the least recently used tenth of the results until the cache is
+        back under its size limit"""
+        while self.size_bytes() > self.max_bytes:
+            num_results = self.connection.execute(
+                "SELECT COUNT(*) FROM results"
+            ).fetchone()[0]
+            if num_results == 0:
+                return
+
+            with self.connection:
+                deleted = self.connection.execute(
+                    "DELETE FROM results WHERE key IN ("
+                    "SELECT key FROM results ORDER BY last_used LIMIT ?)",
+                    (max(1, num_results // 10),),
+                ).rowcount
+            self.evictions += deleted
+
+    def stats(self) -> Dict[str, float]:
+        """Hit and miss counters for this process"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class CachedExtractor:
+    """Wraps an abbreviation extractor so that texts it has already processed are
+    answered from the result cache rather than being re-parsed. Results are keyed
+    on the wrapped extractor's `version`, so changing the model or its settings
+    never returns stale output.
+
+    Args:
+        extractor: The extractor to wrap
+        cache (ResultCache): Where results are stored
+    """
+
+    def __init__(self, extractor, cache: ResultCache) -> None:
+        self.extractor = extractor
+        self.cache = cache
+        self.version = extractor.version
+
+    def find_abbreviations_batch(
+        self, texts: Iterable[str], batch_size: int = EXTRACTION_BATCH_SIZE
+    ) -> Iterator[List[Abbreviation]]:
+        """Cached equivalent of the wrapped extractor's `find_abbreviations_batch`.
+        Texts are looked up a block at a time, and only the misses are passed on
+        to the extractor
+
+        Yields:
+            List[Abbreviation]: The abbreviations found in each text, in order
+        """
+        block: List[str] = []
+        for text in texts:
+            block.append(text)
+            if len(block) >= MAX_QUERY_PARAMETERS:
+                yield from self.find_block(block, batch_size)
+                block = []
+
+        if block:
+            yield from self.find_block(block, batch_size)
+
+    def find_abbreviations(self, text: str):
+        """Cached equivalent of the wrapped extractor's `find_abbreviations`"""
+        key = cache_key(self.version, text)
+        cached: Optional[List[Abbreviation]] = self.cache.get_many([key]).get(key)
+        if cached is None:
+            cached = list(next(self.extractor.find_abbreviations_batch([text])))
+            self.cache.put_many({key: cached})
+        return to_array(cached)
+
+    def find_block(
+        self, texts: List[str], batch_size: int
+    ) -> Iterator[List[Abbreviation]]:
+        keys = [cache_key(self.version, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Texts can repeat within a block, so each missing key is extracted once
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        if missing:
+            extracted = self.extractor.find_abbreviations_batch(
+                missing.values(), batch_size=batch_size
+            )
+            new_results = dict(zip(missing.keys(), map(list, extracted)))
+            self.cache.put_many(new_results)
+            found.update(new_results)
+
+        for key in keys:
+            yield found[key]
@@ -0,0 +1,158 @@
+from hashlib import sha1
+from pathlib import Path
+from typing import Dict, Iterable, List
+import sqlite3
+
+import pandas as pd
+
+# SQLite's default limit on the number of parameters in a single query
+MAX_QUERY_PARAMETERS = 900
+
+CREATE_COMPLETED_TABLE = """
+CREATE TABLE IF NOT EXISTS completed (
+    extractor TEXT NOT NULL,
+    pmid TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    PRIMARY KEY (extractor, pmid)
+) WITHOUT ROWID
+"""
+
+
+def content_hash(article_title, abstract) -> str:
+    """Hashes the article text the extractors read, to detect changed articles"""
+    text = f"{article_title or ''}\x00{abstract or ''}"
+    return sha1(text.encode("utf-8")).hexdigest()
+
+
+class RunManifest:
+    """Records which PMIDs each extractor has finished with, in a small SQLite
+    database, so that interrupted or repeated runs can skip work already done.
+
+    Articles are marked done only after their output has been written. A crash
+    between the two re-processes the last chunk, so output is at-least-once.
+    """
+
+    def __init__(self, path: str) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(CREATE_COMPLETED_TABLE)
+        self.connection.commit()
+
+    def reset(self, extractor: str) -> None:
+        """Forgets all completed PMIDs for an extractor, for a fresh run"""
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM completed WHERE extractor = ?", (extractor,)
+            )
+
+    def completed_hashes(self, extractor: str, pmids: Iterable[str]) -> Dict[str, str]:
+        """Looks up the content hash recorded for each completed PMID
+
+        Args:
+            extractor (str): The extractor's manifest key
+            pmids (Iterable[str]): The PMIDs to look up
+
+        Returns:
+            Dict[str, str]: The recorded content hash of each PMID that is done
+        """
+        pmids = list(pmids)
+        hashes = {}
+        for start in range(0, len(pmids), MAX_QUERY_PARAMETERS):
+            batch = pmids[start : start + MAX_QUERY_PARAMETERS]
+            rows = self.connection.execute(
+                "SELECT pmid, content_hash FROM completed "
+                f"WHERE extractor = ? AND pmid IN ({','.join('?' * len(batch))})",
+                (extractor, *batch),
+            )
+            hashes.update(rows)
+        return hashes
+
+    def mark_done(self, extractor: str, pmids: List[str], hashes: List[str]) -> None:
+        """Records that the articles have been processed and their output written"""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO completed VALUES (?, ?, ?)",
+                ((extractor, pmid, hash_) for pmid, hash_ in zip(pmids, hashes)),
+            )
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class ExtractorCheckpoint:
+    """An extractor's view of the run manifest
+
+    Args:
+        manifest (RunManifest): The shared run manifest
+        extractor (str): The key the extractor's progress is recorded under
+        incremental (bool): If True, articles whose title or abstract changed since
+            they were processed are done again. Otherwise every completed PMID is
+            skipped
+    """
+
+    def __init__(
+        self, manifest: RunManifest, extractor: str, incremental: bool = False
+    ) -> None:
+        self.manifest = manifest
+        self.extractor = extractor
+        self.incremental = incremental
+        self.num_skipped = 0
+
+    def pending(self, cleaned_articles: pd.DataFrame) -> pd.DataFrame:
+        """Filters a chunk of articles down to those still to be processed
+
+        Args:
+            cleaned_articles (pd.DataFrame): A chunk of cleaned articles
+
+        Returns:
+            pd.DataFrame: The articles that are new, or changed in incremental mode
+        """
+        completed = self.manifest.completed_hashes(
+            self.extractor, cleaned_articles["PMID"]
+        )
+
+        if self.incremental:
+            hashes = self.hashes(cleaned_articles)
+            is_pending = [
+                completed.get(pmid) != hash_
+                for pmid, hash_ in zip(cleaned_articles["PMID"], hashes)
+            ]
+        else:
+            is_pending = ~cleaned_articles["PMID"].isin(list(completed))
+
+        pending_articles = cleaned_articles[is_pending]
+        self.num_skipped += len(cleaned_articles) - len(pending_articles)
+        return pending_articles
+
+    def superseded(self, cleaned_articles: pd.DataFrame) -> List[str]:
+        """The PMIDs in a chunk of pending articles that already have output, from
+        an earlier version of the article. Their old rows are removed before the
+        new ones are written, see `sinks.OutputSink.remove_pmids`
+
+        Args:
+            cleaned_articles (pd.DataFrame): A chunk of articles from `pending`
+
+        Returns:
+            List[str]: The PMIDs whose earlier output is now stale
+        """
+        completed = self.manifest.completed_hashes(
+            self.extractor, cleaned_articles["PMID"]
+        )
+        return [pmid for pmid in cleaned_articles["PMID"] if pmid in completed]
+
+    def mark_done(self, cleaned_articles: pd.DataFrame) -> None:
+        """Records a chunk of articles as processed, once its output is written"""
+        self.manifest.mark_done(
+            self.extractor,
+            list(cleaned_articles["PMID"]),
+            self.hashes(cleaned_articles),
+        )
+
+    @staticmethod
+    def hashes(cleaned_articles: pd.DataFrame) -> List[str]:
+        return [
+            content_hash(article_title, abstract)
+            for article_title, abstract in zip(
+                cleaned_articles["article_title"], cleaned_articles["abstract"]
+            )
+        ]
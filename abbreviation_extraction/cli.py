@@ -0,0 +1,218 @@
+from functools import partial
+from typing import Callable, List, Optional
+import argparse
+import importlib
+
+from config import COMPACT_IOB_DATA_PATH, FULL_IOB_DATA_PATH, INDIVIDUAL_IOB_DATA_PATHS
+from config import METRICS_PATH, NUM_WORKERS, OUTPUT_LAYOUT, SIMPLE_RULE_ENGINE
+from config import EVAL_BATCH_SIZE, EVAL_EVERY, EVAL_LIMIT, ML_ONNX_PATH, USE_GPU
+
+# This module is imported before every subcommand, so it only imports the
+# standard library and config. Each subcommand's loader imports what it needs
+
+# Implementations of the rule-based extractor, as (module, class). The spaCy
+# engine's module loads spaCy, so engines are only imported once chosen
+RULE_ENGINES = {
+    "spacy": ("models", "SimpleAbbreviationExtractor"),
+    "regex": ("rules", "RegexAbbreviationExtractor"),
+}
+
+
+def rule_engine(engine: str):
+    """Imports and returns the rule-based extractor class of an engine"""
+    module_name, class_name = RULE_ENGINES[engine]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def load_extraction(args) -> Callable[[], None]:
+    """Loads the extraction subcommands: the pipeline, and only the extractors
+    they run"""
+    from main import run_extraction
+
+    if "rule_based" in args.extractors:
+        rule_engine(args.engine)
+    if "ml_based" in args.extractors:
+        import models  # noqa: F401
+
+    return partial(run_extraction, args)
+
+
+def load_training(args) -> Callable[[], None]:
+    from train import train
+
+    return partial(
+        train,
+        use_gpu=args.gpu,
+        eval_batch_size=args.eval_batch_size,
+        eval_limit=args.eval_limit or None,
+        eval_every=args.eval_every,
+    )
+
+
+def load_conll_prep(args) -> Callable[[], None]:
+    from data import concat_conll_files
+
+    return partial(
+        concat_conll_files,
+        FULL_IOB_DATA_PATH,
+        INDIVIDUAL_IOB_DATA_PATHS,
+        COMPACT_IOB_DATA_PATH if args.compact else None,
+    )
+
+
+def add_extraction_arguments(parser: argparse.ArgumentParser) -> None:
+    """Options shared by every extraction subcommand"""
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip articles a previous run already processed, appending to its output",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only process articles that are new or changed since the last run",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Reuse results for abstracts already processed by the same extractor",
+    )
+    parser.add_argument(
+        "--metrics",
+        default=METRICS_PATH,
+        help="Write per-stage timings to this file (.json, or .prom for Prometheus)",
+    )
+    parser.add_argument(
+        "--dictionary",
+        action="store_true",
+        help="Also build a short form -> long form dictionary from each output",
+    )
+    parser.add_argument(
+        "--propagate",
+        choices=["document", "corpus"],
+        help="Also resolve later mentions of short forms defined in the same "
+        "abstract, or also anywhere in the dictionaries of a previous run",
+    )
+    parser.add_argument(
+        "--layout",
+        choices=["full", "offsets"],
+        default=OUTPUT_LAYOUT,
+        help="Repeat each row's sentence, or locate it by PMID, sentence index "
+        "and character offsets instead",
+    )
+    parser.add_argument(
+        "--sentences",
+        action="store_true",
+        help="With --layout offsets, also write each sentence's text once to a "
+        "sentence table",
+    )
+
+
+def add_rule_based_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=NUM_WORKERS,
+        help="Number of processes for the rule-based extractor",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=RULE_ENGINES.keys(),
+        default=SIMPLE_RULE_ENGINE,
+        help="Implementation of the rule-based extractor",
+    )
+
+
+def add_gpu_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--gpu",
+        action="store_true",
+        default=USE_GPU,
+        help="Run the transformer on the GPU, if one is available",
+    )
+
+
+def add_onnx_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--onnx",
+        default=ML_ONNX_PATH,
+        metavar="PATH",
+        help="Run the ML extractor's transformer from this ONNX export, on the CPU. "
+        "See onnx_inference.py",
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Abbreviation extraction: extract, train and prepare data"
+    )
+    # Stops once the subcommand's imports are done, for the startup benchmark
+    parser.add_argument("--import-only", action="store_true", help=argparse.SUPPRESS)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract = commands.add_parser(
+        "extract", help="Run both extractors over the articles in one pass"
+    )
+    add_rule_based_arguments(extract)
+    add_gpu_argument(extract)
+    add_onnx_argument(extract)
+    add_extraction_arguments(extract)
+    extract.set_defaults(load=load_extraction, extractors=["rule_based", "ml_based"])
+
+    rule_based = commands.add_parser(
+        "rule-based", help="Run only the rule-based extractor. Loads no ML model"
+    )
+    add_rule_based_arguments(rule_based)
+    add_extraction_arguments(rule_based)
+    rule_based.set_defaults(load=load_extraction, extractors=["rule_based"])
+
+    ml = commands.add_parser("ml", help="Run only the ML extractor")
+    add_gpu_argument(ml)
+    add_onnx_argument(ml)
+    add_extraction_arguments(ml)
+    ml.set_defaults(load=load_extraction, extractors=["ml_based"])
+
+    train = commands.add_parser("train", help="Fine-tune the ML model on PLOD")
+    add_gpu_argument(train)
+    train.add_argument(
+        "--eval-batch-size",
+        type=int,
+        default=EVAL_BATCH_SIZE,
+        help="Docs per batch when evaluating",
+    )
+    train.add_argument(
+        "--eval-limit",
+        type=int,
+        default=EVAL_LIMIT,
+        help="Validate on a fixed sample of this many dev docs. 0 uses them all",
+    )
+    train.add_argument(
+        "--eval-every",
+        type=int,
+        default=EVAL_EVERY,
+        help="Validate every this many epochs, and after the last",
+    )
+    train.set_defaults(load=load_training)
+
+    prep_conll = commands.add_parser(
+        "prep-conll", help="Concatenate the PLOS CoNLL splits"
+    )
+    prep_conll.add_argument(
+        "--compact",
+        action="store_true",
+        help="Also write a memory-mappable copy to `compact_iob_data_path`",
+    )
+    prep_conll.set_defaults(load=load_conll_prep)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = build_parser().parse_args(argv)
+    run = args.load(args)
+    if not args.import_only:
+        run()
+
+
+if __name__ == "__main__":
+    main()
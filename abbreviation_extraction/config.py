@@ -1,10 +1,18 @@
+import os
+
 from environs import Env
 
 env = Env()
 
 ARTICLE_READ_PATH = env("article_read_path", "data/raw/articles.xml")
+# Number of articles held in memory at once when streaming the XML
+ARTICLE_CHUNK_SIZE = env.int("article_chunk_size", 10000)
 
 FULL_IOB_DATA_PATH = env("full_iob_data_path", "data/processed/PLOD_IOB_tagged.conll")
+# Memory-mappable copy of the above, written by `data.py --compact`
+COMPACT_IOB_DATA_PATH = env(
+    "compact_iob_data_path", "data/processed/PLOD_IOB_tagged.compact"
+)
 
 INDIVIDUAL_IOB_DATA_PATHS = env(
     "individual_iob_data_paths",
@@ -15,7 +23,16 @@ INDIVIDUAL_IOB_DATA_PATHS = env(
     ],
 )
 
-SIMPLE_OUTPUT_PATH = env("simple_output_path", "data/out/rule_based_abbreviations.tsv")
+# Output format: "tsv", "parquet" (a directory of part files) or "arrow" (an
+# Arrow IPC stream). Sets the default extension of the output paths
+OUTPUT_FORMAT = env("output_format", "tsv")
+OUTPUT_EXTENSION = {"tsv": ".tsv", "parquet": ".parquet", "arrow": ".arrows"}.get(
+    OUTPUT_FORMAT, ""
+)
+
+SIMPLE_OUTPUT_PATH = env(
+    "simple_output_path", f"data/out/rule_based_abbreviations{OUTPUT_EXTENSION}"
+)
 TARGET_ELEMENTS = env(
     "target_elements",
     {
@@ -25,8 +42,111 @@ TARGET_ELEMENTS = env(
     },
 )
 
+# Number of article chunks each stage of the pipeline can queue up before the
+# stage feeding it waits, see pipeline.run_pipeline
+PIPELINE_QUEUE_SIZE = env.int("pipeline_queue_size", 2)
+
+# Number of abstracts passed through nlp.pipe at a time by the extractors
+EXTRACTION_BATCH_SIZE = env.int("extraction_batch_size", 64)
+
+# Transformer batches group docs of similar length, up to this many tokens
+# including padding, rather than a fixed number of docs. Docs are sorted by length
+# `bucket_window` at a time, see batching.length_bucketed_batches. At inference a
+# window also stops at `bucket_window_tokens` tokens, which bounds the processed
+# docs (and their transformer output) held back to restore the input order
+TRAIN_TOKEN_BUDGET = env.int("train_token_budget", 4096)
+INFERENCE_TOKEN_BUDGET = env.int("inference_token_budget", 8192)
+BUCKET_WINDOW = env.int("bucket_window", 1024)
+BUCKET_WINDOW_TOKENS = env.int("bucket_window_tokens", 65536)
+
+# Sentence boundaries for the rule-based extractor. One of "full", "parser",
+# "senter" or "sentencizer", see models.load_rule_based_pipeline
+SIMPLE_SENTENCE_SEGMENTER = env("simple_sentence_segmenter", "full")
+
+# Rule-based engine: "spacy" (SimpleAbbreviationExtractor) or "regex"
+# (rules.RegexAbbreviationExtractor, for bulk runs). The regex engine follows
+# spaCy's tokenizer and sentencizer, and its rows match the "sentencizer"
+# segmenter's on the reference abstracts in tests/test_rules.py. It doesn't split
+# after abbreviations such as "et al." or "Fig.", where the sentencizer does, and
+# a statistical segmenter such as "full" can split sentences differently
+SIMPLE_RULE_ENGINE = env("simple_rule_engine", "spacy")
+# Whether the regex engine also matches <short form> (<long form>)
+SIMPLE_SHORT_FORM_FIRST = env.bool("simple_short_form_first", False)
+
+# If set, per-stage timings are collected and written here at the end of a run,
+# as JSON or, for paths ending in .prom, in the Prometheus text format
+METRICS_PATH = env("metrics_path", "")
+
+# Number of processes used by the rule-based extractor. 1 runs in-process
+NUM_WORKERS = env.int("num_workers", 1)
+
+# SQLite manifest of the PMIDs each extractor has completed, for resumable runs
+MANIFEST_PATH = env("manifest_path", "data/out/manifest.sqlite")
+
+# On-disk cache of extractor results, keyed by abstract text and extractor version
+RESULT_CACHE_PATH = env("result_cache_path", "data/cache/results.sqlite")
+RESULT_CACHE_MAX_MB = env.int("result_cache_max_mb", 1024)
+
 MODEL_READ_PATH = env("model_read_path", "models/roberta-abbrev-identifier")
-ML_OUTPUT_PATH = env("ml_output_path", "data/out/ml_based_abbreviations.tsv")
+
+# Whether the transformer runs on the GPU (if there is one) by default, for
+# extraction and training. The CLI's --gpu flag turns it on per run
+USE_GPU = env.bool("use_gpu", False)
+
+# An ONNX export of the ML model's transformer for extraction to run on the CPU
+# instead, see onnx_inference.py. Empty runs the spaCy transformer. The CLI's
+# --onnx flag sets it per run. Needs requirements-onnx.txt
+ML_ONNX_PATH = env("ml_onnx_path", "")
+# Threads per operator for the ONNX Runtime backend. 0 uses the default
+ONNX_NUM_THREADS = env.int("onnx_num_threads", 0)
+# Abstracts from `article_read_path` an export must tag exactly as the spaCy
+# transformer does, on top of onnx_inference.CHECK_TEXTS
+ONNX_CHECK_ARTICLES = env.int("onnx_check_articles", 200)
+
+# Whether the ML extractor skips abstracts without candidate parentheses. Faster,
+# but drops abbreviations the model would find without them
+ML_PREFILTER = env.bool("ml_prefilter", False)
+# Whether the rule-based extractors skip abstracts and sentences without candidate
+# parentheses. They can't match there, so this only changes speed. Turn it off to
+# time the unfiltered baseline
+SIMPLE_PREFILTER = env.bool("simple_prefilter", True)
+
+# Extraction service (service.py). Listens on the Unix socket if one is given.
+# Concurrent requests are batched together, up to `service_max_batch_size`
+# abstracts or `service_max_wait_ms` after the first one arrives
+SERVICE_HOST = env("service_host", "127.0.0.1")
+SERVICE_PORT = env.int("service_port", 8080)
+SERVICE_SOCKET = env("service_socket", "")
+SERVICE_MAX_BATCH_SIZE = env.int("service_max_batch_size", EXTRACTION_BATCH_SIZE)
+SERVICE_MAX_WAIT_MS = env.float("service_max_wait_ms", 10)
+ML_OUTPUT_PATH = env(
+    "ml_output_path", f"data/out/ml_based_abbreviations{OUTPUT_EXTENSION}"
+)
+
+# Output layout: "full" repeats each row's sentence, "offsets" gives its PMID,
+# sentence index and character offsets instead, see results.OffsetAbbreviationTable.
+# With `--sentences`, the offsets layout's sentence tables are written here
+OUTPUT_LAYOUT = env("output_layout", "full")
+SIMPLE_SENTENCES_OUTPUT_PATH = env(
+    "simple_sentences_output_path", f"data/out/rule_based_sentences{OUTPUT_EXTENSION}"
+)
+ML_SENTENCES_OUTPUT_PATH = env(
+    "ml_sentences_output_path", f"data/out/ml_based_sentences{OUTPUT_EXTENSION}"
+)
+
+# Short form -> long form dictionaries built from each extractor's output when
+# main.py is run with --dictionary, see dictionary.AbbreviationDictionary
+SIMPLE_DICTIONARY_PATH = env(
+    "simple_dictionary_path", "data/out/rule_based_dictionary.sqlite"
+)
+ML_DICTIONARY_PATH = env("ml_dictionary_path", "data/out/ml_based_dictionary.sqlite")
+
+# With `main.py --propagate corpus`, short forms are resolved corpus-wide to their
+# most frequent long form in the dictionaries above, if found at least this often
+PROPAGATION_MIN_FREQUENCY = env.int("propagation_min_frequency", 2)
+# Short forms shorter than this, or that are common words in capitals such as "NO"
+# or "IT", are only resolved in abstracts that define them, never corpus-wide
+PROPAGATION_MIN_SHORT_FORM_LENGTH = env.int("propagation_min_short_form_length", 3)
 
 TESTFLAG = env("testflag", False)
 
@@ -34,5 +154,16 @@ TRAINED_MODEL_OUTPUT_PATH = env(
     "trained_model_output_path", "models/new-roberta-abbrev-identifier"
 )
 PLOD_LOCATION = env("plod_location", "data/raw/PLOD_filtered.tsv")
+# Preprocessed PLOD train/dev/test DocBin shards, rebuilt if the TSV is newer
+PLOD_CORPUS_DIR = env("plod_corpus_dir", "data/processed/PLOD_corpus")
+CORPUS_SHARD_SIZE = env.int("corpus_shard_size", 5000)
+PREP_WORKERS = env.int("prep_workers", os.cpu_count() or 1)
 
 NUM_EPOCHS = env("num_epochs", 4)
+
+# Validation during training, see evaluation.CachedEvaluator. The dev split is
+# evaluated every `eval_every` epochs and after the last, on a fixed sample of
+# `eval_limit` docs (0 for all of it), `eval_batch_size` docs at a time
+EVAL_BATCH_SIZE = env.int("eval_batch_size", 64)
+EVAL_LIMIT = env.int("eval_limit", 0)
+EVAL_EVERY = env.int("eval_every", 1)
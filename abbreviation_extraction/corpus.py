@@ -0,0 +1,257 @@
+from collections import deque
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+import json
+import random
+
+import pandas as pd
+import spacy
+from spacy.language import Language
+from spacy.tokens import DocBin
+from spacy.training import Example
+from tqdm import tqdm
+
+from config import CORPUS_SHARD_SIZE, PLOD_CORPUS_DIR, PLOD_LOCATION, PREP_WORKERS
+from config import TESTFLAG
+from utils import format_PLOD
+
+# Fractions of PLOD used for training and validation, the rest is for testing.
+# Matches train.py's original 70/15/15 split. Segments are assigned at random as
+# the TSV is read, so split sizes are only approximately these fractions
+TRAIN_FRACTION = 0.7
+DEV_FRACTION = 0.15
+SPLITS = ("train", "dev", "test")
+
+# Really quick dirty hack for the purposes of local testing
+TEST_LIMIT = 10000
+
+# Shards queued in the pool per worker. Bounds how much of the TSV is held in
+# memory while the workers catch up with the reader
+SHARDS_IN_FLIGHT_PER_WORKER = 2
+
+# Alignment counts kept for each split, see `build_shard`
+COUNTS = ("written", "malformed", "overlapping", "misaligned")
+
+# Each prep worker's tokenizer, built once in `init_worker`
+_worker_nlp = None
+
+
+def init_worker(lang: str) -> None:
+    """Pool initializer. en_core_web_trf uses the default tokenizer for its
+    language, so a blank pipeline tokenizes identically without loading the
+    transformer weights in every worker"""
+    global _worker_nlp
+    _worker_nlp = spacy.blank(lang)
+
+
+def build_shard(task: Tuple[str, pd.DataFrame]) -> Dict[str, int]:
+    """Parses, tokenizes and aligns a shard of PLOD segments, and writes their
+    reference docs to a DocBin
+
+    Args:
+        task (Tuple[str, pd.DataFrame]): The shard's output path, and its rows of
+            the PLOD TSV
+
+    Returns:
+        Dict[str, int]: How many segments were written, dropped for malformed
+            index columns or overlapping entities, or written with misaligned
+            entities marked as missing
+    """
+    shard_path, rows = task
+    formatted_data = format_PLOD(rows)
+    counts = dict.fromkeys(COUNTS, 0)
+    counts["malformed"] = len(rows) - len(formatted_data)
+    doc_bin = DocBin()
+
+    for text, annots in formatted_data:
+        try:
+            example = Example.from_dict(_worker_nlp.make_doc(text), annots)
+        except ValueError:
+            counts["overlapping"] += 1
+            continue
+
+        # Entities that don't line up with token boundaries become missing labels
+        if any(token.ent_iob == 0 for token in example.reference):
+            counts["misaligned"] += 1
+        doc_bin.add(example.reference)
+        counts["written"] += 1
+
+    doc_bin.to_disk(shard_path)
+    return counts
+
+
+def split_rows(rows: pd.DataFrame, rng: random.Random) -> Dict[str, pd.DataFrame]:
+    """Assigns each row to the train, dev or test split at random, in the
+    `TRAIN_FRACTION` and `DEV_FRACTION` proportions"""
+    dev_start = TRAIN_FRACTION
+    test_start = TRAIN_FRACTION + DEV_FRACTION
+    draws = pd.Series([rng.random() for _ in range(len(rows))], index=rows.index)
+    return {
+        "train": rows[draws < dev_start],
+        "dev": rows[(draws >= dev_start) & (draws < test_start)],
+        "test": rows[draws >= test_start],
+    }
+
+
+def iter_shard_tasks(
+    plod_path: str,
+    output_dir: str,
+    shard_size: int,
+    limit: Optional[int],
+    seed: int,
+) -> Iterator[Tuple[str, Tuple[str, pd.DataFrame]]]:
+    """Streams the PLOD TSV `shard_size` rows at a time, splitting the rows as
+    they are read and yielding each shard as soon as it is full. Only the rows of
+    partly filled shards are held in between
+
+    Args:
+        plod_path (str): file location of PLOD dataset TSV
+        output_dir (str): Directory the `<split>/<shard>.spacy` files go in
+        shard_size (int): The maximum number of rows per shard
+        limit (Optional[int]): Only read the first `limit` rows
+        seed (int): Seed for the split assignment
+
+    Yields:
+        Tuple[str, Tuple[str, pd.DataFrame]]: The shard's split, and its
+            `build_shard` task
+    """
+    rng = random.Random(seed)
+    buffered = {split: [] for split in SPLITS}
+    num_shards = dict.fromkeys(SPLITS, 0)
+
+    def shard_task(split: str, rows: pd.DataFrame):
+        shard_path = str(Path(output_dir) / split / f"{num_shards[split]:05d}.spacy")
+        num_shards[split] += 1
+        return split, (shard_path, rows)
+
+    for chunk in pd.read_csv(
+        plod_path, encoding="utf-8", sep="\t", chunksize=shard_size, nrows=limit
+    ):
+        # Lowercase columns for easier manipulation
+        chunk.columns = chunk.columns.str.lower()
+        for split, rows in split_rows(chunk, rng).items():
+            rows = pd.concat([*buffered[split], rows])
+            while len(rows) >= shard_size:
+                yield shard_task(split, rows.iloc[:shard_size])
+                rows = rows.iloc[shard_size:]
+            buffered[split] = [rows]
+
+    for split, pieces in buffered.items():
+        rows = pd.concat(pieces) if pieces else None
+        if rows is not None and len(rows):
+            yield shard_task(split, rows)
+
+
+def prepare_corpus(
+    plod_path: str = PLOD_LOCATION,
+    output_dir: str = PLOD_CORPUS_DIR,
+    workers: int = PREP_WORKERS,
+    shard_size: int = CORPUS_SHARD_SIZE,
+    limit: Optional[int] = None,
+    seed: int = 0,
+    lang: str = "en",
+) -> Dict:
+    """Preprocesses PLOD into train, dev and test DocBin shards on disk. The TSV
+    is read in chunks, and each shard is parsed, tokenized and aligned in a
+    process pool as soon as it fills, so the whole dataset is never in memory.
+    Shards hold segments in file order; training shuffles within and across them
+
+    Args:
+        plod_path (str): file location of PLOD dataset TSV
+        output_dir (str): Directory to write `<split>/<shard>.spacy` files to
+        workers (int): The number of processes to tokenize with
+        shard_size (int): The maximum number of docs per shard
+        limit (Optional[int]): Only use the first `limit` rows
+        seed (int): Seed for the split shuffle
+        lang (str): Language of the tokenizer
+
+    Returns:
+        Dict: The corpus metadata, also written to `meta.json`, including the
+            alignment counts for each split
+    """
+    for split in SPLITS:
+        split_dir = Path(output_dir) / split
+        split_dir.mkdir(parents=True, exist_ok=True)
+        for stale_shard in split_dir.glob("*.spacy"):
+            stale_shard.unlink()
+
+    counts = {split: dict.fromkeys(COUNTS, 0) for split in SPLITS}
+    in_flight: deque = deque()
+
+    def collect_shard():
+        split, result = in_flight.popleft()
+        for name, count in result.get().items():
+            counts[split][name] += count
+        progress.update()
+
+    tasks = iter_shard_tasks(plod_path, output_dir, shard_size, limit, seed)
+    with Pool(workers, initializer=init_worker, initargs=(lang,)) as pool:
+        with tqdm(unit="shard") as progress:
+            for split, task in tasks:
+                in_flight.append((split, pool.apply_async(build_shard, (task,))))
+                if len(in_flight) >= workers * SHARDS_IN_FLIGHT_PER_WORKER:
+                    collect_shard()
+            while in_flight:
+                collect_shard()
+
+    meta = {
+        "source": str(plod_path),
+        "source_mtime": Path(plod_path).stat().st_mtime,
+        "limit": limit,
+        "seed": seed,
+        "counts": counts,
+    }
+    (Path(output_dir) / "meta.json").write_text(json.dumps(meta, indent=2))
+    return meta
+
+
+def is_prepared(
+    output_dir: str = PLOD_CORPUS_DIR,
+    plod_path: str = PLOD_LOCATION,
+    limit: Optional[int] = None,
+    seed: int = 0,
+) -> bool:
+    """Whether the corpus on disk was prepared from the current PLOD TSV with the
+    same settings"""
+    meta_path = Path(output_dir) / "meta.json"
+    if not meta_path.exists():
+        return False
+    meta = json.loads(meta_path.read_text())
+    return (
+        meta["source_mtime"] >= Path(plod_path).stat().st_mtime
+        and meta["limit"] == limit
+        and meta["seed"] == seed
+    )
+
+
+def iter_examples(
+    nlp: Language, split_dir: str, shuffle_seed: Optional[int] = None
+) -> Iterator[Example]:
+    """Streams Examples from a split's DocBin shards, holding one shard in memory
+    at a time. With a seed, shards and the docs within each shard are shuffled
+
+    Args:
+        nlp (Language): The pipeline being trained, used to tokenize the text
+        split_dir (str): The split's shard directory
+        shuffle_seed (Optional[int]): Seed for shuffling, or None to keep the order
+
+    Yields:
+        Example: The split's examples
+    """
+    rng = random.Random(shuffle_seed)
+    shard_paths = sorted(Path(split_dir).glob("*.spacy"))
+    if shuffle_seed is not None:
+        rng.shuffle(shard_paths)
+
+    for shard_path in shard_paths:
+        references = list(DocBin().from_disk(shard_path).get_docs(nlp.vocab))
+        if shuffle_seed is not None:
+            rng.shuffle(references)
+        for reference in references:
+            yield Example(nlp.make_doc(reference.text), reference)
+
+
+if __name__ == "__main__":
+    meta = prepare_corpus(limit=TEST_LIMIT if TESTFLAG else None)
+    print("Alignment:", json.dumps(meta["counts"], indent=2))
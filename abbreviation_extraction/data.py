@@ -1,67 +1,291 @@
+from array import array
 from pathlib import Path
-import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import sys
 
-from config import FULL_IOB_DATA_PATH, INDIVIDUAL_IOB_DATA_PATHS
+import numpy as np
 
 
-def read_conll(file_path, contains_pos_tags=False):
-    file_path = Path(file_path)
+# A single CoNLL document: its tokens and their tags
+ConllDoc = Tuple[List[str], List[str]]
 
-    raw_text = file_path.read_text(encoding="utf-8").strip()
-    raw_docs = re.split(r"\n\s?\n", raw_text)
+# PLOS tags -> the tags the model is trained on
+TAG_REPLACEMENTS = [("AC", "SF"), ("B-O", "O")]
 
-    token_docs = []
-    tag_docs = []
+# Offsets buffered before being appended to the compact form's files
+FLUSH_SIZE = 65536
+
+# Element types of the compact form's arrays
+OFFSET_DTYPE = np.int64
+TAG_ID_DTYPE = np.uint16
+
+
+def iter_conll(file_path, contains_pos_tags=False) -> Iterator[ConllDoc]:
+    """Streams the documents of a CoNLL file, one at a time. Documents are
+    separated by blank lines
+
+    Args:
+        file_path (str): The CoNLL file
+        contains_pos_tags (bool): Whether each line is `token POS tag` rather than
+            `token tag`
 
-    for doc in raw_docs:
-        tokens = []
-        tags = []
-        for line in doc.split("\n"):
+    Yields:
+        ConllDoc: The tokens and tags of each document
+    """
+    tokens: List[str] = []
+    tags: List[str] = []
+
+    with open(file_path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                if tokens:
+                    yield tokens, tags
+                    tokens, tags = [], []
+                continue
 
             if contains_pos_tags:
-                token, _, tag = line.split()
+                token, _, tag = fields
             else:
-                token, tag = line.split()
+                token, tag = fields
 
             tokens.append(token)
             tags.append(tag)
 
+    if tokens:
+        yield tokens, tags
+
+
+def read_conll(file_path, contains_pos_tags=False):
+    """Reads a whole CoNLL file into memory. See `iter_conll` to stream it
+
+    Returns:
+        Tuple[List[List[str]], List[List[str]]]: The tokens and the tags of every
+            document
+    """
+    token_docs = []
+    tag_docs = []
+
+    for tokens, tags in iter_conll(file_path, contains_pos_tags):
         token_docs.append(tokens)
         tag_docs.append(tags)
 
     return token_docs, tag_docs
 
 
-def concat_conll_files(out, read_file_paths):
-    tokens = []
-    tags = []
-
-    for file_path in read_file_paths:
-        print(file_path)
-        subset_tokens, subset_tags = read_conll(file_path, True)
+def remap_tag(tag: str, replacements: Dict[str, str]) -> str:
+    """Renames a PLOS tag, e.g. `B-AC` -> `B-SF`. Results are memoised in
+    `replacements`, as there are only a handful of distinct tags"""
+    remapped = replacements.get(tag)
+    if remapped is None:
+        remapped = tag
+        for old, new in TAG_REPLACEMENTS:
+            remapped = remapped.replace(old, new)
+        replacements[tag] = remapped
+    return remapped
 
-        tokens += subset_tokens
-        tags += subset_tags
 
-    temp_tags = []
-    for doc_tags in tags:
-        temp_doc_tags = []
-        for tag in doc_tags:
-            temp_doc_tags.append(tag.replace("AC", "SF").replace("B-O", "O"))
-        temp_tags.append(temp_doc_tags)
+def remap_tags(docs: Iterable[ConllDoc]) -> Iterator[ConllDoc]:
+    """Renames the tags of each document as it streams past"""
+    replacements: Dict[str, str] = {}
+    for tokens, tags in docs:
+        yield tokens, [remap_tag(tag, replacements) for tag in tags]
 
-    tags = temp_tags
 
-    per_doc_pairs = list(zip(tokens, tags))
-    per_token_pairs = [list(zip(each[0], each[1])) for each in per_doc_pairs]
+def write_conll(out, docs: Iterable[ConllDoc]) -> int:
+    """Writes documents to a CoNLL file, one `token tag` line per token
 
+    Returns:
+        int: The number of documents written
+    """
+    num_docs = 0
     with open(out, "w", encoding="utf-8") as f:
-        for doc in per_token_pairs:
-            for line in doc:
-                linestr = " ".join(map(str, line))
-                f.write(f"{linestr}\n")
+        for tokens, tags in docs:
+            for token, tag in zip(tokens, tags):
+                f.write(f"{token} {tag}\n")
             f.write("\n")
+            num_docs += 1
+    return num_docs
+
+
+class CompactConllWriter:
+    """Writes documents in a compact binary form that `CompactConll` memory-maps,
+    rather than re-parsing text. The directory holds:
+
+        tokens.bin         The UTF-8 text of every token, back to back
+        token_offsets.bin  The byte offset of each token in tokens.bin, and the end
+        tag_ids.bin        Each token's tag, as an index into meta.json's tags
+        doc_offsets.bin    The index of each document's first token, and the end
+        meta.json          The tag table and the arrays' element types
+
+    Arrays are appended to their files as they fill, so writing takes constant
+    memory. Writers are context managers, finishing the files on exit.
+
+    Args:
+        path (str): The directory to write
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.tag_ids: Dict[str, int] = {}
+
+        self.tokens_file = open(self.path / "tokens.bin", "wb")
+        self.token_offsets_file = open(self.path / "token_offsets.bin", "wb")
+        self.tag_ids_file = open(self.path / "tag_ids.bin", "wb")
+        self.doc_offsets_file = open(self.path / "doc_offsets.bin", "wb")
+
+        self.token_offsets = array("q", [0])
+        self.doc_offsets = array("q", [0])
+        self.doc_tag_ids = array("H")
+        self.num_bytes = 0
+        self.num_tokens = 0
+
+    def write(self, tokens: List[str], tags: List[str]) -> None:
+        """Appends a document"""
+        for token, tag in zip(tokens, tags):
+            encoded = token.encode("utf-8")
+            self.tokens_file.write(encoded)
+            self.num_bytes += len(encoded)
+            self.token_offsets.append(self.num_bytes)
+
+            tag_id = self.tag_ids.get(tag)
+            if tag_id is None:
+                tag_id = self.tag_ids[tag] = len(self.tag_ids)
+            self.doc_tag_ids.append(tag_id)
+
+        self.num_tokens += len(tokens)
+        self.doc_offsets.append(self.num_tokens)
+        if len(self.token_offsets) >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        self.token_offsets.tofile(self.token_offsets_file)
+        self.doc_tag_ids.tofile(self.tag_ids_file)
+        self.doc_offsets.tofile(self.doc_offsets_file)
+        self.token_offsets = array("q")
+        self.doc_tag_ids = array("H")
+        self.doc_offsets = array("q")
+
+    def close(self) -> None:
+        self.flush()
+        for f in (
+            self.tokens_file,
+            self.token_offsets_file,
+            self.tag_ids_file,
+            self.doc_offsets_file,
+        ):
+            f.close()
+
+        meta = {
+            "tags": list(self.tag_ids),
+            "offset_dtype": np.dtype(OFFSET_DTYPE).str,
+            "tag_id_dtype": np.dtype(TAG_ID_DTYPE).str,
+        }
+        (self.path / "meta.json").write_text(json.dumps(meta))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CompactConll:
+    """Read-only, memory-mapped view of documents written by `CompactConllWriter`.
+    Opening it reads nothing but the tag table, and each document is decoded
+    only when it is accessed
+
+    Args:
+        path (str): The directory written by `CompactConllWriter`
+    """
+
+    def __init__(self, path: str) -> None:
+        path = Path(path)
+        meta = json.loads((path / "meta.json").read_text())
+        self.tags: List[str] = meta["tags"]
+
+        self.doc_offsets = self.memmap(path / "doc_offsets.bin", meta["offset_dtype"])
+        self.token_offsets = self.memmap(
+            path / "token_offsets.bin", meta["offset_dtype"]
+        )
+        self.tag_ids = self.memmap(path / "tag_ids.bin", meta["tag_id_dtype"])
+        self.token_bytes = self.memmap(path / "tokens.bin", np.uint8)
+
+    @staticmethod
+    def memmap(path: Path, dtype) -> np.ndarray:
+        # Empty files can't be mapped
+        if path.stat().st_size == 0:
+            return np.empty(0, dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    def __len__(self) -> int:
+        return max(len(self.doc_offsets) - 1, 0)
+
+    def __getitem__(self, index: int) -> ConllDoc:
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        start, end = self.doc_offsets[index], self.doc_offsets[index + 1]
+        offsets = self.token_offsets[start : end + 1]
+        text = self.token_bytes[offsets[0] : offsets[-1]].tobytes()
+
+        base = offsets[0]
+        tokens = [
+            text[token_start - base : token_end - base].decode("utf-8")
+            for token_start, token_end in zip(offsets[:-1], offsets[1:])
+        ]
+        tags = [self.tags[tag_id] for tag_id in self.tag_ids[start:end]]
+        return tokens, tags
+
+    def __iter__(self) -> Iterator[ConllDoc]:
+        for index in range(len(self)):
+            yield self[index]
+
+
+def concat_conll_files(out, read_file_paths, compact_out: Optional[str] = None):
+    """Concatenates the PLOS CoNLL splits into a single file, renaming their tags
+    to the model's. Documents are streamed through one at a time
+
+    Args:
+        out (str): The CoNLL file to write
+        read_file_paths (List[str]): The CoNLL files to read, with POS tags
+        compact_out (Optional[str]): If given, also write the documents in the
+            compact form, see `CompactConllWriter`
+
+    Returns:
+        int: The number of documents written
+    """
+
+    def read_all():
+        for file_path in read_file_paths:
+            print(file_path)
+            yield from iter_conll(file_path, True)
+
+    docs = remap_tags(read_all())
+    if compact_out is None:
+        return write_conll(out, docs)
+
+    with CompactConllWriter(compact_out) as compact_writer:
+
+        def write_compact(docs):
+            for tokens, tags in docs:
+                compact_writer.write(tokens, tags)
+                yield tokens, tags
+
+        return write_conll(out, write_compact(docs))
+
+
+def load_conll(path) -> Iterable[ConllDoc]:
+    """Loads documents from either a CoNLL file (streamed) or the compact form
+    (memory-mapped)"""
+    if Path(path).is_dir():
+        return CompactConll(path)
+    return iter_conll(path)
 
 
 if __name__ == "__main__":
-    concat_conll_files(FULL_IOB_DATA_PATH, INDIVIDUAL_IOB_DATA_PATHS)
+    from cli import main
+
+    main(["prep-conll", *sys.argv[1:]])
@@ -0,0 +1,331 @@
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import argparse
+import sqlite3
+
+import pandas as pd
+
+from metrics import stage
+from results import PROPAGATED, SOURCE_COLUMN
+from sinks import read_output_chunks
+
+# SQLite's default limit on the number of parameters in a single query
+MAX_QUERY_PARAMETERS = 900
+
+CREATE_PAIRS_TABLE = """
+CREATE TABLE IF NOT EXISTS pairs (
+    id INTEGER PRIMARY KEY,
+    short_form TEXT NOT NULL,
+    folded_short_form TEXT NOT NULL,
+    long_form TEXT NOT NULL,
+    frequency INTEGER NOT NULL,
+    first_pmid TEXT NOT NULL,
+    last_pmid TEXT NOT NULL,
+    UNIQUE (short_form, long_form)
+)
+"""
+CREATE_FOLDED_SHORT_FORM_INDEX = """
+CREATE INDEX IF NOT EXISTS pairs_folded_short_form ON pairs (folded_short_form)
+"""
+CREATE_OCCURRENCES_TABLE = """
+CREATE TABLE IF NOT EXISTS occurrences (
+    pair_id INTEGER NOT NULL REFERENCES pairs (id),
+    pmid TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (pair_id, pmid)
+) WITHOUT ROWID
+"""
+CREATE_OCCURRENCES_PMID_INDEX = """
+CREATE INDEX IF NOT EXISTS occurrences_pmid ON occurrences (pmid)
+"""
+
+# PMIDs are stored as text but ordered numerically: shorter PMIDs are smaller
+PMID_BEFORE = """(
+    length({0}) < length({1}) OR (length({0}) = length({1}) AND {0} < {1})
+)"""
+
+UPSERT_PAIR = f"""
+INSERT INTO pairs (
+    short_form, folded_short_form, long_form, frequency, first_pmid, last_pmid
+) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (short_form, long_form) DO UPDATE SET
+    frequency = frequency + excluded.frequency,
+    first_pmid = CASE WHEN {PMID_BEFORE.format("excluded.first_pmid", "first_pmid")}
+        THEN excluded.first_pmid ELSE first_pmid END,
+    last_pmid = CASE WHEN {PMID_BEFORE.format("last_pmid", "excluded.last_pmid")}
+        THEN excluded.last_pmid ELSE last_pmid END
+"""
+
+RECOMPUTE_PMID_RANGE = """
+UPDATE pairs SET
+    first_pmid = (
+        SELECT pmid FROM occurrences WHERE pair_id = pairs.id
+        ORDER BY length(pmid), pmid LIMIT 1
+    ),
+    last_pmid = (
+        SELECT pmid FROM occurrences WHERE pair_id = pairs.id
+        ORDER BY length(pmid) DESC, pmid DESC LIMIT 1
+    )
+WHERE id = ?
+"""
+
+
+class DictionaryEntry(NamedTuple):
+    """A short form -> long form pair, aggregated over every article it was found
+    in. The first and last PMIDs are the lowest and highest, i.e. the earliest and
+    latest articles in PubMed"""
+
+    short_form: str
+    long_form: str
+    frequency: int
+    first_pmid: str
+    last_pmid: str
+
+
+def pmid_order(pmid: str) -> Tuple[int, str]:
+    """Sort key that orders PMIDs numerically, as `PMID_BEFORE` does"""
+    return len(pmid), pmid
+
+
+def fold_case(short_form: str) -> str:
+    """The key short forms are looked up by when ignoring case"""
+    return short_form.casefold()
+
+
+class AbbreviationDictionary:
+    """Indexed short form -> long form dictionary, folded from extractor output
+    chunk by chunk and stored in SQLite. Each pair keeps its frequency, its first
+    and last PMID and the PMIDs it was found in, and short forms are indexed both
+    as-is and case-folded, so lookups don't scan the extractor output.
+
+    Adding a chunk first removes anything previously recorded for its PMIDs, so
+    resumed and incremental runs that re-process articles don't count them twice.
+
+    Dictionaries are context managers, closing themselves on exit.
+
+    Args:
+        path (str): The SQLite database to build or read
+    """
+
+    def __init__(self, path: str) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # The pipeline creates dictionaries on the main thread and adds to them
+        # from a stage's writer thread, one thread at a time
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(CREATE_PAIRS_TABLE)
+        self.connection.execute(CREATE_FOLDED_SHORT_FORM_INDEX)
+        self.connection.execute(CREATE_OCCURRENCES_TABLE)
+        self.connection.execute(CREATE_OCCURRENCES_PMID_INDEX)
+        self.connection.commit()
+
+    def reset(self) -> None:
+        """Forgets every pair, for a fresh run"""
+        with self.connection:
+            self.connection.execute("DELETE FROM occurrences")
+            self.connection.execute("DELETE FROM pairs")
+
+    def add(
+        self, abbreviations: pd.DataFrame, pmids: Optional[Iterable[str]] = None
+    ) -> None:
+        """Folds a chunk of extractor output into the dictionary
+
+        Args:
+            abbreviations (pd.DataFrame): Output in the `get_abbreviations` schema.
+                Rows whose `source` is propagated are not counted
+            pmids (Optional[Iterable[str]]): Every article the chunk covers,
+                including those without abbreviations. Pairs previously recorded
+                for them are replaced. If not given, the chunk is only added
+        """
+        with stage("build_dictionary", len(abbreviations)):
+            # Propagated rows repeat a definition rather than confirm it
+            if SOURCE_COLUMN in abbreviations:
+                abbreviations = abbreviations[
+                    abbreviations[SOURCE_COLUMN] != PROPAGATED
+                ]
+            occurrence_counts = Counter(
+                zip(
+                    abbreviations["short_form"],
+                    abbreviations["long_form"],
+                    abbreviations["PMID"].astype(str),
+                )
+            )
+            pair_pmids: Dict[Tuple[str, str], Dict[str, int]] = defaultdict(dict)
+            for (short_form, long_form, pmid), count in occurrence_counts.items():
+                pair_pmids[short_form, long_form][pmid] = count
+
+            with self.connection:
+                if pmids is not None:
+                    self.remove_pmids([str(pmid) for pmid in pmids])
+                for (short_form, long_form), counts in pair_pmids.items():
+                    self.add_pair(short_form, long_form, counts)
+
+    def add_pair(self, short_form: str, long_form: str, counts: Dict[str, int]):
+        """Adds the occurrences of a pair, per PMID, to its totals"""
+        pmids = sorted(counts, key=pmid_order)
+        self.connection.execute(
+            UPSERT_PAIR,
+            (
+                short_form,
+                fold_case(short_form),
+                long_form,
+                sum(counts.values()),
+                pmids[0],
+                pmids[-1],
+            ),
+        )
+        (pair_id,) = self.connection.execute(
+            "SELECT id FROM pairs WHERE short_form = ? AND long_form = ?",
+            (short_form, long_form),
+        ).fetchone()
+        self.connection.executemany(
+            "INSERT INTO occurrences VALUES (?, ?, ?) "
+            "ON CONFLICT (pair_id, pmid) DO UPDATE SET count = count + excluded.count",
+            ((pair_id, pmid, count) for pmid, count in counts.items()),
+        )
+
+    def remove_pmids(self, pmids: List[str]) -> None:
+        """Subtracts everything recorded for the PMIDs from their pairs. Only pairs
+        that lose a PMID have their PMID range recomputed"""
+        removed: Counter = Counter()
+        for start in range(0, len(pmids), MAX_QUERY_PARAMETERS):
+            batch = pmids[start : start + MAX_QUERY_PARAMETERS]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(
+                "SELECT pair_id, count FROM occurrences "
+                f"WHERE pmid IN ({placeholders})",
+                batch,
+            )
+            for pair_id, count in rows:
+                removed[pair_id] += count
+            self.connection.execute(
+                f"DELETE FROM occurrences WHERE pmid IN ({placeholders})", batch
+            )
+
+        if not removed:
+            return
+        self.connection.executemany(
+            "UPDATE pairs SET frequency = frequency - ? WHERE id = ?",
+            ((count, pair_id) for pair_id, count in removed.items()),
+        )
+        self.connection.executemany(
+            "DELETE FROM pairs WHERE id = ? AND frequency <= 0",
+            ((pair_id,) for pair_id in removed),
+        )
+        self.connection.executemany(
+            RECOMPUTE_PMID_RANGE, ((pair_id,) for pair_id in removed)
+        )
+
+    def lookup(
+        self, short_form: str, ignore_case: bool = False
+    ) -> List[DictionaryEntry]:
+        """Finds the long forms of a short form
+
+        Args:
+            short_form (str): The short form to look up
+            ignore_case (bool): Whether to also match the short form in other
+                cases, e.g. "mRNA" for "MRNA"
+
+        Returns:
+            List[DictionaryEntry]: The matching pairs, most frequent first
+        """
+        column, key = (
+            ("folded_short_form", fold_case(short_form))
+            if ignore_case
+            else ("short_form", short_form)
+        )
+        rows = self.connection.execute(
+            "SELECT short_form, long_form, frequency, first_pmid, last_pmid "
+            f"FROM pairs WHERE {column} = ? ORDER BY frequency DESC, long_form",
+            (key,),
+        )
+        return [DictionaryEntry(*row) for row in rows]
+
+    def most_frequent_long_forms(self, min_frequency: int = 1) -> Dict[str, str]:
+        """The most frequent long form of each short form, e.g. to resolve short
+        forms corpus-wide with `propagation.PropagatingExtractor`
+
+        Args:
+            min_frequency (int): Leave out pairs found fewer times than this
+
+        Returns:
+            Dict[str, str]: The long form of each short form
+        """
+        rows = self.connection.execute(
+            "SELECT short_form, long_form FROM pairs WHERE frequency >= ? "
+            "ORDER BY short_form, frequency DESC, long_form",
+            (min_frequency,),
+        )
+        long_forms: Dict[str, str] = {}
+        for short_form, long_form in rows:
+            long_forms.setdefault(short_form, long_form)
+        return long_forms
+
+    def pmids(self, short_form: str, long_form: str) -> List[str]:
+        """The PMIDs a pair was found in, in numerical order"""
+        rows = self.connection.execute(
+            "SELECT pmid FROM occurrences JOIN pairs ON pairs.id = pair_id "
+            "WHERE short_form = ? AND long_form = ? ORDER BY length(pmid), pmid",
+            (short_form, long_form),
+        )
+        return [pmid for (pmid,) in rows]
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM pairs").fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def build_dictionary(output_path: str, dictionary_path: str) -> int:
+    """Builds a dictionary from an existing TSV, Parquet or Arrow output file,
+    replacing anything already in it. Rows are counted as they appear, so output
+    that a resumed run wrote twice is counted twice
+
+    Returns:
+        int: The number of pairs in the dictionary
+    """
+    with AbbreviationDictionary(dictionary_path) as dictionary:
+        dictionary.reset()
+        for abbreviations in read_output_chunks(output_path):
+            dictionary.add(abbreviations)
+        return len(dictionary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build or query a short form -> long form dictionary"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Build from extractor output")
+    build_parser.add_argument("output", help="TSV, Parquet or Arrow output to read")
+    build_parser.add_argument("dictionary", help="SQLite dictionary to write")
+
+    lookup_parser = commands.add_parser("lookup", help="Look up a short form")
+    lookup_parser.add_argument("dictionary", help="SQLite dictionary to read")
+    lookup_parser.add_argument("short_form")
+    lookup_parser.add_argument("--ignore-case", action="store_true")
+    lookup_parser.add_argument(
+        "--pmids", action="store_true", help="Also list the PMIDs of each pair"
+    )
+    args = parser.parse_args()
+
+    if args.command == "build":
+        num_pairs = build_dictionary(args.output, args.dictionary)
+        print(f"{num_pairs} pairs written to {args.dictionary}")
+    else:
+        with AbbreviationDictionary(args.dictionary) as dictionary:
+            for entry in dictionary.lookup(args.short_form, args.ignore_case):
+                print(
+                    f"{entry.short_form}\t{entry.long_form}\t{entry.frequency}\t"
+                    f"{entry.first_pmid}\t{entry.last_pmid}"
+                )
+                if args.pmids:
+                    print("\t" + " ".join(dictionary.pmids(*entry[:2])))
@@ -0,0 +1,196 @@
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+import random
+import time
+
+from spacy.language import Language
+from spacy.tokens import Doc, DocBin
+
+from config import EVAL_BATCH_SIZE
+from models import heuristic_abbreviation_match
+
+# Entity labels scored separately
+LABELS = ("SF", "LF")
+
+# An entity, as (start char, end char, label)
+Entity = Tuple[int, int, str]
+# A short form/long form pair, as the character spans of both
+Pair = Tuple[int, int, int, int]
+# A sentence, as (start char, end char)
+Sentence = Tuple[int, int]
+
+
+def doc_entities(doc: Doc) -> Set[Entity]:
+    return {(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents}
+
+
+def doc_sentences(doc: Doc) -> List[Sentence]:
+    """The doc's sentences, or the whole doc if it has no sentence boundaries"""
+    if not doc.has_annotation("SENT_START"):
+        return [(0, len(doc.text))]
+    return [(sentence.start_char, sentence.end_char) for sentence in doc.sents]
+
+
+def segment_sentences(
+    nlp: Language, texts: List[str], batch_size: int = EVAL_BATCH_SIZE
+) -> List[List[Sentence]]:
+    """Splits texts into sentences as the pipeline would at inference, with its
+    components that set sentence boundaries, such as en_core_web_trf's parser, and
+    those they listen to. Components that set entities are not run. If there are
+    none that set sentence boundaries, each text is a single sentence"""
+    pipe_names = nlp.pipe_names
+
+    def assigns(attribute):
+        return [
+            name for name in pipe_names if attribute in nlp.get_pipe_meta(name).assigns
+        ]
+
+    if not assigns("token.is_sent_start"):
+        return [[(0, len(text))] for text in texts]
+    with nlp.select_pipes(disable=assigns("doc.ents")):
+        return [doc_sentences(doc) for doc in nlp.pipe(texts, batch_size=batch_size)]
+
+
+def doc_pairs(doc: Doc, sentences: Optional[List[Sentence]] = None) -> Set[Pair]:
+    """The pairs `BertAbbreviationExtractor` would output from the doc's entities,
+    see `models.heuristic_abbreviation_match`. As there, entities are only paired
+    within a sentence. Sentences are the doc's own, see `doc_sentences`, unless
+    given"""
+    if sentences is None:
+        sentences = doc_sentences(doc)
+    pairs = set()
+    for start, end in sentences:
+        sentence_ents = [
+            ent for ent in doc.ents if ent.start_char >= start and ent.end_char <= end
+        ]
+        for short_form, long_form in heuristic_abbreviation_match(sentence_ents):
+            pairs.add(
+                (
+                    short_form.start_char,
+                    short_form.end_char,
+                    long_form.start_char,
+                    long_form.end_char,
+                )
+            )
+    return pairs
+
+
+def prf(num_correct: int, num_predicted: int, num_gold: int) -> Dict[str, float]:
+    """Precision, recall and F1 from counts"""
+    precision = num_correct / num_predicted if num_predicted else 0.0
+    recall = num_correct / num_gold if num_gold else 0.0
+    f_score = (
+        2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    )
+    return {"p": precision, "r": recall, "f": f_score}
+
+
+class CachedEvaluator:
+    """Scores the NER model on a corpus split, for validation during training.
+
+    Unlike `nlp.evaluate` over `corpus.iter_examples`, the split's shards are only
+    read, tokenized and scored for their gold entities and pairs once. Each
+    evaluation then runs copies of the tokenized docs through `nlp.pipe` in
+    batches, and compares the predictions with the cached gold annotations.
+
+    As well as SF and LF entities, scores the pairs the ML extractor would output,
+    so extraction quality is measured end to end without a run of main.py. Gold
+    pairs are the pairs found from the gold entities. Both are paired within the
+    sentences inference would see, found once when the split is cached, by the
+    pipeline's own sentence boundary components at that point, see
+    `segment_sentences`. PLOD's segments can hold more than one sentence.
+
+    Args:
+        nlp (Language): The pipeline being trained
+        split_dir (str): The split's shard directory
+        limit (Optional[int]): If given, only evaluate on this many docs, a fixed
+            random sample of the split
+        batch_size (int): The number of docs `nlp.pipe` processes at a time
+        seed (int): Seed for the sample
+    """
+
+    def __init__(
+        self,
+        nlp: Language,
+        split_dir: str,
+        limit: Optional[int] = None,
+        batch_size: int = EVAL_BATCH_SIZE,
+        seed: int = 0,
+    ) -> None:
+        self.nlp = nlp
+        self.batch_size = batch_size
+
+        references: List[Doc] = []
+        for shard_path in sorted(Path(split_dir).glob("*.spacy")):
+            references.extend(DocBin().from_disk(shard_path).get_docs(nlp.vocab))
+        if limit is not None and limit < len(references):
+            sample = random.Random(seed).sample(range(len(references)), limit)
+            references = [references[index] for index in sorted(sample)]
+
+        self.docs = [nlp.make_doc(reference.text) for reference in references]
+        self.sentences = segment_sentences(
+            nlp, [reference.text for reference in references], batch_size
+        )
+        self.gold_entities = [doc_entities(reference) for reference in references]
+        self.gold_pairs = [
+            doc_pairs(reference, sentences)
+            for reference, sentences in zip(references, self.sentences)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def evaluate(self) -> Dict:
+        """Runs the pipeline over the cached docs and scores its predictions.
+        Components left disabled with `nlp.select_pipes` are not run
+
+        Returns:
+            Dict: `ents_p`, `ents_r` and `ents_f` over both labels,
+                `ents_per_type` with each label's scores, `pairs_p`, `pairs_r`
+                and `pairs_f`, and the docs evaluated per second
+        """
+        counts: Counter = Counter()
+
+        start = time.perf_counter()
+        predictions = self.nlp.pipe(
+            (doc.copy() for doc in self.docs), batch_size=self.batch_size
+        )
+        for doc, sentences, gold_entities, gold_pairs in zip(
+            predictions, self.sentences, self.gold_entities, self.gold_pairs
+        ):
+            entities = doc_entities(doc)
+            for label in LABELS:
+                predicted = {entity for entity in entities if entity[2] == label}
+                gold = {entity for entity in gold_entities if entity[2] == label}
+                counts[label, "correct"] += len(predicted & gold)
+                counts[label, "predicted"] += len(predicted)
+                counts[label, "gold"] += len(gold)
+
+            pairs = doc_pairs(doc, sentences)
+            counts["pairs", "correct"] += len(pairs & gold_pairs)
+            counts["pairs", "predicted"] += len(pairs)
+            counts["pairs", "gold"] += len(gold_pairs)
+        seconds = time.perf_counter() - start
+
+        def scores(*keys):
+            return prf(
+                *(
+                    sum(counts[key, count] for key in keys)
+                    for count in ("correct", "predicted", "gold")
+                )
+            )
+
+        entity_scores = scores(*LABELS)
+        pair_scores = scores("pairs")
+        return {
+            "ents_p": entity_scores["p"],
+            "ents_r": entity_scores["r"],
+            "ents_f": entity_scores["f"],
+            "ents_per_type": {label: scores(label) for label in LABELS},
+            "pairs_p": pair_scores["p"],
+            "pairs_r": pair_scores["r"],
+            "pairs_f": pair_scores["f"],
+            "docs": len(self.docs),
+            "docs_per_second": len(self.docs) / seconds if seconds else None,
+        }
@@ -0,0 +1,212 @@
+from pathlib import Path
+from typing import List, Tuple
+from xml.sax.saxutils import escape
+import random
+
+import pandas as pd
+import spacy
+from thinc.api import Maxout, Model, chain, with_padded
+from thinc.types import Padded
+
+# (long form, short form) pairs the synthetic corpus defines
+DEFINITIONS = [
+    ("magnetic resonance imaging", "MRI"),
+    ("polymerase chain reaction", "PCR"),
+    ("tumor necrosis factor-alpha", "TNF-alpha"),
+    ("World Health Organization", "WHO"),
+    ("reactive oxygen species", "ROS"),
+    ("body mass index", "BMI"),
+    ("confidence interval", "CI"),
+    ("chronic obstructive pulmonary disease", "COPD"),
+    ("randomized controlled trial", "RCT"),
+    ("human immunodeficiency virus", "HIV"),
+    ("interleukin-6", "IL-6"),
+    ("computed tomography", "CT"),
+]
+
+FILLER_WORDS = (
+    "the patients were treated with a significant increase in levels of "
+    "expression during follow-up and compared to controls we observed that "
+    "results suggest this cohort study analysis showed higher lower risk"
+).split()
+
+
+def filler(rng: random.Random, min_words: int = 4, max_words: int = 14) -> str:
+    return " ".join(rng.choices(FILLER_WORDS, k=rng.randint(min_words, max_words)))
+
+
+def make_sentence(rng: random.Random) -> Tuple[str, List[Tuple[int, int, str]]]:
+    """Builds a synthetic sentence, optionally defining an abbreviation
+
+    Returns:
+        Tuple[str, List[Tuple[int, int, str]]]: The sentence, and the character
+            offsets and labels (SF/LF) of the abbreviation it defines
+    """
+    sentence = filler(rng).capitalize()
+    entities = []
+
+    if rng.random() < 0.5:
+        long_form, short_form = rng.choice(DEFINITIONS)
+        lf_start = len(sentence) + 1
+        sentence = f"{sentence} {long_form} ("
+        sf_start = len(sentence)
+        sentence = f"{sentence}{short_form})"
+        entities = [
+            (lf_start, lf_start + len(long_form), "LF"),
+            (sf_start, sf_start + len(short_form), "SF"),
+        ]
+
+    if rng.random() < 0.2:  # Parentheses that are not abbreviations
+        sentence = f"{sentence} (n = {rng.randint(2, 500)})"
+
+    return f"{sentence} {filler(rng, 2, 6)}.", entities
+
+
+def make_abstract(rng: random.Random, min_sents: int = 4, max_sents: int = 12):
+    return " ".join(
+        make_sentence(rng)[0] for _ in range(rng.randint(min_sents, max_sents))
+    )
+
+
+def write_articles_xml(path: str, num_articles: int, seed: int = 0) -> None:
+    """Writes a MEDLINE-style XML file of synthetic articles. One in twenty has
+    no abstract, as some real articles do"""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<PubmedArticleSet>\n')
+        for pmid in range(1, num_articles + 1):
+            abstract = ""
+            if rng.random() >= 0.05:
+                abstract = (
+                    "<Abstract><AbstractText>"
+                    f"{escape(make_abstract(rng))}"
+                    "</AbstractText></Abstract>"
+                )
+            f.write(
+                "<PubmedArticle><MedlineCitation>"
+                f'<PMID Version="1">{pmid}</PMID><Article>'
+                f"<ArticleTitle>{escape(filler(rng).capitalize())}.</ArticleTitle>"
+                f"{abstract}</Article></MedlineCitation></PubmedArticle>\n"
+            )
+        f.write("</PubmedArticleSet>\n")
+
+
+def write_plod_tsv(path: str, num_segments: int, seed: int = 0) -> None:
+    """Writes a PLOD-style TSV of synthetic, labelled segments. One in fifty has
+    malformed indexes, as `utils.process_PLOD` has to filter out"""
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(num_segments):
+        segment, entities = make_sentence(rng)
+        short_forms = [[start, end] for start, end, label in entities if label == "SF"]
+        long_forms = [[start, end] for start, end, label in entities if label == "LF"]
+        if rng.random() < 0.02:
+            short_forms = "nan"
+        rows.append(
+            {
+                "Segment": segment,
+                "Abbreviation_Indexes": str(short_forms),
+                "Long-Form_Indexes": str(long_forms),
+            }
+        )
+    pd.DataFrame(rows).to_csv(path, sep="\t", index=False)
+
+
+def padded_dense_forward(model: Model, Xp: Padded, is_train: bool):
+    """Runs the wrapped layer over every position of a padded batch, padding
+    included, as a transformer does"""
+    length, batch_size, width = Xp.data.shape
+    Y, backprop_layer = model.layers[0](
+        Xp.data.reshape(length * batch_size, width), is_train
+    )
+
+    def backprop(dYp: Padded) -> Padded:
+        dX = backprop_layer(dYp.data.reshape(length * batch_size, -1))
+        return Padded(
+            dX.reshape(length, batch_size, -1),
+            dYp.size_at_t,
+            dYp.lengths,
+            dYp.indices,
+        )
+
+    return (
+        Padded(Y.reshape(length, batch_size, -1), Xp.size_at_t, Xp.lengths, Xp.indices),
+        backprop,
+    )
+
+
+@spacy.registry.architectures("abbreviation_extraction.PaddedEncoder.v1")
+def padded_encoder(width: int, hidden_width: int) -> Model:
+    """A token encoder whose cost grows with the padded size of the batch, like
+    the transformer's, so batching strategies can be compared on CPU"""
+    layer = chain(Maxout(hidden_width, width), Maxout(width, hidden_width))
+    padded_dense = Model(
+        "padded_dense",
+        padded_dense_forward,
+        init=lambda model, X=None, Y=None: model.layers[0].initialize(),
+        layers=[layer],
+    )
+    return with_padded(padded_dense)
+
+
+# Config of the stand-in model's NER component
+STAND_IN_NER = {
+    "model": {
+        "@architectures": "spacy.TransitionBasedParser.v2",
+        "state_type": "ner",
+        "extra_state_tokens": False,
+        "hidden_width": 32,
+        "maxout_pieces": 1,
+        "use_upper": True,
+        "tok2vec": {
+            "@architectures": "spacy.Tok2Vec.v2",
+            "embed": {
+                "@architectures": "spacy.MultiHashEmbed.v2",
+                "width": 64,
+                "attrs": ["NORM", "PREFIX", "SUFFIX", "SHAPE"],
+                "rows": [5000, 1000, 1000, 1000],
+                "include_static_vectors": False,
+            },
+            "encode": {
+                "@architectures": "abbreviation_extraction.PaddedEncoder.v1",
+                "width": 64,
+                "hidden_width": 1024,
+            },
+        },
+    }
+}
+
+
+def write_stand_in_model(path: str) -> None:
+    """Saves a tiny, untrained spaCy NER pipeline with the SF/LF labels. It loads
+    like the fine-tuned RoBERTa model, and pays for padding like it does, for
+    timing BertAbbreviationExtractor without a GPU or the real weights. Loading it
+    needs this module imported, to register its encoder"""
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    ner = nlp.add_pipe("ner", config=STAND_IN_NER)
+    ner.add_label("SF")
+    ner.add_label("LF")
+    nlp.initialize()
+    nlp.to_disk(path)
+
+
+def write_fixture_corpus(
+    directory: str, num_articles: int, num_segments: int, seed: int = 0
+) -> dict:
+    """Writes a synthetic MEDLINE XML file, PLOD TSV and stand-in NER model
+
+    Returns:
+        dict: The paths of the "articles", "plod" and "model" fixtures
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = {
+        "articles": str(directory / "articles.xml"),
+        "plod": str(directory / "PLOD.tsv"),
+        "model": str(directory / "stand-in-model"),
+    }
+    write_articles_xml(paths["articles"], num_articles, seed)
+    write_plod_tsv(paths["plod"], num_segments, seed)
+    write_stand_in_model(paths["model"])
+    return paths
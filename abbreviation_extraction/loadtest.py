@@ -0,0 +1,188 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPException
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import argparse
+import json
+import random
+import socket
+import threading
+import time
+
+import numpy as np
+
+from config import SERVICE_HOST, SERVICE_PORT, SERVICE_SOCKET
+from fixtures import make_abstract
+from utils import clean_data, load_articles
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """HTTPConnection over a Unix socket"""
+
+    def __init__(self, socket_path: str) -> None:
+        super().__init__("localhost")
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def load_abstracts(articles_path: str, num_abstracts: int, seed: int = 0) -> List[str]:
+    """Abstracts to send, from an articles file or else synthetic"""
+    if articles_path is not None:
+        return list(clean_data(load_articles(articles_path))["abstract"])
+    rng = random.Random(seed)
+    return [make_abstract(rng) for _ in range(num_abstracts)]
+
+
+def run_client(
+    connect, abstracts: List[str], extractors: List[str], batch_size: int, until: float
+) -> Tuple[List[float], Counter]:
+    """Sends requests over one keep-alive connection until the deadline. Failed
+    requests are counted rather than stopping the client, and a connection that
+    breaks is reopened
+
+    Returns:
+        Tuple[List[float], Counter]: The latency of each successful request, in
+            seconds, and the failures by HTTP status or exception name
+    """
+    connection = connect()
+    # Abstracts are drawn with replacement, so batches can be larger than the pool
+    rng = random.Random(threading.get_ident())
+    latencies = []
+    errors: Counter = Counter()
+
+    while time.perf_counter() < until:
+        if batch_size == 1:
+            request = {"abstract": rng.choice(abstracts)}
+        else:
+            request = {"abstracts": rng.choices(abstracts, k=batch_size)}
+        request["extractors"] = extractors
+
+        start = time.perf_counter()
+        try:
+            connection.request(
+                "POST",
+                "/extract",
+                body=json.dumps(request),
+                headers={"Content-Type": "application/json"},
+            )
+            response = connection.getresponse()
+            response.read()
+        except (HTTPException, OSError) as error:
+            errors[type(error).__name__] += 1
+            connection.close()
+            connection = connect()
+            continue
+
+        if response.status != 200:
+            errors[str(response.status)] += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+
+    connection.close()
+    return latencies, errors
+
+
+def latency_ms(latencies: np.ndarray, percentile: float) -> Optional[float]:
+    """A latency percentile in milliseconds, or None if no request succeeded"""
+    if not len(latencies):
+        return None
+    return float(np.percentile(latencies, percentile) * 1000)
+
+
+def load_test(
+    connect,
+    abstracts: List[str],
+    extractors: List[str],
+    concurrency: int,
+    duration: float,
+    batch_size: int = 1,
+) -> Dict:
+    """Keeps `concurrency` clients sending requests for `duration` seconds
+
+    Returns:
+        Dict: Latency percentiles in milliseconds and throughput, over successful
+            requests, and the failed requests. Latencies are None if every
+            request failed
+    """
+    if not abstracts:
+        raise ValueError("No abstracts to send")
+
+    start = time.perf_counter()
+    until = start + duration
+    latencies = []
+    errors: Counter = Counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for client_latencies, client_errors in executor.map(
+            lambda _: run_client(connect, abstracts, extractors, batch_size, until),
+            range(concurrency),
+        ):
+            latencies.extend(client_latencies)
+            errors.update(client_errors)
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies)
+
+    return {
+        "concurrency": concurrency,
+        "abstracts_per_request": batch_size,
+        "requests": len(latencies),
+        "failed_requests": sum(errors.values()),
+        "errors": dict(errors),
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "abstracts_per_second": len(latencies) * batch_size / elapsed,
+        "p50_ms": latency_ms(latencies, 50),
+        "p99_ms": latency_ms(latencies, 99),
+        "max_ms": latency_ms(latencies, 100),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test a running extraction service (service.py)"
+    )
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--socket", default=SERVICE_SOCKET)
+    parser.add_argument("--articles", help="MEDLINE XML file (default: synthetic)")
+    parser.add_argument("--num-abstracts", type=int, default=500)
+    parser.add_argument("--extractors", nargs="+", default=["rule_based", "ml_based"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    def connect():
+        if args.socket:
+            return UnixHTTPConnection(args.socket)
+        return HTTPConnection(args.host, args.port)
+
+    abstracts = load_abstracts(args.articles, args.num_abstracts)
+    health = connect()
+    health.request("GET", "/health")
+    service = json.loads(health.getresponse().read())
+    health.close()
+
+    results = {
+        "service": service,
+        "settings": vars(args),
+        "runs": [
+            load_test(
+                connect,
+                abstracts,
+                args.extractors,
+                concurrency,
+                args.duration,
+                args.batch_size,
+            )
+            for concurrency in args.concurrency
+        ],
+    }
+
+    print(json.dumps(results, indent=2))
+    if args.output is not None:
+        Path(args.output).write_text(json.dumps(results, indent=2))
@@ -1,65 +1,470 @@
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+from functools import partial
+from multiprocessing import Pool
+import os
+import sys
+import time
+
 from config import MODEL_READ_PATH
-from models import BertAbbreviationExtractor
 from config import SIMPLE_OUTPUT_PATH, ARTICLE_READ_PATH, ML_OUTPUT_PATH
-from models import SimpleAbbreviationExtractor
-from utils import clean_data, load_articles
+from config import EXTRACTION_BATCH_SIZE
+from config import MANIFEST_PATH, OUTPUT_FORMAT
+from config import RESULT_CACHE_PATH
+from config import ML_DICTIONARY_PATH, SIMPLE_DICTIONARY_PATH
+from config import PROPAGATION_MIN_FREQUENCY
+from config import ML_SENTENCES_OUTPUT_PATH, SIMPLE_SENTENCES_OUTPUT_PATH
+from cache import CachedExtractor, ResultCache
+from checkpoint import ExtractorCheckpoint, RunManifest
+from dictionary import AbbreviationDictionary
+from pipeline import PipelineStage, run_pipeline
+from propagation import PropagatingExtractor, build_propagating_extractor
+from results import new_table
+import metrics
+from cli import rule_engine
+from sinks import open_sink
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
 
+# Each worker process builds its own extractor once, in `init_worker`
+_worker_extractor = None
+
+# Shards per worker in each chunk. More shards than workers keeps the pool
+# busy when some shards contain longer abstracts than others
+SHARDS_PER_WORKER = 4
+
 
-def get_abbreviations(extractor, cleaned_articles):
+def get_abbreviations(
+    extractor,
+    cleaned_articles,
+    batch_size=EXTRACTION_BATCH_SIZE,
+    show_progress=True,
+    layout="full",
+    sentences=False,
+):
     """Wrapper function that abstracts the logic for:
         - making our input articles' data match with the abbreviation-extractors
-        - Iterating across each abstract
+        - Iterating across each abstract, in batches
         - returning a properly formatted dataframe ready for output.
 
     Args:
         cleaned_articles (pd.DataFrame): The input articles in a dataframe form
+        batch_size (int): The number of abstracts the extractor processes at a time
+        show_progress (bool): Whether to display a progress bar
+        layout (str): "full", or "offsets" to locate each row's sentence by
+            character offsets rather than repeat it, see `results.new_table`
+        sentences (bool): With the offsets layout, also keep each sentence's text
+            for the sentence table
 
     Returns:
         pd.DataFrame: A DataFrame containing sentence-per-row entries where each row
         matches the task's given schema. Covering every article from the input.
     """
 
-    abstracts_with_ids = cleaned_articles[["PMID", "abstract"]].to_numpy()  # for speed
-    abbreviations_with_ids = []
+    abbreviations = new_table(layout, sentences)
 
-    for keyed_abstract in tqdm(abstracts_with_ids):
-        # Get the abbreviations for a single abstract, tracked per sentence
-        abbrevs = extractor.find_abbreviations(keyed_abstract[1])
+    # Get the abbreviations for each abstract, tracked per sentence
+    abbrevs_per_abstract = extractor.find_abbreviations_batch(
+        cleaned_articles["abstract"], batch_size=batch_size
+    )
 
-        if abbrevs.size == 0:
-            continue
-        abbrevs = np.insert(abbrevs, abbrevs.shape[1], keyed_abstract[0], axis=1)
-        abbreviations_with_ids.append(abbrevs)
+    for pmid, article_title, abbrevs in tqdm(
+        zip(
+            cleaned_articles["PMID"],
+            cleaned_articles["article_title"],
+            abbrevs_per_abstract,
+        ),
+        total=len(cleaned_articles),
+        disable=not show_progress,
+    ):
+        # Timed per article, so the extractor's own time isn't counted here
+        with metrics.stage("assemble_results", 1):
+            abbreviations.extend(article_title, pmid, abbrevs)
 
-    abbreviations_with_ids = [
-        item for sublist in abbreviations_with_ids for item in sublist
-    ]
+    with metrics.stage("assemble_results"):
+        return abbreviations.to_frame()
 
-    combined_data = pd.DataFrame(
-        abbreviations_with_ids, columns=["sentence", "short_form", "long_form", "PMID"]
-    ).merge(cleaned_articles[["PMID", "article_title"]], how="left", on="PMID")[
-        ["article_title", "PMID", "sentence", "short_form", "long_form"]
-    ]
 
-    return combined_data
+def init_worker(extractor_class, extractor_args, cache_path=None, metrics_on=False):
+    """Pool initializer. Loads the worker's own extractor (and therefore its own
+    spaCy pipeline) once, rather than once per shard. Workers open their own
+    connection to the result cache, if one is used, and collect their own stage
+    metrics if the parent does"""
+    global _worker_extractor
+    metrics.reset()  # Forked workers start with a copy of the parent's
+    if metrics_on:
+        metrics.enable()
+    _worker_extractor = extractor_class(*extractor_args)
+    if cache_path is not None:
+        _worker_extractor = CachedExtractor(_worker_extractor, ResultCache(cache_path))
 
 
-if __name__ == "__main__":
-    articles = load_articles(ARTICLE_READ_PATH)
+def extract_shard(shard, layout="full", sentences=False):
+    """Runs the worker's extractor over a shard of cleaned articles
 
-    cleaned_articles = clean_data(articles)
+    Args:
+        shard (pd.DataFrame): A contiguous slice of the cleaned articles
+        layout (str): The output layout, see `get_abbreviations`
+        sentences (bool): Whether to keep the sentences, see `get_abbreviations`
 
-    simple_abbreviation_extractor = SimpleAbbreviationExtractor()
-    simple_abbreviation_output = get_abbreviations(
-        simple_abbreviation_extractor, cleaned_articles
+    Returns:
+        Tuple[pd.DataFrame, int, int, float, Counter, dict, Counter]: The
+            shard's abbreviations, the worker's process ID, the number of abstracts
+            processed, the time taken, the shard's result cache hits and misses, the
+            worker's stage metrics for the shard and the shard's prefilter counts
+    """
+    start = time.perf_counter()
+    cache_before = cache_counts(_worker_extractor)
+    prefilter_before = prefilter_counts(_worker_extractor)
+    abbreviation_output = get_abbreviations(
+        _worker_extractor,
+        shard,
+        show_progress=False,
+        layout=layout,
+        sentences=sentences,
+    )
+    shard_metrics = metrics.snapshot()
+    metrics.reset()
+    return (
+        abbreviation_output,
+        os.getpid(),
+        len(shard),
+        time.perf_counter() - start,
+        count_difference(cache_counts(_worker_extractor), cache_before),
+        shard_metrics,
+        count_difference(prefilter_counts(_worker_extractor), prefilter_before),
     )
-    simple_abbreviation_output.to_csv(SIMPLE_OUTPUT_PATH, sep="\t", index=False)
 
-    bert_abbreviation_extractor = BertAbbreviationExtractor(MODEL_READ_PATH)
-    bert_abbreviation_output = get_abbreviations(
-        bert_abbreviation_extractor, cleaned_articles
+
+def count_difference(after, before):
+    """Per-key `after - before`. Unlike subtracting Counters, keys whose count
+    didn't change are kept, at zero"""
+    return Counter({key: count - before[key] for key, count in after.items()})
+
+
+def cache_counts(extractor):
+    """The result cache's hit and miss counters, if the extractor is cached"""
+    if not isinstance(extractor, CachedExtractor):
+        return Counter()
+    return Counter(hits=extractor.cache.hits, misses=extractor.cache.misses)
+
+
+def prefilter_counts(extractor):
+    """The documents and sentences the extractor's pre-screen has seen and skipped,
+    see `rules.has_candidate_parentheses`"""
+    # Unwrap any cached or propagating extractor
+    while hasattr(extractor, "extractor"):
+        extractor = extractor.extractor
+    return Counter(getattr(extractor, "prefilter_stats", {}))
+
+
+def report_prefilter(extractor_name, counts):
+    """Prints how much of the input the extractor's pre-screen skipped"""
+    skipped = [
+        f"{counts[f'{unit}_skipped']}/{counts[unit]} {label}"
+        for unit, label in (("docs", "abstracts"), ("sentences", "sentences"))
+        if counts[unit]
+    ]
+    if skipped:
+        print(f"{extractor_name} prefilter: skipped {' and '.join(skipped)}")
+
+
+def split_into_shards(cleaned_articles, num_shards):
+    """Splits the articles into at most `num_shards` contiguous, ordered slices"""
+    bounds = np.linspace(0, len(cleaned_articles), num_shards + 1).astype(int)
+    return [
+        cleaned_articles.iloc[start:end]
+        for start, end in zip(bounds[:-1], bounds[1:])
+        if end > start
+    ]
+
+
+def report_worker_throughput(worker_stats, wall_time):
+    """Prints the number of abstracts each worker processed and its throughput"""
+    total_docs = 0
+    for worker_id, (num_docs, busy_time) in sorted(worker_stats.items()):
+        total_docs += num_docs
+        print(
+            f"Worker {worker_id}: {num_docs} abstracts in {busy_time:.1f}s "
+            f"({num_docs / max(busy_time, 1e-9):.1f} abstracts/s)"
+        )
+    print(
+        f"Total: {total_docs} abstracts in {wall_time:.1f}s "
+        f"({total_docs / max(wall_time, 1e-9):.1f} abstracts/s) "
+        f"across {len(worker_stats)} workers"
+    )
+
+
+def open_pool(extractor_class, workers, extractor_args=(), cache_path=None):
+    """Starts a pool of worker processes, each with its own extractor. See
+    `init_worker`"""
+    return Pool(
+        workers,
+        initializer=init_worker,
+        initargs=(extractor_class, extractor_args, cache_path, metrics.ENABLED),
     )
-    bert_abbreviation_output.to_csv(ML_OUTPUT_PATH, sep="\t", index=False)
+
+
+def extract_chunk_parallel(
+    pool,
+    cleaned_articles,
+    workers,
+    worker_stats,
+    cache_stats,
+    show_progress=True,
+    prefilter_stats=None,
+    layout="full",
+    sentences=False,
+):
+    """Shards a chunk of cleaned articles across the pool. Shard results are
+    merged back in input order, so the output matches a serial run
+
+    Args:
+        pool (Pool): A pool from `open_pool`
+        cleaned_articles (pd.DataFrame): The chunk of articles
+        workers (int): The number of worker processes in the pool
+        worker_stats (defaultdict): Abstracts processed and busy time per worker,
+            updated in place
+        cache_stats (Counter): Result cache hits and misses, updated in place
+        show_progress (bool): Whether to display a progress bar over the shards
+        prefilter_stats (Counter): If given, the documents and sentences skipped by
+            the workers' pre-screen, updated in place
+        layout (str): The output layout, see `get_abbreviations`
+        sentences (bool): Whether to keep the sentences, see `get_abbreviations`
+
+    Returns:
+        pd.DataFrame: The chunk's abbreviations, as from `get_abbreviations`
+    """
+    shards = split_into_shards(cleaned_articles, workers * SHARDS_PER_WORKER)
+
+    # imap yields in submission order, keeping the output deterministic
+    shard_outputs = []
+    for (
+        shard_output,
+        worker_id,
+        num_docs,
+        elapsed,
+        shard_cache,
+        shard_metrics,
+        shard_prefilter,
+    ) in tqdm(
+        pool.imap(partial(extract_shard, layout=layout, sentences=sentences), shards),
+        total=len(shards),
+        disable=not show_progress,
+    ):
+        shard_outputs.append(shard_output)
+        cache_stats.update(shard_cache)
+        metrics.merge(shard_metrics)
+        if prefilter_stats is not None:
+            prefilter_stats.update(shard_prefilter)
+        worker_stats[worker_id][0] += num_docs
+        worker_stats[worker_id][1] += elapsed
+
+    return pd.concat(shard_outputs, ignore_index=True)
+
+
+def run_extraction(args):
+    """Runs the chosen extractors over the articles in a single pass, see
+    pipeline.py. spaCy, the ML model and the GPU are only loaded if needed
+
+    Args:
+        args (argparse.Namespace): The options of `cli.py`'s extraction
+            subcommands. `args.extractors` lists "rule_based" and/or "ml_based"
+    """
+    if args.metrics:
+        metrics.enable()
+
+    extractors = args.extractors
+    append = args.resume or args.incremental
+    if args.sentences and args.layout != "offsets":
+        raise ValueError("--sentences needs --layout offsets")
+    cache_path = RESULT_CACHE_PATH if args.cache else None
+    result_caches = {}
+
+    def with_cache(extractor_name, extractor):
+        if not args.cache:
+            return extractor
+        # Each extractor runs on its own thread, so each gets its own connection
+        result_caches[extractor_name] = ResultCache(RESULT_CACHE_PATH)
+        return CachedExtractor(extractor, result_caches[extractor_name])
+
+    # Corpus-wide propagation reads the dictionaries before this run replaces them
+    corpus_long_forms = {}
+    if args.propagate == "corpus":
+        for extractor, extractor_name, dictionary_path in (
+            ("rule_based", "Rule-based", SIMPLE_DICTIONARY_PATH),
+            ("ml_based", "ML-based", ML_DICTIONARY_PATH),
+        ):
+            if extractor not in extractors:
+                continue
+            if not os.path.exists(dictionary_path):
+                raise FileNotFoundError(
+                    f"--propagate corpus needs {dictionary_path}, "
+                    "built by a previous run with --dictionary"
+                )
+            with AbbreviationDictionary(dictionary_path) as dictionary:
+                corpus_long_forms[extractor_name] = dictionary.most_frequent_long_forms(
+                    PROPAGATION_MIN_FREQUENCY
+                )
+
+    def with_propagation(extractor_name, extractor):
+        if not args.propagate:
+            return extractor
+        return PropagatingExtractor(extractor, corpus_long_forms.get(extractor_name))
+
+    manifest = RunManifest(MANIFEST_PATH)
+
+    def checkpoint_for(extractor_name):
+        if not append:  # A fresh run replaces the output, so forget old progress
+            manifest.reset(extractor_name)
+        return ExtractorCheckpoint(manifest, extractor_name, args.incremental)
+
+    def dictionary_for(stack, dictionary_path):
+        if not args.dictionary:
+            return None
+        dictionary = stack.enter_context(AbbreviationDictionary(dictionary_path))
+        if not append:  # Like the output, a fresh run replaces the dictionary
+            dictionary.reset()
+        return dictionary
+
+    # The extractors run in a single pass over the articles, see pipeline.py
+    parallel = "rule_based" in extractors and args.workers > 1
+    worker_stats = defaultdict(lambda: [0, 0.0])
+    worker_cache_stats = Counter(hits=0, misses=0)
+    worker_prefilter_stats = Counter()
+    in_process_extractors = {}
+    stages = []
+    start = time.perf_counter()
+
+    with ExitStack() as stack:
+        if "rule_based" in extractors:
+            rule_based_extractor_class = rule_engine(args.engine)
+            if parallel:
+                worker_extractor, worker_extractor_args = rule_based_extractor_class, ()
+                if args.propagate:
+                    worker_extractor = build_propagating_extractor
+                    worker_extractor_args = (
+                        rule_based_extractor_class,
+                        corpus_long_forms.get("Rule-based"),
+                    )
+                pool = stack.enter_context(
+                    open_pool(
+                        worker_extractor,
+                        args.workers,
+                        worker_extractor_args,
+                        cache_path,
+                    )
+                )
+                extract_rule_based = partial(
+                    extract_chunk_parallel,
+                    pool,
+                    workers=args.workers,
+                    worker_stats=worker_stats,
+                    cache_stats=worker_cache_stats,
+                    show_progress=False,
+                    prefilter_stats=worker_prefilter_stats,
+                    layout=args.layout,
+                    sentences=args.sentences,
+                )
+            else:
+                extractor = rule_based_extractor_class()
+                in_process_extractors["Rule-based"] = extractor
+                extract_rule_based = partial(
+                    get_abbreviations,
+                    with_cache("Rule-based", with_propagation("Rule-based", extractor)),
+                    show_progress=False,
+                    layout=args.layout,
+                    sentences=args.sentences,
+                )
+
+            stages.append(
+                PipelineStage(
+                    "Rule-based",
+                    extract_rule_based,
+                    stack.enter_context(
+                        open_sink(
+                            SIMPLE_OUTPUT_PATH,
+                            OUTPUT_FORMAT,
+                            append,
+                            args.layout,
+                            SIMPLE_SENTENCES_OUTPUT_PATH if args.sentences else None,
+                            provenance=bool(args.propagate),
+                        )
+                    ),
+                    checkpoint_for(f"rule_based-{args.engine}"),
+                    dictionary_for(stack, SIMPLE_DICTIONARY_PATH),
+                )
+            )
+
+        if "ml_based" in extractors:
+            # Imported here, after any worker processes have been started, so
+            # neither spaCy's transformer stack nor CUDA is loaded unless needed
+            import spacy
+            from models import BertAbbreviationExtractor
+
+            if args.gpu:
+                spacy.prefer_gpu()
+
+            # The ML model is left in-process: it is GPU-bound and batched instead
+            extractor = BertAbbreviationExtractor(
+                MODEL_READ_PATH, onnx_path=args.onnx or None
+            )
+            in_process_extractors["ML-based"] = extractor
+            extract_ml = partial(
+                get_abbreviations,
+                with_cache("ML-based", with_propagation("ML-based", extractor)),
+                show_progress=False,
+                layout=args.layout,
+                sentences=args.sentences,
+            )
+            stages.append(
+                PipelineStage(
+                    "ML-based",
+                    extract_ml,
+                    stack.enter_context(
+                        open_sink(
+                            ML_OUTPUT_PATH,
+                            OUTPUT_FORMAT,
+                            append,
+                            args.layout,
+                            ML_SENTENCES_OUTPUT_PATH if args.sentences else None,
+                            provenance=bool(args.propagate),
+                        )
+                    ),
+                    checkpoint_for("ml_based"),
+                    dictionary_for(stack, ML_DICTIONARY_PATH),
+                )
+            )
+
+        run_pipeline(ARTICLE_READ_PATH, stages)
+
+    for stage in stages:
+        print(
+            f"{stage.name}: skipped {stage.checkpoint.num_skipped} completed articles"
+        )
+
+    if parallel:
+        report_worker_throughput(worker_stats, time.perf_counter() - start)
+        if args.cache:
+            print("Rule-based worker result cache:", dict(worker_cache_stats))
+        report_prefilter("Rule-based", worker_prefilter_stats)
+
+    for extractor_name, extractor in in_process_extractors.items():
+        report_prefilter(extractor_name, prefilter_counts(extractor))
+
+    manifest.close()
+
+    for extractor_name, result_cache in result_caches.items():
+        print(f"{extractor_name} result cache:", result_cache.stats())
+        result_cache.close()
+
+    if args.metrics:
+        metrics.write_metrics(args.metrics)
+        print("Stage metrics written to", args.metrics)
+
+
+if __name__ == "__main__":
+    from cli import main
+
+    main(["extract", *sys.argv[1:]])
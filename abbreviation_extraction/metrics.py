@@ -0,0 +1,182 @@
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+import json
+import resource
+import sys
+import threading
+import time
+
+from config import METRICS_PATH
+
+# Stages are only timed once metrics are enabled. While disabled, `stage` and
+# `timed_iter` return before doing any work
+ENABLED = bool(METRICS_PATH)
+
+# Per-stage totals for this process
+_stages: Dict[str, Dict[str, float]] = {}
+# Pipeline stages run on their own threads
+_lock = threading.Lock()
+EMPTY_STAGE = {"calls": 0, "items": 0, "seconds": 0.0, "peak_rss_mb": 0.0}
+
+_DISABLED_STAGE = nullcontext()
+
+
+def enable() -> None:
+    global ENABLED
+    ENABLED = True
+
+
+def disable() -> None:
+    global ENABLED
+    ENABLED = False
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident set size of the current process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def record(name: str, seconds: float, items: int = 0, calls: int = 1) -> None:
+    """Adds a timing to a stage's totals, and samples the memory high-water mark
+
+    Args:
+        name (str): The stage, e.g. "parse_xml"
+        seconds (float): The wall time spent in the stage
+        items (int): The number of items (articles, docs, rows...) it processed
+        calls (int): The number of times the stage ran
+    """
+    peak = peak_rss_mb()
+    with _lock:
+        stats = _stages.setdefault(name, dict(EMPTY_STAGE))
+        stats["calls"] += calls
+        stats["items"] += items
+        stats["seconds"] += seconds
+        stats["peak_rss_mb"] = max(stats["peak_rss_mb"], peak)
+
+
+@contextmanager
+def _timed_stage(name: str, items: int) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, items)
+
+
+def stage(name: str, items: int = 0):
+    """Context manager timing the code inside it as a stage
+
+    Args:
+        name (str): The stage
+        items (int): The number of items processed inside the block
+    """
+    if not ENABLED:
+        return _DISABLED_STAGE
+    return _timed_stage(name, items)
+
+
+def timed_iter(name: str, iterable: Iterable) -> Iterable:
+    """Times a lazily evaluated stage, such as a generator or `nlp.pipe`. Only the
+    time spent producing each item is counted, not the time the consumer spends
+    on it. Items are the number of values yielded
+
+    Args:
+        name (str): The stage
+        iterable (Iterable): The stage's output
+
+    Returns:
+        Iterable: The same values, in order
+    """
+    if not ENABLED:
+        return iterable
+    return _timed_iter(name, iterable)
+
+
+def _timed_iter(name: str, iterable: Iterable) -> Iterator:
+    iterator = iter(iterable)
+    seconds = 0.0
+    items = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                value = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start
+            items += 1
+            yield value
+    finally:
+        record(name, seconds, items)
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    """A copy of this process' stage totals"""
+    with _lock:
+        return {name: dict(stats) for name, stats in _stages.items()}
+
+
+def merge(stages: Dict[str, Dict[str, float]]) -> None:
+    """Adds stage totals from another process, e.g. a worker, to this process'.
+    Their times add up, so stages run in parallel can total more than wall time"""
+    with _lock:
+        for name, stats in stages.items():
+            totals = _stages.setdefault(name, dict(EMPTY_STAGE))
+            for key in ("calls", "items", "seconds"):
+                totals[key] += stats[key]
+            totals["peak_rss_mb"] = max(totals["peak_rss_mb"], stats["peak_rss_mb"])
+
+
+def reset() -> None:
+    """Forgets this process' stage totals. Pipeline threads may still be recording"""
+    with _lock:
+        _stages.clear()
+
+
+def report() -> Dict[str, Dict[str, float]]:
+    """The stage totals with their throughput, slowest stage first"""
+    stages = snapshot()
+    return {
+        name: {
+            **stats,
+            "items_per_second": (
+                stats["items"] / stats["seconds"] if stats["seconds"] else None
+            ),
+        }
+        for name, stats in sorted(
+            stages.items(), key=lambda stage: stage[1]["seconds"], reverse=True
+        )
+    }
+
+
+def to_prometheus(stages: Dict[str, Dict[str, float]]) -> str:
+    """Formats stage totals in the Prometheus text exposition format"""
+    metrics = [
+        ("calls_total", "calls", "counter", "Number of times the stage ran"),
+        ("items_total", "items", "counter", "Items processed by the stage"),
+        ("seconds_total", "seconds", "counter", "Wall time spent in the stage"),
+        ("peak_rss_mb", "peak_rss_mb", "gauge", "Peak RSS sampled after the stage"),
+    ]
+    lines = []
+    for suffix, key, metric_type, description in metrics:
+        name = f"abbreviation_extraction_stage_{suffix}"
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for stage_name, stats in stages.items():
+            lines.append(f'{name}{{stage="{stage_name}"}} {stats[key]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path: str = METRICS_PATH) -> None:
+    """Writes the stage totals to a file. Paths ending in `.prom` are written in
+    the Prometheus text format, for the node exporter's textfile collector, and
+    anything else as JSON"""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    if str(path).endswith(".prom"):
+        Path(path).write_text(to_prometheus(snapshot()))
+    else:
+        Path(path).write_text(json.dumps(report(), indent=2))
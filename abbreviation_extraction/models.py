@@ -1,11 +1,23 @@
-from typing import Iterable, List, Tuple
+from collections import Counter
+from hashlib import sha1
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+import json
 import spacy
 import numpy as np
+from spacy.language import Language
+from spacy.tokens import Doc
 from spacy.tokenizer import Tokenizer
 from spacy.util import compile_infix_regex
 from spacy.matcher import Matcher
 
-spacy.prefer_gpu()
+from batching import iter_windows, pipe_length_bucketed
+from config import EXTRACTION_BATCH_SIZE, INFERENCE_TOKEN_BUDGET, ML_PREFILTER
+from config import SIMPLE_PREFILTER, SIMPLE_SENTENCE_SEGMENTER
+from metrics import stage, timed_iter
+from results import Abbreviation, to_array
+from rules import RULES_VERSION
+from rules import has_candidate_parentheses, is_valid_short_form
+from rules import long_form_window, match_abbreviation
 
 # Rule for Spacy matching to extract words in parentheses
 BRACKETED_RULE = [
@@ -16,41 +28,12 @@ BRACKETED_RULE = [
     {"ORTH": ")"},
 ]
 
+# Number of texts screened at a time by `pipe_prefiltered`
+PREFILTER_WINDOW = 1024
 
-def match_abbreviation(short_form: str, long_form: str):
-    """Matches an abbreviation to preceeding long form defitions, if one exists.
-    Part of the Schwartz & Hearst abbreviation matching algorithm
-
-    Args:
-        short_form (str): The abbreviation
-        long_formm (str): The preceeding characters in which to search for a match
-
-    Returns:
-        str: The original short form's corresponding long form defition.
-    """
-    sf_index = len(short_form) - 1
-    lf_index = len(long_form) - 1
-
-    while sf_index >= 0:
-        # Store the next character to match. Ignore case
-        curr_char = short_form[sf_index].lower()
-        # ignore non alphanumeric characters
-        if not curr_char.isalnum():
-            sf_index -= 1
-            continue
-
-        while (lf_index >= 0 and long_form[lf_index].lower() != curr_char) or (
-            (sf_index == 0) and lf_index > 0 and long_form[lf_index - 1].isalnum()
-        ):
-            lf_index -= 1
-
-        if lf_index < 0:
-            return None
-
-        lf_index -= 1
-        sf_index -= 1
-
-    return long_form[lf_index + 1 :]
+# en_core_web_md components the rule-based algorithm never reads from. It only
+# needs tokens (for the Matcher) and sentence boundaries
+UNUSED_COMPONENTS = ["tagger", "attribute_ruler", "lemmatizer", "ner"]
 
 
 def find_abbreviation_candidates(sentence: spacy.tokens.span.Span, parentheses_words):
@@ -63,7 +46,7 @@ def find_abbreviation_candidates(sentence: spacy.tokens.span.Span, parentheses_w
             tokens that match the parentheses
 
     Returns:
-        list(Tuple[str,str]): List of Tuples containing the short
+        list(Tuple[Span, Span]): List of Tuples containing the short
         abbreviation form, and the candidates for the definition
     """
     abbreviation_candidates = []
@@ -73,26 +56,114 @@ def find_abbreviation_candidates(sentence: spacy.tokens.span.Span, parentheses_w
             parentheses_start + 1 : parentheses_end - 1
         ]  # Excluding the parentheses
         short_len = len(parenthesis_word.text)
-        # Criteria given by Schwartz and Hearst to constitute a valid abbreviation
-        valid = parenthesis_word.text[0].isalnum()
-        valid = any(c.isalpha() for c in parenthesis_word.text) and valid
-        valid = (len(parenthesis_word.text.split()) <= 2) and valid
-        valid = short_len >= 2 and short_len <= 10 and valid
-
-        if valid:
-            # Long form has a max length in the paper, so we start selecting the
-            # candidate pool at this number of characters before the brackets
-            long_start = max(0, parentheses_start - min(short_len + 5, short_len * 2))
+
+        if is_valid_short_form(parenthesis_word.text):
+            long_start = max(0, parentheses_start - long_form_window(short_len))
             long_form = sentence[long_start:parentheses_start]
 
-            abbreviation_candidates.append((str(parenthesis_word), str(long_form)))
+            abbreviation_candidates.append((parenthesis_word, long_form))
 
     return abbreviation_candidates
 
 
+def pipe_prefiltered(
+    texts: Iterable[str],
+    pipe: Callable[[List[str]], Iterator[Doc]],
+    prefilter_stats: Counter,
+) -> Iterator[Optional[Doc]]:
+    """Runs a pipeline only over the texts with candidate parentheses, see
+    `rules.has_candidate_parentheses`. Texts are screened a window at a time
+
+    Args:
+        texts (Iterable[str]): The texts to process
+        pipe (Callable[[List[str]], Iterator[Doc]]): Processes a list of texts,
+            e.g. `nlp.pipe`
+        prefilter_stats (Counter): Counts of the docs seen and skipped, updated
+            in place
+
+    Yields:
+        Optional[Doc]: Each text's processed doc, or None if it was skipped
+    """
+    for window in iter_windows(texts, PREFILTER_WINDOW):
+        has_candidates = [has_candidate_parentheses(text) for text in window]
+        docs = pipe([text for text, keep in zip(window, has_candidates) if keep])
+        prefilter_stats["docs"] += len(window)
+        prefilter_stats["docs_skipped"] += has_candidates.count(False)
+
+        for keep in has_candidates:
+            yield next(docs) if keep else None
+
+
+def load_rule_based_pipeline(
+    sentence_segmenter: str = SIMPLE_SENTENCE_SEGMENTER,
+) -> Language:
+    """Loads the spaCy pipeline for the rule-based extractor, keeping only what is
+    needed to find sentence boundaries
+
+    Args:
+        sentence_segmenter (str): Where sentence boundaries come from:
+            - "full": the complete en_core_web_md pipeline (dependency parser)
+            - "parser": en_core_web_md's dependency parser, with the other
+              components excluded
+            - "senter": en_core_web_md's lighter statistical sentence recognizer
+            - "sentencizer": spaCy's rule-based sentencizer on a blank English
+              pipeline. Loads no model weights or vectors
+
+    Returns:
+        Language: The loaded pipeline
+    """
+    if sentence_segmenter == "full":
+        return spacy.load("en_core_web_md")
+
+    if sentence_segmenter == "parser":
+        return spacy.load("en_core_web_md", exclude=UNUSED_COMPONENTS)
+
+    if sentence_segmenter == "senter":
+        nlp = spacy.load(
+            "en_core_web_md", exclude=UNUSED_COMPONENTS + ["tok2vec", "parser"]
+        )
+        nlp.enable_pipe("senter")  # Shipped disabled in favour of the parser
+        return nlp
+
+    if sentence_segmenter == "sentencizer":
+        # The English tokenizer settings are the same as en_core_web_md's
+        nlp = spacy.blank("en")
+        nlp.add_pipe("sentencizer")
+        return nlp
+
+    raise ValueError(f"Unknown sentence segmenter: {sentence_segmenter}")
+
+
+def doc_sentence_spans(doc: Doc) -> List[Tuple[int, int]]:
+    """The start and end offsets of a processed doc's sentences"""
+    return [(sentence.start_char, sentence.end_char) for sentence in doc.sents]
+
+
+def pipeline_version(nlp: Language) -> str:
+    """Identifies a loaded pipeline by its name, version and a hash of its meta,
+    which changes with its components and recorded scores when it is retrained"""
+    meta_hash = sha1(json.dumps(nlp.meta, sort_keys=True, default=str).encode())
+    return f"{nlp.meta['name']}-{nlp.meta['version']}-{meta_hash.hexdigest()[:12]}"
+
+
 class SimpleAbbreviationExtractor:
-    def __init__(self) -> None:
-        self.nlp = spacy.load("en_core_web_md")
+    """Schwartz & Hearst extraction over a spaCy pipeline's tokens and sentences
+
+    Args:
+        sentence_segmenter (str): Where sentence boundaries come from, see
+            `load_rule_based_pipeline`
+        prefilter (bool): Whether abstracts and sentences without candidate
+            parentheses skip the pipeline and the matcher
+    """
+
+    def __init__(
+        self,
+        sentence_segmenter: str = SIMPLE_SENTENCE_SEGMENTER,
+        prefilter: bool = SIMPLE_PREFILTER,
+    ) -> None:
+        self.sentence_segmenter = sentence_segmenter
+        self.prefilter = prefilter
+        self.nlp = load_rule_based_pipeline(sentence_segmenter)
 
         # The algorithm treats hyphenated words as single words, hence we do not wish to tokenize them for just this
         # engineering use-case. The handling of data, tokenized or otherwise, can be optimized for downstream tasks in this manner.
@@ -117,6 +188,17 @@ class SimpleAbbreviationExtractor:
         self.matcher = Matcher(self.nlp.vocab)
         self.matcher.add("bracketed", [BRACKETED_RULE])
 
+        # How many documents and sentences were skipped by the pre-screen
+        self.prefilter_stats: Counter = Counter()
+
+    @property
+    def version(self) -> str:
+        """Identifies the extractor, pipeline and settings that produce its output"""
+        return (
+            f"spacy-rules-{RULES_VERSION}:spacy-{spacy.__version__}:"
+            f"{pipeline_version(self.nlp)}:{self.sentence_segmenter}"
+        )
+
     def find_abbreviations(self, text: str):
         """Implements the rule-based abbreviation
             extraction algorithm proposed by Schwartz and Hearst (2003).
@@ -131,27 +213,124 @@ class SimpleAbbreviationExtractor:
                 gives an abbreviation along with its in-place sentence
                 and its definition.
         """
-        processed_text = self.nlp(text)
-        all_abbreviations = []
+        self.prefilter_stats["docs"] += 1
+        if self.prefilter and not has_candidate_parentheses(text):
+            self.prefilter_stats["docs_skipped"] += 1
+            return np.array([])
+        with stage("simple.spacy", 1):
+            processed_text = self.nlp(text)
+        return to_array(self.abbreviations_from_doc(processed_text))
+
+    def find_abbreviations_batch(
+        self, texts: Iterable[str], batch_size: int = EXTRACTION_BATCH_SIZE
+    ) -> Iterator[List[Abbreviation]]:
+        """Batched equivalent of `find_abbreviations`. Texts are streamed through
+        `nlp.pipe` so spaCy can process them in batches. With the prefilter on,
+        texts without candidate parentheses can't contain an abbreviation, so they
+        skip the pipeline
 
-        for sent in processed_text.sents:
-            parentheses_words = self.matcher(sent)
-            parentheses_with_candidates = find_abbreviation_candidates(
-                sent, parentheses_words
+        Args:
+            texts (Iterable[str]): strings in which to find the abbreviations
+            batch_size (int): The number of texts spaCy processes at a time
+
+        Yields:
+            List[Abbreviation]: The abbreviations found in each text, in order
+        """
+
+        for abbreviations, _ in self.find_abbreviations_and_sentences(
+            texts, batch_size
+        ):
+            yield abbreviations
+
+    def find_abbreviations_and_sentences(
+        self, texts: Iterable[str], batch_size: int = EXTRACTION_BATCH_SIZE
+    ) -> Iterator[Tuple[List[Abbreviation], Optional[List[Tuple[int, int]]]]]:
+        """Equivalent of `find_abbreviations_batch`, also yielding the sentences
+        the pipeline split each text into, see `propagation.PropagatingExtractor`
+
+        Yields:
+            Tuple[List[Abbreviation], Optional[List[Tuple[int, int]]]]: The
+                abbreviations found in each text, and the start and end offsets
+                of its sentences, or None if the prefilter skipped it
+        """
+
+        def pipe(texts):
+            return timed_iter(
+                "simple.spacy", self.nlp.pipe(texts, batch_size=batch_size)
             )
 
-            for possible_solution in parentheses_with_candidates:
-                abbreviation_definition = match_abbreviation(
-                    possible_solution[0], possible_solution[1]
+        if not self.prefilter:
+            for processed_text in pipe(texts):
+                self.prefilter_stats["docs"] += 1
+                abbreviations = self.abbreviations_from_doc(processed_text)
+                yield abbreviations, doc_sentence_spans(processed_text)
+            return
+
+        for processed_text in pipe_prefiltered(texts, pipe, self.prefilter_stats):
+            if processed_text is None:
+                yield [], None
+            else:
+                abbreviations = self.abbreviations_from_doc(processed_text)
+                yield abbreviations, doc_sentence_spans(processed_text)
+
+    def sentence_spans(self, text: str) -> List[Tuple[int, int]]:
+        """The start and end offsets of the text's sentences, as the pipeline
+        splits them"""
+        with stage("simple.spacy", 1):
+            return doc_sentence_spans(self.nlp(text))
+
+    def abbreviations_from_doc(self, processed_text: Doc) -> List[Abbreviation]:
+        """Runs the abbreviation matching over an already-processed spaCy Doc
+
+        Args:
+            processed_text (Doc): The output of the extractor's pipeline
+
+        Returns:
+            List[Abbreviation]: The abbreviations found, and where they are
+        """
+        all_abbreviations = []
+        text = processed_text.text
+
+        num_sentences = num_skipped = 0
+        for sentence_index, sent in enumerate(processed_text.sents):
+            num_sentences += 1
+            if self.prefilter and not has_candidate_parentheses(
+                text, sent.start_char, sent.end_char
+            ):
+                num_skipped += 1
+                continue
+
+            with stage("simple.candidates", 1):
+                parentheses_words = self.matcher(sent)
+                parentheses_with_candidates = find_abbreviation_candidates(
+                    sent, parentheses_words
                 )
-                if abbreviation_definition is not None:
-                    all_abbreviations.append(
-                        np.array(
-                            [sent.text, possible_solution[0], abbreviation_definition]
-                        )
+
+            with stage("match_abbreviation", len(parentheses_with_candidates)):
+                for short_form, long_form in parentheses_with_candidates:
+                    abbreviation_definition = match_abbreviation(
+                        short_form.text, long_form.text
                     )
+                    if abbreviation_definition is not None:
+                        # The definition is the end of the candidate long form
+                        all_abbreviations.append(
+                            Abbreviation(
+                                sent.text,
+                                short_form.text,
+                                abbreviation_definition,
+                                sentence_index,
+                                sent.start_char,
+                                sent.end_char,
+                                short_form.start_char,
+                                short_form.end_char,
+                                long_form.end_char - len(abbreviation_definition),
+                                long_form.end_char,
+                            )
+                        )
 
-        return np.array(all_abbreviations)
+        self.prefilter_stats["sentences"] += num_sentences
+        self.prefilter_stats["sentences_skipped"] += num_skipped
+        return all_abbreviations
 
 
 def heuristic_abbreviation_match(found_entities: List[spacy.tokens.span.Span]):
@@ -177,8 +356,47 @@ def heuristic_abbreviation_match(found_entities: List[spacy.tokens.span.Span]):
 
 
 class BertAbbreviationExtractor:
-    def __init__(self, base_name) -> None:
+    """Finds abbreviations with a fine-tuned NER model, pairing the short and long
+    forms it tags
+
+    Args:
+        base_name (str): The model's name or path
+        token_budget (int): The maximum padded size of a batch, see
+            `batching.length_bucketed_batches`
+        prefilter (bool): Whether to skip the model for abstracts without candidate
+            parentheses. Faster, but loses abbreviations the model finds outside
+            of parentheses
+        onnx_path (Optional[str]): If given, an ONNX export of the model's
+            transformer to run on the CPU instead. `onnx_inference.export_onnx`
+            only keeps exports that tag the same entities as the model
+    """
+
+    def __init__(
+        self,
+        base_name,
+        token_budget: int = INFERENCE_TOKEN_BUDGET,
+        prefilter: bool = ML_PREFILTER,
+        onnx_path: Optional[str] = None,
+    ) -> None:
         self.nlp = spacy.load(base_name)
+        self.onnx_digest = None
+        if onnx_path:
+            # Only imported when used, so ONNX Runtime stays an optional dependency
+            from onnx_inference import use_onnx_transformer
+
+            self.onnx_digest = use_onnx_transformer(self.nlp, onnx_path)
+        self.token_budget = token_budget
+        self.prefilter = prefilter
+        # How many documents and sentences were skipped by the pre-screen
+        self.prefilter_stats: Counter = Counter()
+
+    @property
+    def version(self) -> str:
+        """Identifies the extractor, model and settings that produce its output"""
+        version = f"bert:spacy-{spacy.__version__}:{pipeline_version(self.nlp)}"
+        if self.onnx_digest is not None:
+            version += f":onnx-{self.onnx_digest}"
+        return f"{version}:prefilter" if self.prefilter else version
 
     def find_abbreviations(self, text: str):
         """
@@ -192,14 +410,115 @@ class BertAbbreviationExtractor:
                 gives an abbreviation along with its in-place sentence
                 and its definition.
         """
-        processed_text = self.nlp(text)
+        if self.prefilter:
+            self.prefilter_stats["docs"] += 1
+            if not has_candidate_parentheses(text):
+                self.prefilter_stats["docs_skipped"] += 1
+                return np.array([])
+        with stage("bert.spacy", 1):
+            processed_text = self.nlp(text)
+        return to_array(self.abbreviations_from_doc(processed_text))
+
+    def find_abbreviations_batch(
+        self, texts: Iterable[str], batch_size: int = EXTRACTION_BATCH_SIZE
+    ) -> Iterator[List[Abbreviation]]:
+        """Batched equivalent of `find_abbreviations`. Texts of similar length are
+        batched together up to the extractor's token budget, so the transformer
+        runs on whole batches with little padding. With the prefilter on, texts
+        without candidate parentheses skip the model
+
+        Args:
+            texts (Iterable[str]): strings in which to find the abbreviations
+            batch_size (int): The maximum number of texts the model processes at a
+                time
+
+        Yields:
+            List[Abbreviation]: The abbreviations found in each text, in order
+        """
+
+        for abbreviations, _ in self.find_abbreviations_and_sentences(
+            texts, batch_size
+        ):
+            yield abbreviations
+
+    def find_abbreviations_and_sentences(
+        self, texts: Iterable[str], batch_size: int = EXTRACTION_BATCH_SIZE
+    ) -> Iterator[Tuple[List[Abbreviation], Optional[List[Tuple[int, int]]]]]:
+        """Equivalent of `find_abbreviations_batch`, also yielding the sentences
+        the pipeline split each text into, see `propagation.PropagatingExtractor`
+
+        Yields:
+            Tuple[List[Abbreviation], Optional[List[Tuple[int, int]]]]: The
+                abbreviations found in each text, and the start and end offsets
+                of its sentences, or None if the prefilter skipped it
+        """
+
+        def pipe(texts):
+            return timed_iter(
+                "bert.spacy",
+                pipe_length_bucketed(
+                    self.nlp, texts, self.token_budget, max_batch_size=batch_size
+                ),
+            )
+
+        if not self.prefilter:
+            for processed_text in pipe(texts):
+                abbreviations = self.abbreviations_from_doc(processed_text)
+                yield abbreviations, doc_sentence_spans(processed_text)
+            return
+
+        for processed_text in pipe_prefiltered(texts, pipe, self.prefilter_stats):
+            if processed_text is None:
+                yield [], None
+            else:
+                abbreviations = self.abbreviations_from_doc(processed_text)
+                yield abbreviations, doc_sentence_spans(processed_text)
+
+    def sentence_spans(self, text: str) -> List[Tuple[int, int]]:
+        """The start and end offsets of the text's sentences, as the pipeline
+        splits them"""
+        with stage("bert.spacy", 1):
+            return doc_sentence_spans(self.nlp(text))
+
+    def abbreviations_from_doc(self, processed_text: Doc) -> List[Abbreviation]:
+        """Pairs the entities the model found in an already-processed spaCy Doc
+
+        Args:
+            processed_text (Doc): The output of the extractor's pipeline
+
+        Returns:
+            List[Abbreviation]: The abbreviations found, and where they are
+        """
         all_abbreviations = []
 
-        for sent in processed_text.sents:
-            found_abbreviations = heuristic_abbreviation_match(sent.ents)
+        num_sentences = num_skipped = 0
+        for sentence_index, sent in enumerate(processed_text.sents):
+            num_sentences += 1
+            sent_ents = sent.ents
+            # The heuristic pairs a long form with the short form right after it
+            if len(sent_ents) < 2:
+                num_skipped += 1
+                continue
+
+            found_abbreviations = heuristic_abbreviation_match(sent_ents)
 
             if found_abbreviations:
-                for found_pair in found_abbreviations:
-                    all_abbreviations.append(np.array([sent, *found_pair]))
+                for short_form, long_form in found_abbreviations:
+                    all_abbreviations.append(
+                        Abbreviation(
+                            sent.text,
+                            short_form.text,
+                            long_form.text,
+                            sentence_index,
+                            sent.start_char,
+                            sent.end_char,
+                            short_form.start_char,
+                            short_form.end_char,
+                            long_form.start_char,
+                            long_form.end_char,
+                        )
+                    )
 
-        return np.array(all_abbreviations)
+        self.prefilter_stats["sentences"] += num_sentences
+        self.prefilter_stats["sentences_skipped"] += num_skipped
+        return all_abbreviations
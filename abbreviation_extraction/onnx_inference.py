@@ -0,0 +1,297 @@
+from hashlib import sha1
+from itertools import islice
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+import argparse
+import tempfile
+
+import numpy as np
+import onnxruntime
+import spacy
+import torch
+from spacy.language import Language
+from spacy.tokens import Doc
+from transformers.modeling_outputs import BaseModelOutput
+
+from config import ARTICLE_READ_PATH, MODEL_READ_PATH, ONNX_CHECK_ARTICLES
+from config import ONNX_NUM_THREADS, TARGET_ELEMENTS
+from utils import iter_articles
+
+ONNX_OPSET = 13
+
+# Run through a swapped pipeline to check the session is what computes its states
+PROBE_TEXT = "Magnetic resonance imaging (MRI) was performed."
+
+# Every export must tag these exactly as the spaCy transformer does, see
+# `check_export`. Abstracts from the articles are added to them when exporting
+CHECK_TEXTS = (
+    PROBE_TEXT,
+    "Levels of reactive oxygen species (ROS) rose, and ROS scavengers were added.",
+    "Patients with chronic obstructive pulmonary disease (COPD) or asthma were "
+    "enrolled. COPD was confirmed by spirometry (FEV1/FVC < 0.7).",
+    "The World Health Organization (WHO) and the U.S. Food and Drug "
+    "Administration (FDA) issued guidance.",
+    "No abbreviations are defined in this sentence.",
+)
+
+# Sequence axes are dynamic, so one export serves every batch shape
+DYNAMIC_AXES = {
+    "input_ids": {0: "batch", 1: "sequence"},
+    "attention_mask": {0: "batch", 1: "sequence"},
+    "last_hidden_state": {0: "batch", 1: "sequence"},
+}
+
+
+def transformer_shim(nlp: Language):
+    """The PyTorch shim that holds the Hugging Face model inside the pipeline's
+    spacy-transformers component"""
+    return nlp.get_pipe("transformer").model.layers[0].shims[0]
+
+
+def file_digest(path: str) -> str:
+    """Identifies an exported model by its contents"""
+    digest = sha1()
+    with open(path, "rb") as model_file:
+        for block in iter(lambda: model_file.read(2**20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+class LastHiddenState(torch.nn.Module):
+    """Exports only the transformer's last hidden states, which are all the NER
+    component reads"""
+
+    def __init__(self, model: torch.nn.Module) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+
+class OnnxTransformer(torch.nn.Module):
+    """Stands in for the Hugging Face model inside a spacy-transformers pipeline,
+    running an exported model through ONNX Runtime instead. It takes and returns
+    the same tensors, so tokenization, alignment and the NER component that
+    decodes the SF/LF spans are all still spaCy's own
+
+    Args:
+        session (onnxruntime.InferenceSession): The exported model
+        config: The replaced model's config, which spacy-transformers reads when
+            serializing the pipeline
+    """
+
+    def __init__(self, session: onnxruntime.InferenceSession, config=None) -> None:
+        super().__init__()
+        self.session = session
+        self.config = config
+        self.input_names = [model_input.name for model_input in session.get_inputs()]
+        # Forward passes run, so callers can check the session is in use
+        self.calls = 0
+
+    @property
+    def device(self) -> torch.device:
+        """Where spacy-transformers puts the model's inputs. The session runs on
+        the CPU"""
+        return torch.device("cpu")
+
+    def forward(self, input_ids, attention_mask=None, **kwargs):
+        self.calls += 1
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        (last_hidden_state,) = self.session.run(
+            None,
+            {
+                name: inputs[name].cpu().numpy().astype(np.int64)
+                for name in self.input_names
+            },
+        )
+        return BaseModelOutput(last_hidden_state=torch.from_numpy(last_hidden_state))
+
+
+def load_session(onnx_path: str, num_threads: int = ONNX_NUM_THREADS):
+    """Opens an exported model on the CPU, with all graph optimisations on
+
+    Args:
+        onnx_path (str): The exported model
+        num_threads (int): Threads per operator. 0 leaves it to ONNX Runtime
+
+    Returns:
+        onnxruntime.InferenceSession: The session
+    """
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = num_threads
+    return onnxruntime.InferenceSession(
+        onnx_path, options, providers=["CPUExecutionProvider"]
+    )
+
+
+def use_onnx_transformer(
+    nlp: Language, onnx_path: str, num_threads: int = ONNX_NUM_THREADS
+) -> str:
+    """Swaps a loaded pipeline's transformer for an exported one, in place.
+    spacy-transformers calls the shim's model but reads the input device from its
+    Hugging Face objects, so both are replaced. A probe text is then run through
+    the pipeline to check the session really receives its inputs
+
+    Args:
+        nlp (Language): A pipeline loaded from the model `onnx_path` was exported
+            from
+        onnx_path (str): The exported model, from `export_onnx`
+        num_threads (int): Threads per operator. 0 leaves it to ONNX Runtime
+
+    Returns:
+        str: The digest of the exported model, to identify its output
+
+    Raises:
+        RuntimeError: If the pipeline does not run the exported model
+    """
+    shim = transformer_shim(nlp)
+    onnx_model = OnnxTransformer(
+        load_session(onnx_path, num_threads), getattr(shim._model, "config", None)
+    )
+    shim._model = onnx_model
+    shim._hfmodel.transformer = onnx_model
+
+    nlp(PROBE_TEXT)
+    if not onnx_model.calls:
+        raise RuntimeError(
+            f"{onnx_path} was loaded, but the pipeline did not run it on a probe text"
+        )
+    return file_digest(onnx_path)
+
+
+def doc_entities(doc: Doc) -> List[Tuple[int, int, str]]:
+    """The character spans and labels of a doc's entities"""
+    return [(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents]
+
+
+def check_export(model_path: str, onnx_path: str, texts: Sequence[str]) -> None:
+    """Runs texts through the spaCy pipeline with and without an export swapped
+    in, and checks they tag the same SF/LF entities in every one
+
+    Args:
+        model_path (str): The spaCy pipeline the export was made from
+        onnx_path (str): The exported model
+        texts (Sequence[str]): The texts to compare on
+
+    Raises:
+        RuntimeError: If any text's entities differ
+    """
+    reference = spacy.load(model_path)
+    candidate = spacy.load(model_path)
+    use_onnx_transformer(candidate, onnx_path)
+
+    mismatches = [
+        text
+        for text, expected, actual in zip(
+            texts, reference.pipe(texts), candidate.pipe(texts)
+        )
+        if doc_entities(expected) != doc_entities(actual)
+    ]
+    if mismatches:
+        raise RuntimeError(
+            f"{onnx_path} tags different entities from {model_path} in "
+            f"{len(mismatches)} of {len(texts)} texts, e.g. {mismatches[0]!r}"
+        )
+
+
+def export_onnx(
+    model_path: str,
+    onnx_path: str,
+    quantize: bool = False,
+    check_texts: Optional[Sequence[str]] = CHECK_TEXTS,
+) -> None:
+    """Exports the transformer of a fine-tuned spaCy pipeline to ONNX, then checks
+    the export tags the same entities as the pipeline, see `check_export`
+
+    Args:
+        model_path (str): The spaCy pipeline, e.g. the RoBERTa abbreviation model
+        onnx_path (str): Where to write the exported model
+        quantize (bool): Whether to quantize the weights to int8. Activations
+            are quantized dynamically at inference time
+        check_texts (Optional[Sequence[str]]): The texts to check the export on.
+            None skips the check, for the benchmark, which measures how closely
+            the entities agree instead
+
+    Raises:
+        RuntimeError: If the export tags different entities in any check text. The
+            export is deleted, so it can't be used by mistake
+    """
+    nlp = spacy.load(model_path)
+    model = transformer_shim(nlp)._model.cpu().eval()
+
+    # Any ids will do for tracing
+    input_ids = torch.ones((2, 16), dtype=torch.int64)
+    attention_mask = torch.ones((2, 16), dtype=torch.int64)
+
+    Path(onnx_path).parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory() as export_dir:
+        export_path = str(Path(export_dir) / "model.onnx") if quantize else onnx_path
+        with torch.no_grad():
+            torch.onnx.export(
+                LastHiddenState(model),
+                (input_ids, attention_mask),
+                export_path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes=DYNAMIC_AXES,
+                opset_version=ONNX_OPSET,
+            )
+
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            quantize_dynamic(export_path, onnx_path, weight_type=QuantType.QInt8)
+
+    if check_texts is not None:
+        try:
+            check_export(model_path, onnx_path, check_texts)
+        except RuntimeError:
+            Path(onnx_path).unlink()
+            raise
+
+
+def article_abstracts(read_location: str, limit: int) -> List[str]:
+    """The first `limit` abstracts of an articles file"""
+    column = list(TARGET_ELEMENTS.values()).index("abstract")
+    abstracts = (
+        article[column] for article in iter_articles(read_location) if article[column]
+    )
+    return list(islice(abstracts, limit))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the ML extractor's transformer to ONNX for CPU inference"
+    )
+    parser.add_argument("--model", default=MODEL_READ_PATH)
+    parser.add_argument("--output", default="models/roberta.onnx")
+    parser.add_argument(
+        "--quantize", action="store_true", help="Quantize the weights to int8"
+    )
+    parser.add_argument(
+        "--check-articles",
+        default=ARTICLE_READ_PATH,
+        help="Articles whose abstracts the export must tag exactly as the model "
+        "does. Empty checks only the built-in texts",
+    )
+    parser.add_argument(
+        "--check-limit",
+        type=int,
+        default=ONNX_CHECK_ARTICLES,
+        help="How many abstracts to check on",
+    )
+    args = parser.parse_args()
+
+    check_texts = list(CHECK_TEXTS)
+    if args.check_articles:
+        check_texts += article_abstracts(args.check_articles, args.check_limit)
+
+    export_onnx(args.model, args.output, args.quantize, check_texts)
+    print(
+        f"Exported {args.model} to {args.output}, with the same entities in "
+        f"{len(check_texts)} texts"
+    )
@@ -0,0 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+import asyncio
+
+import pandas as pd
+from tqdm import tqdm
+
+from checkpoint import ExtractorCheckpoint
+from config import ARTICLE_CHUNK_SIZE, PIPELINE_QUEUE_SIZE
+from dictionary import AbbreviationDictionary
+from sinks import OutputSink
+from utils import clean_data, iter_article_chunks
+
+# Marks the end of the stream on a queue
+END = None
+
+
+class PipelineStage:
+    """One extractor's branch of the pipeline: its extraction and its output
+
+    Args:
+        name (str): The extractor's name, for logging
+        extract (Callable[[pd.DataFrame], pd.DataFrame]): Turns a chunk of cleaned
+            articles into its abbreviations, e.g. `get_abbreviations` bound to an
+            extractor
+        sink (OutputSink): Where the abbreviations are written
+        checkpoint (Optional[ExtractorCheckpoint]): If given, articles it records
+            as done are skipped, and each chunk is recorded once written
+        dictionary (Optional[AbbreviationDictionary]): If given, each chunk's
+            abbreviations are also folded into it once written
+    """
+
+    def __init__(
+        self,
+        name: str,
+        extract: Callable[[pd.DataFrame], pd.DataFrame],
+        sink: OutputSink,
+        checkpoint: Optional[ExtractorCheckpoint] = None,
+        dictionary: Optional[AbbreviationDictionary] = None,
+    ) -> None:
+        self.name = name
+        self.extract = extract
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.dictionary = dictionary
+        # Each stage's extractor and sink are only used from their own thread
+        self.extract_executor = ThreadPoolExecutor(1, f"{name}-extract")
+        self.write_executor = ThreadPoolExecutor(1, f"{name}-write")
+
+    def shutdown(self) -> None:
+        self.extract_executor.shutdown()
+        self.write_executor.shutdown()
+
+
+def next_cleaned_chunk(chunks) -> Optional[pd.DataFrame]:
+    articles = next(chunks, END)
+    return END if articles is END else clean_data(articles)
+
+
+async def read_articles(
+    read_location: str, chunk_size: int, outboxes: List[asyncio.Queue]
+) -> None:
+    """Parses and cleans the articles a chunk at a time on a reader thread, and
+    hands every chunk to each extractor"""
+    loop = asyncio.get_running_loop()
+    chunks = iter_article_chunks(read_location, chunk_size)
+
+    with ThreadPoolExecutor(1, "reader") as reader, tqdm(unit=" articles") as progress:
+        while True:
+            cleaned_articles = await loop.run_in_executor(
+                reader, next_cleaned_chunk, chunks
+            )
+            if cleaned_articles is END:
+                break
+            progress.update(len(cleaned_articles))
+            for outbox in outboxes:
+                await outbox.put(cleaned_articles)
+
+    for outbox in outboxes:
+        await outbox.put(END)
+
+
+async def extract_chunks(
+    stage: PipelineStage, inbox: asyncio.Queue, outbox: asyncio.Queue
+) -> None:
+    """Runs a stage's extractor over each chunk still to be processed"""
+    loop = asyncio.get_running_loop()
+    while True:
+        cleaned_articles = await inbox.get()
+        if cleaned_articles is END:
+            break
+        if stage.checkpoint is not None:
+            cleaned_articles = stage.checkpoint.pending(cleaned_articles)
+        if not len(cleaned_articles):
+            continue
+
+        abbreviations = await loop.run_in_executor(
+            stage.extract_executor, stage.extract, cleaned_articles
+        )
+        await outbox.put((cleaned_articles, abbreviations))
+
+    await outbox.put(END)
+
+
+async def write_chunks(stage: PipelineStage, inbox: asyncio.Queue) -> None:
+    """Writes each chunk's abbreviations, replacing the output of any articles
+    written before, and adds them to the stage's dictionary if it has one, then
+    records the chunk as done"""
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await inbox.get()
+        if item is END:
+            break
+        cleaned_articles, abbreviations = item
+
+        # Changed articles' earlier rows go first, so the output never holds
+        # both versions. A crash before `mark_done` redoes the whole chunk
+        if stage.checkpoint is not None:
+            superseded = stage.checkpoint.superseded(cleaned_articles)
+            if superseded:
+                await loop.run_in_executor(
+                    stage.write_executor, stage.sink.remove_pmids, superseded
+                )
+        await loop.run_in_executor(
+            stage.write_executor, stage.sink.write, abbreviations
+        )
+        if stage.dictionary is not None:
+            await loop.run_in_executor(
+                stage.write_executor,
+                stage.dictionary.add,
+                abbreviations,
+                cleaned_articles["PMID"],
+            )
+        if stage.checkpoint is not None:
+            stage.checkpoint.mark_done(cleaned_articles)
+
+
+async def run_stages(
+    read_location: str, stages: List[PipelineStage], chunk_size: int, queue_size: int
+) -> None:
+    extract_queues = [asyncio.Queue(queue_size) for _ in stages]
+    write_queues = [asyncio.Queue(queue_size) for _ in stages]
+
+    await asyncio.gather(
+        read_articles(read_location, chunk_size, extract_queues),
+        *(
+            extract_chunks(stage, inbox, outbox)
+            for stage, inbox, outbox in zip(stages, extract_queues, write_queues)
+        ),
+        *(write_chunks(stage, inbox) for stage, inbox in zip(stages, write_queues)),
+    )
+
+
+def run_pipeline(
+    read_location: str,
+    stages: List[PipelineStage],
+    chunk_size: int = ARTICLE_CHUNK_SIZE,
+    queue_size: int = PIPELINE_QUEUE_SIZE,
+) -> None:
+    """Runs every extractor over the articles in a single pass. Reading, each
+    extractor and each writer run concurrently on their own threads, so parsing,
+    extraction and output overlap. Chunks are passed between them through bounded
+    queues, so a slow stage holds back the ones feeding it rather than letting
+    chunks pile up in memory.
+
+    Checkpoints and the manifest are only touched from the event loop's thread.
+
+    Args:
+        read_location (str): The XML file to read articles from. May be gzipped
+        stages (List[PipelineStage]): The extractors and their outputs
+        chunk_size (int): The number of articles to read at a time
+        queue_size (int): The number of chunks each queue holds before blocking
+    """
+    try:
+        asyncio.run(run_stages(read_location, stages, chunk_size, queue_size))
+    finally:
+        for stage in stages:
+            stage.shutdown()
@@ -0,0 +1,291 @@
+from bisect import bisect_right
+from collections import deque
+from hashlib import sha1
+from typing import Collection, Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import re
+
+from config import EXTRACTION_BATCH_SIZE, PROPAGATION_MIN_SHORT_FORM_LENGTH
+from metrics import stage
+from results import PROPAGATED, Abbreviation, to_array
+
+# Bumped whenever propagation's output changes, so cached results are not reused
+PROPAGATION_VERSION = "4"
+
+# Common English words, which are often written in capitals in headings or for
+# emphasis. Never resolved as short forms corpus-wide, see `is_corpus_short_form`
+CORPUS_STOP_WORDS = frozenset("""
+    a about after all also am an and any are as at be been before but by can did
+    do does each for from had has have he her here his how if in into is it its
+    may me more most my no nor not now of off on once only or other our out over
+    she so some such than that the their them then there these they this those
+    to too under up us was we were what when where which while who why will with
+    would yes yet you your
+    """.split())
+
+# Runs of word characters, and single punctuation characters. Short form mentions
+# must start and end on these boundaries, so "AS" is never found inside "ASD"
+BOUNDARY_RE = re.compile(r"\w+|[^\w\s]")
+
+
+class ShortFormScanner:
+    """Finds every mention of a set of short forms in a single pass over a text.
+
+    Rather than matching each short form separately, the scanner only considers
+    spans that start at one token boundary and end at another, no longer than the
+    longest short form, and looks each one up in hash sets. Short forms are at
+    most a handful of tokens, so a scan is linear in the length of the text
+    however many short forms there are.
+
+    Args:
+        short_forms (Collection[str]): The short forms to find, e.g. the keys of
+            a short form -> long form dict. Matching is case-sensitive
+    """
+
+    def __init__(self, short_forms: Collection[str]) -> None:
+        self.lookups = [short_forms]
+        self.max_length = max(map(len, short_forms), default=0)
+
+    def with_short_forms(self, short_forms: Collection[str]) -> "ShortFormScanner":
+        """A scanner that also finds the given short forms. The existing ones are
+        shared rather than copied, so extending a large scanner is cheap"""
+        scanner = ShortFormScanner(short_forms)
+        scanner.lookups += self.lookups
+        scanner.max_length = max(scanner.max_length, self.max_length)
+        return scanner
+
+    def __contains__(self, span: str) -> bool:
+        return any(span in lookup for lookup in self.lookups)
+
+    def find(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """Finds the mentions, leftmost-longest and without overlaps
+
+        Args:
+            text (str): The text to scan
+
+        Yields:
+            Tuple[int, int, str]: The start and end offsets of each mention, and
+                the short form found
+        """
+        if not self.max_length:
+            return
+
+        starts, ends = [], []
+        for token in BOUNDARY_RE.finditer(text):
+            starts.append(token.start())
+            ends.append(token.end())
+
+        index = 0
+        while index < len(starts):
+            start = starts[index]
+            found = None
+            # Tokens are at least a character long, so no more can fit
+            for end in ends[index : index + self.max_length]:
+                if end - start > self.max_length:
+                    break
+                if text[start:end] in self:
+                    found = end
+
+            if found is None:
+                index += 1
+                continue
+            yield start, found, text[start:found]
+            while index < len(starts) and starts[index] < found:
+                index += 1
+
+
+def is_corpus_short_form(short_form: str, min_length: int) -> bool:
+    """Whether a short form can be resolved in abstracts that don't define it.
+    Short ones are too ambiguous across the corpus, and common words would be
+    resolved wherever they are written in capitals"""
+    return len(short_form) >= min_length and short_form.lower() not in (
+        CORPUS_STOP_WORDS
+    )
+
+
+class PropagatingExtractor:
+    """Wraps an abbreviation extractor to also find later uses of the short forms
+    it defines. The extractors only report a short form in the sentence that
+    defines it, so for each abstract the short forms found are mapped to their
+    long forms, and every later sentence mentioning one of them gets a row too.
+    Mentions before the definition are left alone.
+
+    Each row's `source` is `results.DEFINITION` for the wrapped extractor's own
+    rows, or `results.PROPAGATED`, so propagated rows can be told apart
+    downstream, e.g. kept out of `dictionary.AbbreviationDictionary`.
+
+    Rows are placed in the sentences the wrapped extractor split the abstract
+    into, so they line up with its own rows. Abstracts its prefilter skipped are
+    only split, with its `sentence_spans`, if they mention a short form.
+
+    With a corpus-wide map, e.g. from `dictionary.AbbreviationDictionary`, short
+    forms defined in other abstracts are resolved as well, apart from short ones
+    and common words, see `is_corpus_short_form`. An abstract's own definitions
+    take precedence, and are resolved whatever their length.
+
+    Args:
+        extractor: The extractor to wrap, with `find_abbreviations_and_sentences`
+            and `sentence_spans` as well as `find_abbreviations_batch`
+        corpus_long_forms (Optional[Dict[str, str]]): The long form to use for
+            each short form not defined in the abstract itself
+        min_short_form_length (int): The shortest short form resolved through
+            the corpus-wide map
+    """
+
+    def __init__(
+        self,
+        extractor,
+        corpus_long_forms: Optional[Dict[str, str]] = None,
+        min_short_form_length: int = PROPAGATION_MIN_SHORT_FORM_LENGTH,
+    ) -> None:
+        self.extractor = extractor
+        self.corpus_long_forms = {
+            short_form: long_form
+            for short_form, long_form in (corpus_long_forms or {}).items()
+            if is_corpus_short_form(short_form, min_short_form_length)
+        }
+        self.corpus_scanner = ShortFormScanner(self.corpus_long_forms)
+
+        mode = "document"
+        if corpus_long_forms is not None:
+            corpus_json = json.dumps(sorted(self.corpus_long_forms.items()))
+            mode = f"corpus-{sha1(corpus_json.encode('utf-8')).hexdigest()[:12]}"
+        self.version = f"{extractor.version}:propagate{PROPAGATION_VERSION}-{mode}"
+
+    def find_abbreviations_batch(
+        self, texts: Iterable[str], batch_size: int = EXTRACTION_BATCH_SIZE
+    ) -> Iterator[List[Abbreviation]]:
+        """Equivalent of the wrapped extractor's `find_abbreviations_batch`, with
+        the propagated abbreviations after each text's own
+
+        Yields:
+            List[Abbreviation]: The abbreviations found in each text, in order,
+                with their source
+        """
+        # The extractor reads each text before yielding its result
+        pending = deque()
+
+        def remember(texts):
+            for text in texts:
+                pending.append(text)
+                yield text
+
+        for abbreviations, sentences in self.extractor.find_abbreviations_and_sentences(
+            remember(texts), batch_size=batch_size
+        ):
+            yield abbreviations + self.propagate(
+                pending.popleft(), abbreviations, sentences
+            )
+
+    def find_abbreviations(self, text: str):
+        """Equivalent of the wrapped extractor's `find_abbreviations`"""
+        return to_array(next(self.find_abbreviations_batch([text])))
+
+    def propagate(
+        self,
+        text: str,
+        abbreviations: List[Abbreviation],
+        sentences: Optional[List[Tuple[int, int]]] = None,
+    ):
+        """Resolves the short form mentions in a text after the sentences that
+        define them. Short forms only resolved through the corpus-wide map aren't
+        defined in the text, so all of their mentions are resolved
+
+        Args:
+            text (str): The abstract
+            abbreviations (List[Abbreviation]): The abbreviations the extractor
+                found in it
+            sentences (Optional[List[Tuple[int, int]]]): The start and end offsets
+                of the sentences the extractor split it into. If not given, it is
+                split with the extractor's `sentence_spans` when needed
+
+        Returns:
+            List[Abbreviation]: A `results.PROPAGATED` row for each sentence
+                mentioning a short form, in order. The long form's offsets are
+                those of the first definition, or -1 for one from the corpus map
+        """
+        definitions: Dict[str, Abbreviation] = {}
+        defining_spans: Dict[str, List[Tuple[int, int]]] = {}
+        for abbreviation in abbreviations:
+            definitions.setdefault(abbreviation.short_form, abbreviation)
+            defining_spans.setdefault(abbreviation.short_form, []).append(
+                (abbreviation.sentence_start, abbreviation.sentence_end)
+            )
+        long_forms = {
+            short_form: definition.long_form
+            for short_form, definition in definitions.items()
+        }
+        # Mentions are only resolved after the end of the first definition
+        definition_ends = {
+            short_form: min(end for _, end in spans)
+            for short_form, spans in defining_spans.items()
+        }
+
+        if not long_forms and not self.corpus_long_forms:
+            return []
+        scanner = self.corpus_scanner.with_short_forms(long_forms)
+
+        with stage("propagate", 1):
+            mentions = []
+            for start, end, short_form in scanner.find(text):
+                if short_form in long_forms and start < definition_ends[short_form]:
+                    continue
+                if any(
+                    span_start <= start and end <= span_end
+                    for span_start, span_end in defining_spans.get(short_form, ())
+                ):
+                    continue
+                mentions.append((start, end, short_form))
+            if not mentions:
+                return []
+
+        if sentences is None:
+            sentences = self.extractor.sentence_spans(text)
+
+        with stage("propagate"):
+            sentence_starts = [start for start, _ in sentences]
+
+            propagated = []
+            seen = set()
+            for start, end, short_form in mentions:
+                sentence_index = bisect_right(sentence_starts, start) - 1
+                if sentence_index < 0 or (sentence_index, short_form) in seen:
+                    continue
+                sentence_start, sentence_end = sentences[sentence_index]
+                if end > sentence_end:  # Between or across sentences
+                    continue
+                seen.add((sentence_index, short_form))
+
+                definition = definitions.get(short_form)
+                if definition is not None:
+                    long_form = definition.long_form
+                    long_start = definition.long_form_start
+                    long_end = definition.long_form_end
+                else:
+                    long_form = self.corpus_long_forms[short_form]
+                    long_start = long_end = -1
+                propagated.append(
+                    Abbreviation(
+                        text[sentence_start:sentence_end],
+                        short_form,
+                        long_form,
+                        sentence_index,
+                        sentence_start,
+                        sentence_end,
+                        start,
+                        end,
+                        long_start,
+                        long_end,
+                        PROPAGATED,
+                    )
+                )
+
+        return propagated
+
+
+def build_propagating_extractor(
+    extractor_class, corpus_long_forms: Optional[Dict[str, str]] = None
+) -> PropagatingExtractor:
+    """Builds an extractor and wraps it in a `PropagatingExtractor`. Picklable, so
+    it can be passed to `main.open_pool` in place of an extractor class"""
+    return PropagatingExtractor(extractor_class(), corpus_long_forms)
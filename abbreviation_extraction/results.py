@@ -0,0 +1,252 @@
+from array import array
+from typing import Dict, Iterable, List, NamedTuple
+
+import numpy as np
+import pandas as pd
+
+OUTPUT_COLUMNS = ["article_title", "PMID", "sentence", "short_form", "long_form"]
+
+# Where a row came from: a definition the extractor found, or a later mention of
+# a defined short form. Written as a `source` column when propagating
+DEFINITION = "definition"
+PROPAGATED = "propagated"
+SOURCES = [DEFINITION, PROPAGATED]
+SOURCE_COLUMN = "source"
+
+
+class Abbreviation(NamedTuple):
+    """A single extracted abbreviation, and where the extractor found it. Offsets
+    are character offsets into the abstract, or -1 where the text isn't in it,
+    such as a long form only defined in another abstract"""
+
+    sentence: str
+    short_form: str
+    long_form: str
+    # The sentence's position among all of the abstract's sentences, as the
+    # extractor split them, whether or not they hold an abbreviation
+    sentence_index: int = -1
+    sentence_start: int = -1
+    sentence_end: int = -1
+    short_form_start: int = -1
+    short_form_end: int = -1
+    long_form_start: int = -1
+    long_form_end: int = -1
+    # A definition the extractor found, or a mention found by
+    # `propagation.PropagatingExtractor`
+    source: str = DEFINITION
+
+
+def to_array(abbreviations: List[Abbreviation]) -> np.ndarray:
+    """The output of an extractor's `find_abbreviations`: an array with a
+    (sentence, short form, long form) row per abbreviation"""
+    return np.array([abbreviation[:3] for abbreviation in abbreviations])
+
+
+# The offsets layout locates each row's sentence, short form and long form in the
+# abstract rather than repeating the sentence's text, see `Abbreviation`
+OFFSET_COLUMNS = [
+    "PMID",
+    "sentence_index",
+    "sentence_start",
+    "sentence_end",
+    "short_form_start",
+    "short_form_end",
+    "long_form_start",
+    "long_form_end",
+    "short_form",
+    "long_form",
+]
+
+# The optional sentence table of the offsets layout, one row per sentence
+SENTENCE_COLUMNS = ["PMID", "sentence_index", "sentence"]
+
+# The columns written for each output layout
+LAYOUT_COLUMNS = {
+    "full": OUTPUT_COLUMNS,
+    "offsets": OFFSET_COLUMNS,
+    "sentences": SENTENCE_COLUMNS,
+}
+
+
+def source_code(source: str) -> int:
+    """The code of a row's source, its position in `SOURCES`"""
+    return SOURCES.index(source)
+
+
+def source_categories(source_codes) -> pd.Categorical:
+    return pd.Categorical.from_codes(source_codes, categories=SOURCES)
+
+
+class AbbreviationTable:
+    """Columnar buffer that extractor output is appended to, row by row.
+
+    Sentences and article titles are interned into shared tables and stored per
+    row as integer codes, so repeated text is held once rather than once per
+    abbreviation. The buffer converts straight to the output schema, with no
+    intermediate arrays or merge on PMID.
+    """
+
+    def __init__(self) -> None:
+        self.titles: Dict[str, int] = {}
+        self.sentences: Dict[str, int] = {}
+
+        self.title_codes = array("l")
+        self.sentence_codes = array("l")
+        self.pmids: List[str] = []
+        self.short_forms: List[str] = []
+        self.long_forms: List[str] = []
+        self.source_codes = array("b")
+
+    def __len__(self) -> int:
+        return len(self.pmids)
+
+    @staticmethod
+    def intern(table: Dict[str, int], text: str) -> int:
+        """Returns the code for the text in the table, adding it if needed"""
+        code = table.get(text)
+        if code is None:
+            code = table[text] = len(table)
+        return code
+
+    def extend(self, article_title, pmid, abbreviations: Iterable[Abbreviation]):
+        """Appends all abbreviations found in a single article
+
+        Args:
+            article_title (str): The article's title
+            pmid (str): The article's PMID
+            abbreviations (Iterable[Abbreviation]): The extractor's output for the
+                article's abstract
+        """
+        title_code = None
+
+        for abbreviation in abbreviations:
+            if title_code is None:  # Articles without abbreviations store nothing
+                # Missing titles are stored as pandas' missing category code
+                title_code = (
+                    -1
+                    if pd.isna(article_title)
+                    else self.intern(self.titles, article_title)
+                )
+
+            self.title_codes.append(title_code)
+            self.sentence_codes.append(
+                self.intern(self.sentences, abbreviation.sentence)
+            )
+            self.pmids.append(pmid)
+            self.short_forms.append(abbreviation.short_form)
+            self.long_forms.append(abbreviation.long_form)
+            self.source_codes.append(source_code(abbreviation.source))
+
+    def to_frame(self) -> pd.DataFrame:
+        """Builds the output dataframe. Titles and sentences become categorical
+        columns backed by the shared tables. Each row's source is in a `source`
+        column after the output schema's
+
+        Returns:
+            pd.DataFrame: A DataFrame containing sentence-per-row entries where each
+                row matches the task's given schema
+        """
+        return pd.DataFrame(
+            {
+                "article_title": pd.Categorical.from_codes(
+                    self.title_codes, categories=list(self.titles)
+                ),
+                "PMID": self.pmids,
+                "sentence": pd.Categorical.from_codes(
+                    self.sentence_codes, categories=list(self.sentences)
+                ),
+                "short_form": self.short_forms,
+                "long_form": self.long_forms,
+                SOURCE_COLUMN: source_categories(self.source_codes),
+            },
+            columns=OUTPUT_COLUMNS + [SOURCE_COLUMN],
+        )
+
+
+class OffsetAbbreviationTable:
+    """Columnar buffer for the offsets output layout. Rather than each row holding
+    its sentence's text, rows hold the PMID, an index for the sentence and the
+    offsets of the sentence, short form and long form in the abstract. Only the
+    short and long forms are kept as text.
+
+    The sentence index and offsets are the ones the extractor reports, see
+    `Abbreviation`, so a sentence's index counts every sentence before it in the
+    abstract. With `sentences`, each sentence's text is also kept once, so a
+    separate sentence table keyed on (PMID, sentence_index) can be written
+    alongside.
+
+    Args:
+        sentences (bool): Whether to keep the sentences' text, in a `sentence`
+            column of the frame
+    """
+
+    def __init__(self, sentences: bool = False) -> None:
+        self.keep_sentences = sentences
+        self.sentences: Dict[str, int] = {}
+
+        self.pmids: List[str] = []
+        self.sentence_codes = array("l")
+        self.offsets = {column: array("l") for column in OFFSET_COLUMNS[1:8]}
+        self.short_forms: List[str] = []
+        self.long_forms: List[str] = []
+        self.source_codes = array("b")
+
+    def __len__(self) -> int:
+        return len(self.pmids)
+
+    def extend(self, article_title, pmid, abbreviations: Iterable[Abbreviation]):
+        """Appends all abbreviations found in a single article
+
+        Args:
+            article_title (str): The article's title. Not part of this layout
+            pmid (str): The article's PMID
+            abbreviations (Iterable[Abbreviation]): The extractor's output for the
+                article's abstract
+        """
+        for abbreviation in abbreviations:
+            for name, column in self.offsets.items():
+                column.append(getattr(abbreviation, name))
+
+            if self.keep_sentences:
+                self.sentence_codes.append(
+                    AbbreviationTable.intern(self.sentences, abbreviation.sentence)
+                )
+            self.pmids.append(pmid)
+            self.short_forms.append(abbreviation.short_form)
+            self.long_forms.append(abbreviation.long_form)
+            self.source_codes.append(source_code(abbreviation.source))
+
+    def to_frame(self) -> pd.DataFrame:
+        """Builds the output dataframe, with each row's source in a `source` column
+        after the layout's columns, followed by a categorical `sentence` column if
+        the sentences are kept
+
+        Returns:
+            pd.DataFrame: A DataFrame with a row per abbreviation, in the offsets
+                layout
+        """
+        columns = {
+            "PMID": self.pmids,
+            **{
+                name: np.asarray(values, dtype=np.int32)
+                for name, values in self.offsets.items()
+            },
+            "short_form": self.short_forms,
+            "long_form": self.long_forms,
+            SOURCE_COLUMN: source_categories(self.source_codes),
+        }
+        if self.keep_sentences:
+            columns["sentence"] = pd.Categorical.from_codes(
+                self.sentence_codes, categories=list(self.sentences)
+            )
+        return pd.DataFrame(columns)
+
+
+def new_table(layout: str = "full", sentences: bool = False):
+    """Creates the buffer for an output layout: "full", the sentence text on every
+    row, or "offsets", see `OffsetAbbreviationTable`"""
+    if layout == "full":
+        return AbbreviationTable()
+    if layout == "offsets":
+        return OffsetAbbreviationTable(sentences)
+    raise ValueError(f"Unknown output layout: {layout}")
@@ -0,0 +1,393 @@
+from bisect import bisect_left
+from collections import Counter
+from typing import Iterable, Iterator, List, Optional, Tuple
+import re
+
+import numpy as np
+
+from config import SIMPLE_PREFILTER, SIMPLE_SHORT_FORM_FIRST
+from metrics import timed_iter
+from results import Abbreviation, to_array
+
+# Part of every rule-based extractor's version. Bump it whenever a change to the
+# algorithm changes its output, so that cached results are not reused
+RULES_VERSION = "2"
+
+# Finds every opening parenthesis along with the text up to the next closing one.
+# The lookahead lets groups overlap, as with the spaCy Matcher's BRACKETED_RULE
+PARENTHESES_RE = re.compile(r"\((?=([^)]*)\))")
+
+# Approximates the rule-based extractor's tokenizer: hyphenated words are kept
+# whole, other punctuation becomes its own token
+TOKEN_RE = re.compile(r"\w+(?:[-–—~'’.]\w+)*|[^\w\s]")
+
+# A sentence ends at terminal punctuation (plus closing quotes/brackets), followed
+# by whitespace and something that can start a sentence
+SENTENCE_BOUNDARY_RE = re.compile(r"[.!?][\"'’”)\]]*\s+(?=[\"'‘“(\[]?[A-Z0-9])")
+
+# Words ending in a period that rarely end a sentence in biomedical text, along
+# with titles and months that spaCy's tokenizer keeps whole, so never splits after
+NON_TERMINAL_WORDS = {
+    "al.",
+    "approx.",
+    "apr.",
+    "aug.",
+    "ca.",
+    "cf.",
+    "co.",
+    "corp.",
+    "dec.",
+    "dr.",
+    "e.g.",
+    "eq.",
+    "feb.",
+    "fig.",
+    "figs.",
+    "i.e.",
+    "inc.",
+    "jan.",
+    "jr.",
+    "ltd.",
+    "mr.",
+    "mrs.",
+    "ms.",
+    "no.",
+    "nov.",
+    "oct.",
+    "prof.",
+    "ref.",
+    "sep.",
+    "sept.",
+    "st.",
+    "vs.",
+}
+
+# Single letters and dotted initialisms, such as "a.", "U.S." or "Ph.D.", which
+# spaCy's tokenizer also keeps whole
+INITIALISM_RE = re.compile(r"[^\W\d_](?:[^\W\d_]*\.[^\W\d_]+)*\.")
+
+# What can follow a closing parenthesis that spaCy's tokenizer splits off. Groups
+# closed by anything else, as in "(ROS)/nitric oxide", are one token with the
+# following text, so neither engine treats them as parenthesised
+CLOSING_PARENTHESIS_RE = re.compile(r"\)(?=$|\s|[.,;!?\]}\"'’”]|\)|'s)")
+
+
+def match_abbreviation(short_form: str, long_form: str):
+    """Matches an abbreviation to preceeding long form defitions, if one exists.
+    Part of the Schwartz & Hearst abbreviation matching algorithm
+
+    Args:
+        short_form (str): The abbreviation
+        long_formm (str): The preceeding characters in which to search for a match
+
+    Returns:
+        str: The original short form's corresponding long form defition.
+    """
+    sf_index = len(short_form) - 1
+    lf_index = len(long_form) - 1
+
+    while sf_index >= 0:
+        # Store the next character to match. Ignore case
+        curr_char = short_form[sf_index].lower()
+        # ignore non alphanumeric characters
+        if not curr_char.isalnum():
+            sf_index -= 1
+            continue
+
+        while (lf_index >= 0 and long_form[lf_index].lower() != curr_char) or (
+            (sf_index == 0) and lf_index > 0 and long_form[lf_index - 1].isalnum()
+        ):
+            lf_index -= 1
+
+        if lf_index < 0:
+            return None
+
+        lf_index -= 1
+        sf_index -= 1
+
+    return long_form[lf_index + 1 :]
+
+
+def is_valid_short_form(short_form: str) -> bool:
+    """Criteria given by Schwartz and Hearst to constitute a valid abbreviation
+
+    Args:
+        short_form (str): The candidate abbreviation
+
+    Returns:
+        bool: Whether the candidate could be an abbreviation
+    """
+    short_len = len(short_form)
+    valid = short_form[0].isalnum()
+    valid = any(c.isalpha() for c in short_form) and valid
+    valid = (len(short_form.split()) <= 2) and valid
+    valid = short_len >= 2 and short_len <= 10 and valid
+    return valid
+
+
+def long_form_window(short_len: int) -> int:
+    """Long form has a max length in the paper, so we start selecting the
+    candidate pool at this number of words before the brackets"""
+    return min(short_len + 5, short_len * 2)
+
+
+def has_candidate_parentheses(
+    text: str, start: int = 0, end: Optional[int] = None
+) -> bool:
+    """Cheap pre-screen for text that could hold an abbreviation: every candidate
+    needs a "(" with a ")" after it. Both extractors' parenthesis rules can only
+    match where this is True, so text failing it can be skipped
+
+    Args:
+        text (str): The text to check
+        start (int): Only check from this character offset, e.g. a sentence's start
+        end (Optional[int]): Only check up to this offset
+
+    Returns:
+        bool: Whether the text contains a "(" followed later by a ")"
+    """
+    end = len(text) if end is None else end
+    open_parenthesis = text.find("(", start, end)
+    return open_parenthesis != -1 and text.find(")", open_parenthesis, end) != -1
+
+
+def split_sentences(text: str) -> Iterator[Tuple[int, int]]:
+    """Splits text into sentences using punctuation rules rather than a parser
+
+    Args:
+        text (str): The text to split
+
+    Yields:
+        Tuple[int, int]: The start and end character offsets of each sentence,
+            excluding surrounding whitespace
+    """
+    start = len(text) - len(text.lstrip())
+
+    for boundary in SENTENCE_BOUNDARY_RE.finditer(text):
+        last_word = text[start : boundary.start() + 1].rsplit(None, 1)[-1]
+        last_word = last_word.lstrip("\"'‘“([")
+        # Don't split after abbreviations, initials, or inside parentheses
+        if (
+            last_word.lower() in NON_TERMINAL_WORDS
+            or INITIALISM_RE.fullmatch(last_word)
+            or text.count("(", start, boundary.start())
+            > text.count(")", start, boundary.start())
+        ):
+            continue
+
+        yield start, boundary.start() + len(boundary.group().rstrip())
+        start = boundary.end()
+
+    end = len(text.rstrip())
+    if end > start:
+        yield start, end
+
+
+def find_sentence_abbreviations(
+    sentence: str, short_form_first: bool = SIMPLE_SHORT_FORM_FIRST
+) -> List[Tuple[str, str, int, int]]:
+    """Runs the Schwartz & Hearst algorithm over a single sentence of raw text
+
+    Args:
+        sentence (str): The sentence in which to find the abbreviations
+        short_form_first (bool): Whether to also match `<short form> (<long form>)`
+            when the parenthesised text is not itself a valid short form
+
+    Returns:
+        List[Tuple[str, str, int, int]]: The short form, long form, and their
+            start offsets in the sentence, of each pair in order
+    """
+    abbreviations = []
+    token_starts = None
+
+    for parentheses in PARENTHESES_RE.finditer(sentence):
+        parenthesis_word = parentheses.group(1).strip()
+        if not parenthesis_word or not CLOSING_PARENTHESIS_RE.match(
+            sentence, parentheses.end(1)
+        ):
+            continue
+        parenthesis_start = parentheses.start(1) + (
+            len(parentheses.group(1)) - len(parentheses.group(1).lstrip())
+        )
+
+        if token_starts is None:  # Only tokenize sentences containing parentheses
+            token_spans = [token.span() for token in TOKEN_RE.finditer(sentence)]
+            token_starts = [start for start, _ in token_spans]
+
+        parentheses_start = bisect_left(token_starts, parentheses.start())
+
+        if is_valid_short_form(parenthesis_word):
+            long_start = max(
+                0, parentheses_start - long_form_window(len(parenthesis_word))
+            )
+            if long_start == parentheses_start:
+                long_form, long_end = "", 0
+            else:
+                long_end = token_spans[parentheses_start - 1][1]
+                long_form = sentence[token_spans[long_start][0] : long_end]
+
+            abbreviation_definition = match_abbreviation(parenthesis_word, long_form)
+            if abbreviation_definition is not None:
+                # The definition is the end of the candidate long form
+                abbreviations.append(
+                    (
+                        parenthesis_word,
+                        abbreviation_definition,
+                        parenthesis_start,
+                        long_end - len(abbreviation_definition),
+                    )
+                )
+
+        elif short_form_first and parentheses_start > 0:
+            # The word just before the parentheses is the short form
+            short_start, short_end = token_spans[parentheses_start - 1]
+            short_form = sentence[short_start:short_end]
+            abbreviation_definition = match_short_form_first(
+                short_form, parenthesis_word
+            )
+            if abbreviation_definition is not None:
+                abbreviations.append(
+                    (
+                        short_form,
+                        abbreviation_definition,
+                        short_start,
+                        parenthesis_start
+                        + len(parenthesis_word)
+                        - len(abbreviation_definition),
+                    )
+                )
+
+    return abbreviations
+
+
+def match_short_form_first(short_form: str, long_form: str) -> Optional[str]:
+    """Matches a short form to the long form given in the parentheses after it
+
+    Args:
+        short_form (str): The word before the parentheses
+        long_form (str): The parenthesised text
+
+    Returns:
+        Optional[str]: The long form definition, if the pair is valid
+    """
+    if not is_valid_short_form(short_form):
+        return None
+    if len(long_form.split()) > long_form_window(len(short_form)):
+        return None
+    return match_abbreviation(short_form, long_form)
+
+
+class RegexAbbreviationExtractor:
+    """Schwartz & Hearst extraction on raw strings, without a spaCy pipeline.
+    Sentences come from `split_sentences` and parenthesised groups from a
+    precompiled regex. A fast path for bulk runs, with the same interface and
+    output format as `models.SimpleAbbreviationExtractor`. Not a drop-in
+    replacement: sentence boundaries can differ from its, see the notes on
+    `simple_rule_engine` in config.py"""
+
+    def __init__(
+        self,
+        short_form_first: bool = SIMPLE_SHORT_FORM_FIRST,
+        prefilter: bool = SIMPLE_PREFILTER,
+    ) -> None:
+        self.short_form_first = short_form_first
+        # Whether texts and sentences without candidate parentheses are skipped
+        self.prefilter = prefilter
+        # How many documents and sentences were skipped by the pre-screen
+        self.prefilter_stats: Counter = Counter()
+
+    @property
+    def version(self) -> str:
+        """Identifies the extractor and settings that produce its output"""
+        return f"regex-rules-{RULES_VERSION}:short-form-first={self.short_form_first}"
+
+    def find_abbreviations(self, text: str) -> np.ndarray:
+        """Implements the rule-based abbreviation
+            extraction algorithm proposed by Schwartz and Hearst (2003).
+
+        Args:
+            text (str): string in which to find the abbreviations
+
+        Returns:
+            np.ndarray: An array of elements where each element
+                gives an abbreviation along with its in-place sentence
+                and its definition.
+        """
+        return to_array(self.abbreviations_from_text(text)[0])
+
+    def find_abbreviations_batch(
+        self, texts: Iterable[str], batch_size: int = 1
+    ) -> Iterator[List[Abbreviation]]:
+        """Equivalent of `find_abbreviations` over many texts. There is no model to
+        batch, so `batch_size` is only accepted for interface compatibility
+
+        Yields:
+            List[Abbreviation]: The abbreviations found in each text, in order
+        """
+        for abbreviations, _ in self.find_abbreviations_and_sentences(texts):
+            yield abbreviations
+
+    def find_abbreviations_and_sentences(
+        self, texts: Iterable[str], batch_size: int = 1
+    ) -> Iterator[Tuple[List[Abbreviation], Optional[List[Tuple[int, int]]]]]:
+        """Equivalent of `find_abbreviations_batch`, also yielding the sentences
+        each text was split into, see `propagation.PropagatingExtractor`
+
+        Yields:
+            Tuple[List[Abbreviation], Optional[List[Tuple[int, int]]]]: The
+                abbreviations found in each text, and the start and end offsets
+                of its sentences, or None if the prefilter skipped it
+        """
+        yield from timed_iter(
+            "regex.extract", (self.abbreviations_from_text(text) for text in texts)
+        )
+
+    def sentence_spans(self, text: str) -> List[Tuple[int, int]]:
+        """The start and end offsets of the text's sentences, as the extractor
+        splits them"""
+        return list(split_sentences(text))
+
+    def abbreviations_from_text(
+        self, text: str
+    ) -> Tuple[List[Abbreviation], Optional[List[Tuple[int, int]]]]:
+        """Finds each abbreviation, and where it is in the text, along with the
+        text's sentences, or None if the prefilter skipped it"""
+        all_abbreviations = []
+
+        self.prefilter_stats["docs"] += 1
+        if self.prefilter and not has_candidate_parentheses(text):
+            self.prefilter_stats["docs_skipped"] += 1
+            return all_abbreviations, None
+
+        sentences = self.sentence_spans(text)
+        num_skipped = 0
+        for sentence_index, (start, end) in enumerate(sentences):
+            if self.prefilter and not has_candidate_parentheses(text, start, end):
+                num_skipped += 1
+                continue
+
+            sentence = text[start:end]
+            for (
+                short_form,
+                long_form,
+                short_start,
+                long_start,
+            ) in find_sentence_abbreviations(sentence, self.short_form_first):
+                all_abbreviations.append(
+                    Abbreviation(
+                        sentence,
+                        short_form,
+                        long_form,
+                        sentence_index,
+                        start,
+                        end,
+                        start + short_start,
+                        start + short_start + len(short_form),
+                        start + long_start,
+                        start + long_start + len(long_form),
+                    )
+                )
+
+        self.prefilter_stats["sentences"] += len(sentences)
+        self.prefilter_stats["sentences_skipped"] += num_skipped
+        return all_abbreviations, sentences
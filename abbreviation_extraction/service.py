@@ -0,0 +1,293 @@
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import Dict, List, Tuple
+import argparse
+import json
+import queue
+import threading
+import time
+
+from config import MODEL_READ_PATH, SERVICE_HOST, SERVICE_MAX_BATCH_SIZE
+from config import SERVICE_MAX_WAIT_MS, SERVICE_PORT, SERVICE_SOCKET
+from config import SIMPLE_RULE_ENGINE, USE_GPU
+from cli import RULE_ENGINES, rule_engine
+from results import Abbreviation
+import metrics
+
+# Extractors the service loads, unless told otherwise
+DEFAULT_EXTRACTORS = ["rule_based", "ml_based"]
+
+
+class MicroBatcher:
+    """Runs an extractor on a background thread, gathering texts submitted by
+    concurrent requests into batches. A batch is run as soon as it holds
+    `max_batch_size` texts, or `max_wait_ms` after its first text arrived.
+
+    The extractor's pipeline is only ever used from the batcher's thread.
+
+    Args:
+        extractor: The abbreviation extractor to run
+        max_batch_size (int): The most texts passed to the extractor at a time
+        max_wait_ms (float): How long the first text of a batch waits for others
+    """
+
+    def __init__(self, extractor, max_batch_size: int, max_wait_ms: float) -> None:
+        self.extractor = extractor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.pending: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, texts: List[str]) -> List[Future]:
+        """Queues texts for extraction
+
+        Returns:
+            List[Future]: Each text's future, resolving to its abbreviations
+        """
+        futures = []
+        for text in texts:
+            future: Future = Future()
+            self.pending.put((text, future))
+            futures.append(future)
+        return futures
+
+    def next_batch(self) -> List[Tuple[str, Future]]:
+        """Blocks for the first queued text, then gathers more until the batch is
+        full or the wait is over"""
+        batch = [self.pending.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self) -> None:
+        while True:
+            batch = self.next_batch()
+            texts = [text for text, _ in batch]
+            try:
+                with metrics.stage("service.batch", len(texts)):
+                    results = list(
+                        self.extractor.find_abbreviations_batch(
+                            texts, batch_size=len(texts)
+                        )
+                    )
+            except Exception as error:
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            for (_, future), abbreviations in zip(batch, results):
+                future.set_result(abbreviations)
+
+
+def to_json(abbreviations: List[Abbreviation]) -> List[Dict[str, str]]:
+    return [
+        {
+            "sentence": abbreviation.sentence,
+            "short_form": abbreviation.short_form,
+            "long_form": abbreviation.long_form,
+        }
+        for abbreviation in abbreviations
+    ]
+
+
+class ExtractionHandler(BaseHTTPRequestHandler):
+    """Handles the service's API. The server's `batchers` map extractor names to
+    their MicroBatcher
+
+    - `POST /extract` with `{"abstract": "..."}` or `{"abstracts": [...]}`, and
+      optionally `"extractors": ["rule_based", "ml_based"]`, which defaults to
+      every loaded extractor. Responds with each extractor's abbreviations, for
+      the abstract or for each abstract in order
+    - `GET /health` lists the loaded extractors and their versions
+    - `GET /metrics` serves stage metrics in the Prometheus text format, if they
+      are enabled
+    """
+
+    # Keeps connections open between requests
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            versions = {
+                name: batcher.extractor.version
+                for name, batcher in self.server.batchers.items()
+            }
+            self.send_json(200, {"status": "ok", "extractors": versions})
+        elif self.path == "/metrics" and metrics.ENABLED:
+            self.send_body(200, metrics.to_prometheus(metrics.snapshot()), "text/plain")
+        else:
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self) -> None:
+        if self.path != "/extract":
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            single = "abstract" in request
+            abstracts = [request["abstract"]] if single else request["abstracts"]
+            extractors = request.get("extractors", list(self.server.batchers))
+            # Strings are iterable too, so check for lists before their items
+            if not isinstance(abstracts, list) or not all(
+                isinstance(abstract, str) for abstract in abstracts
+            ):
+                raise ValueError("Abstracts must be a string or a list of strings")
+            if not isinstance(extractors, list) or not all(
+                isinstance(extractor, str) for extractor in extractors
+            ):
+                raise ValueError("Extractors must be a list of strings")
+            unknown = set(extractors) - set(self.server.batchers)
+            if unknown:
+                raise ValueError(f"Unknown extractors: {sorted(unknown)}")
+        except (AttributeError, KeyError, TypeError, ValueError) as error:
+            self.send_json(400, {"error": str(error)})
+            return
+
+        # Every extractor's batches are queued before waiting on any of them
+        futures = {
+            name: self.server.batchers[name].submit(abstracts) for name in extractors
+        }
+        try:
+            response = {
+                name: [to_json(future.result()) for future in extractor_futures]
+                for name, extractor_futures in futures.items()
+            }
+        except Exception as error:
+            self.send_json(500, {"error": str(error)})
+            return
+
+        if single:
+            response = {name: results[0] for name, results in response.items()}
+        self.send_json(200, response)
+
+    def send_json(self, status: int, body) -> None:
+        self.send_body(status, json.dumps(body), "application/json")
+
+    def send_body(self, status: int, body: str, content_type: str) -> None:
+        encoded = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # One line per request is too noisy under load
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self) -> None:
+        Path(self.server_address).unlink(missing_ok=True)
+        super().server_bind()
+
+
+def make_server(
+    batchers: Dict[str, MicroBatcher], host: str, port: int, socket_path: str = ""
+):
+    """Creates the HTTP server, listening on a Unix socket if a path is given and
+    on host:port otherwise"""
+    if socket_path:
+        server = ThreadingUnixHTTPServer(socket_path, ExtractionHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ExtractionHandler)
+        server.daemon_threads = True
+    server.batchers = batchers
+    return server
+
+
+def load_batchers(
+    extractors: List[str],
+    engine: str,
+    model_path: str,
+    max_batch_size: int,
+    max_wait_ms: float,
+) -> Dict[str, MicroBatcher]:
+    """Loads each extractor once, behind its own micro-batcher"""
+    batchers = {}
+    if "rule_based" in extractors:
+        batchers["rule_based"] = MicroBatcher(
+            rule_engine(engine)(), max_batch_size, max_wait_ms
+        )
+    if "ml_based" in extractors:
+        from models import BertAbbreviationExtractor
+
+        batchers["ml_based"] = MicroBatcher(
+            BertAbbreviationExtractor(model_path), max_batch_size, max_wait_ms
+        )
+    return batchers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve abbreviation extraction over HTTP, with the extractors "
+        "loaded once"
+    )
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument(
+        "--socket", default=SERVICE_SOCKET, help="Listen on this Unix socket instead"
+    )
+    parser.add_argument(
+        "--extractors",
+        nargs="+",
+        choices=DEFAULT_EXTRACTORS,
+        default=DEFAULT_EXTRACTORS,
+    )
+    parser.add_argument(
+        "--engine", choices=RULE_ENGINES.keys(), default=SIMPLE_RULE_ENGINE
+    )
+    parser.add_argument("--model", default=MODEL_READ_PATH)
+    parser.add_argument(
+        "--gpu",
+        action="store_true",
+        default=USE_GPU,
+        help="Run the transformer on the GPU, if one is available",
+    )
+    parser.add_argument("--max-batch-size", type=int, default=SERVICE_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=SERVICE_MAX_WAIT_MS)
+    parser.add_argument(
+        "--metrics", action="store_true", help="Serve stage metrics at /metrics"
+    )
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable()
+    if args.gpu:
+        import spacy
+
+        spacy.prefer_gpu()
+
+    start = time.perf_counter()
+    batchers = load_batchers(
+        args.extractors, args.engine, args.model, args.max_batch_size, args.max_wait_ms
+    )
+    server = make_server(batchers, args.host, args.port, args.socket)
+    print(
+        f"Loaded {', '.join(batchers)} in {time.perf_counter() - start:.1f}s, "
+        f"listening on {args.socket or f'http://{args.host}:{args.port}'}"
+    )
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,344 @@
+from functools import lru_cache
+from pathlib import Path
+from typing import Collection, Iterator, List, Optional, Tuple
+import os
+
+import pandas as pd
+
+from metrics import stage
+from results import LAYOUT_COLUMNS, OUTPUT_COLUMNS, SOURCE_COLUMN
+
+# Rows read at a time from TSV output by `read_output_chunks`
+READ_CHUNK_SIZE = 100000
+
+
+# Integer columns of the offsets layout
+INDEX_COLUMNS = {
+    "sentence_index",
+    "sentence_start",
+    "sentence_end",
+    "short_form_start",
+    "short_form_end",
+    "long_form_start",
+    "long_form_end",
+}
+
+
+# pyarrow is only imported by the Parquet and Arrow sinks, so TSV runs start
+# without it
+@lru_cache(maxsize=None)
+def output_schema(columns: Tuple[str, ...] = tuple(LAYOUT_COLUMNS["full"])):
+    """The Arrow schema of extractor output with the given columns, see
+    `results.LAYOUT_COLUMNS`"""
+    import pyarrow as pa
+
+    def column_type(column):
+        # Sentences, titles and sources repeat across rows, so they are
+        # dictionary-encoded
+        if column in ("article_title", "sentence", SOURCE_COLUMN):
+            return pa.dictionary(pa.int32(), pa.string())
+        if column in INDEX_COLUMNS:
+            return pa.int32()
+        return pa.string()
+
+    return pa.schema([(column, column_type(column)) for column in columns])
+
+
+def to_arrow(abbreviations: pd.DataFrame, columns: List[str] = OUTPUT_COLUMNS):
+    """Converts a chunk of extractor output to an Arrow table with the output schema"""
+    import pyarrow as pa
+
+    return pa.Table.from_pandas(
+        abbreviations[columns],
+        schema=output_schema(tuple(columns)),
+        preserve_index=False,
+    )
+
+
+class OutputSink:
+    """Destination for extractor output. Chunks of output are written as soon as
+    they are ready, so a crashed run keeps everything written before the crash.
+
+    Sinks are context managers, closing themselves on exit.
+
+    Args:
+        path (str): Where to write the output
+        append (bool): Whether to add to existing output rather than replace it
+        layout (str): The columns to write, see `results.LAYOUT_COLUMNS`
+        provenance (bool): Whether to also write each row's `source`, to tell
+            propagated rows from definitions
+    """
+
+    def __init__(
+        self,
+        path: str,
+        append: bool = False,
+        layout: str = "full",
+        provenance: bool = False,
+    ) -> None:
+        self.path = path
+        self.append = append
+        self.layout = layout
+        self.provenance = provenance
+        self.columns = LAYOUT_COLUMNS[layout] + ([SOURCE_COLUMN] if provenance else [])
+        self.num_chunks = 0
+
+    def write(self, abbreviations: pd.DataFrame) -> None:
+        """Writes a chunk of extractor output
+
+        Args:
+            abbreviations (pd.DataFrame): Output in the `get_abbreviations` schema
+        """
+        with stage("write_output", len(abbreviations)):
+            self.write_chunk(abbreviations)
+        self.num_chunks += 1
+
+    def write_chunk(self, abbreviations: pd.DataFrame) -> None:
+        raise NotImplementedError
+
+    def remove_pmids(self, pmids: Collection[str]) -> None:
+        """Deletes the rows of the given articles from the output written so far,
+        e.g. the stale rows of articles an incremental run extracts again
+
+        Args:
+            pmids (Collection[str]): The articles whose rows to delete
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Finalises the output. Runs that found nothing still produce a file with
+        the output schema"""
+        if self.num_chunks == 0 and not self.append:
+            self.write(pd.DataFrame(columns=self.columns))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TsvSink(OutputSink):
+    """Appends chunks to a single tab-separated file. The file is closed after
+    every chunk, so its contents are always complete rows"""
+
+    def write_chunk(self, abbreviations: pd.DataFrame) -> None:
+        # Only the first chunk of a fresh file truncates it and writes the header
+        first_chunk = self.num_chunks == 0 and not (
+            self.append and os.path.exists(self.path)
+        )
+        abbreviations[self.columns].to_csv(
+            self.path,
+            sep="\t",
+            index=False,
+            mode="w" if first_chunk else "a",
+            header=first_chunk,
+        )
+
+    def remove_pmids(self, pmids: Collection[str]) -> None:
+        """Rewrites the file without the articles' rows, a chunk at a time, and
+        renames it into place"""
+        if not pmids or not os.path.exists(self.path):
+            return
+        pmids = set(map(str, pmids))
+        temp_path = f"{self.path}.tmp"
+
+        with stage("remove_output", len(pmids)):
+            pd.read_csv(self.path, sep="\t", nrows=0).to_csv(
+                temp_path, sep="\t", index=False
+            )
+            for chunk in pd.read_csv(
+                self.path,
+                sep="\t",
+                dtype=str,
+                keep_default_na=False,
+                chunksize=READ_CHUNK_SIZE,
+            ):
+                chunk[~chunk["PMID"].isin(pmids)].to_csv(
+                    temp_path, sep="\t", index=False, mode="a", header=False
+                )
+            os.replace(temp_path, self.path)
+
+
+class ParquetSink(OutputSink):
+    """Writes each chunk as its own Parquet file in a dataset directory, read back
+    with `pd.read_parquet(path)`. Part files are renamed into place once complete,
+    so a crash never leaves a truncated file in the dataset"""
+
+    def __init__(
+        self,
+        path: str,
+        append: bool = False,
+        layout: str = "full",
+        provenance: bool = False,
+    ) -> None:
+        super().__init__(path, append, layout, provenance)
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+        existing_parts = sorted(Path(path).glob("part-*.parquet"))
+        self.first_part = 0
+        if append and existing_parts:
+            self.first_part = int(existing_parts[-1].stem.split("-")[1]) + 1
+        elif not append:
+            for stale_part in existing_parts:
+                stale_part.unlink()
+
+    def write_chunk(self, abbreviations: pd.DataFrame) -> None:
+        part_number = self.first_part + self.num_chunks
+        part_path = Path(self.path) / f"part-{part_number:05d}.parquet"
+        temp_path = part_path.with_suffix(".tmp")
+        import pyarrow.parquet as pq
+
+        pq.write_table(to_arrow(abbreviations, self.columns), temp_path)
+        os.replace(temp_path, part_path)
+
+    def remove_pmids(self, pmids: Collection[str]) -> None:
+        """Rewrites only the part files holding the articles' rows, checking each
+        part's PMID column first"""
+        if not pmids:
+            return
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+
+        value_set = pa.array(sorted(set(map(str, pmids))), pa.string())
+        with stage("remove_output", len(value_set)):
+            for part_path in sorted(Path(self.path).glob("part-*.parquet")):
+                part_pmids = pq.read_table(part_path, columns=["PMID"])["PMID"]
+                stale = pc.is_in(part_pmids, value_set=value_set)
+                if not pc.any(stale).as_py():
+                    continue
+                kept = pq.read_table(part_path).filter(pc.invert(stale))
+                temp_path = part_path.with_suffix(".tmp")
+                pq.write_table(kept, temp_path)
+                os.replace(temp_path, part_path)
+
+
+class ArrowSink(OutputSink):
+    """Writes chunks as record batches to an Arrow IPC stream. The stream format
+    allows each batch to carry its own dictionaries, and a stream cut short by a
+    crash can still be read up to the last complete batch. A finished stream
+    cannot be added to, so resumable runs should use TSV or Parquet"""
+
+    def __init__(
+        self,
+        path: str,
+        append: bool = False,
+        layout: str = "full",
+        provenance: bool = False,
+    ) -> None:
+        if append:
+            raise ValueError("Arrow IPC streams cannot be appended to")
+        import pyarrow as pa
+
+        super().__init__(path, append, layout, provenance)
+        self.writer = pa.ipc.new_stream(path, output_schema(tuple(self.columns)))
+
+    def write_chunk(self, abbreviations: pd.DataFrame) -> None:
+        self.writer.write_table(to_arrow(abbreviations, self.columns))
+
+    def close(self) -> None:
+        super().close()
+        self.writer.close()
+
+
+class SentenceTableSink(OutputSink):
+    """Splits offsets-layout output between two sinks: the rows, and a sentence
+    table holding each sentence's text once, keyed on (PMID, sentence_index).
+    Chunks must carry the `sentence` column, see
+    `results.OffsetAbbreviationTable`
+
+    Args:
+        rows (OutputSink): The sink for the rows, in the offsets layout
+        sentences (OutputSink): The sink for the sentences, in the sentences
+            layout
+    """
+
+    def __init__(self, rows: OutputSink, sentences: OutputSink) -> None:
+        super().__init__(rows.path, rows.append, rows.layout, rows.provenance)
+        self.rows = rows
+        self.sentences = sentences
+
+    def write(self, abbreviations: pd.DataFrame) -> None:
+        self.rows.write(abbreviations)
+        self.sentences.write(abbreviations.drop_duplicates(["PMID", "sentence_index"]))
+
+    def remove_pmids(self, pmids: Collection[str]) -> None:
+        self.rows.remove_pmids(pmids)
+        self.sentences.remove_pmids(pmids)
+
+    def close(self) -> None:
+        self.rows.close()
+        self.sentences.close()
+
+
+OUTPUT_SINKS = {
+    "tsv": TsvSink,
+    "parquet": ParquetSink,
+    "arrow": ArrowSink,
+}
+
+
+def open_sink(
+    path: str,
+    output_format: str,
+    append: bool = False,
+    layout: str = "full",
+    sentences_path: Optional[str] = None,
+    provenance: bool = False,
+) -> OutputSink:
+    """Creates the output sink for a format
+
+    Args:
+        path (str): Where to write the output
+        output_format (str): One of "tsv", "parquet" or "arrow"
+        append (bool): Whether to add to existing output rather than replace it
+        layout (str): "full" or "offsets", see `results.LAYOUT_COLUMNS`
+        sentences_path (Optional[str]): With the offsets layout, also write a
+            sentence table here, in the same format
+        provenance (bool): Whether to also write each row's `source`, e.g. when
+            propagating short forms
+
+    Returns:
+        OutputSink: The sink, ready to be written to
+    """
+    if output_format not in OUTPUT_SINKS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    if layout not in ("full", "offsets"):
+        raise ValueError(f"Unknown output layout: {layout}")
+    sink = OUTPUT_SINKS[output_format](path, append, layout, provenance)
+    if layout == "offsets" and sentences_path is not None:
+        sink = SentenceTableSink(
+            sink, OUTPUT_SINKS[output_format](sentences_path, append, "sentences")
+        )
+    return sink
+
+
+def read_output_chunks(path: str) -> Iterator[pd.DataFrame]:
+    """Reads back output written by any of the sinks, a chunk at a time. The
+    format is inferred from the path: a directory of Parquet part files, an Arrow
+    IPC stream, or otherwise TSV
+
+    Args:
+        path (str): The output to read
+
+    Yields:
+        pd.DataFrame: Chunks of output in the `get_abbreviations` schema
+    """
+    if Path(path).is_dir():
+        for part_path in sorted(Path(path).glob("part-*.parquet")):
+            yield pd.read_parquet(part_path)
+    elif path.endswith(".arrows"):
+        import pyarrow as pa
+
+        with pa.ipc.open_stream(path) as reader:
+            for batch in reader:
+                yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(
+            path,
+            sep="\t",
+            dtype={"PMID": str},
+            keep_default_na=False,
+            chunksize=READ_CHUNK_SIZE,
+        )
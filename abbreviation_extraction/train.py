@@ -1,60 +1,81 @@
+import json
+import sys
 import spacy
-import pandas as pd
-import random
 import warnings
 
 from tqdm import tqdm
-from spacy.util import minibatch, compounding
-from spacy.training import Example
 
+from pathlib import Path
 from thinc.api import Adam
-from sklearn.model_selection import train_test_split
-from utils import process_PLOD
+from batching import length_bucketed_batches
+from corpus import TEST_LIMIT, is_prepared, iter_examples, prepare_corpus
+from evaluation import CachedEvaluator
 
-from config import TESTFLAG, TRAINED_MODEL_OUTPUT_PATH, PLOD_LOCATION, NUM_EPOCHS
+from config import TESTFLAG, TRAINED_MODEL_OUTPUT_PATH, NUM_EPOCHS, PLOD_CORPUS_DIR
+from config import EVAL_BATCH_SIZE, EVAL_EVERY, TRAIN_TOKEN_BUDGET
 
 warnings.filterwarnings("ignore")
-spacy.prefer_gpu()
-
-# A fairly textbook Adam optimizer. We're not here to optimize the performance today
-optimizer = Adam(
-    learn_rate=0.001,
-    beta1=0.9,
-    beta2=0.999,
-    eps=1e-08,
-    L2=1e-4,
-    grad_clip=1.0,
-    use_averages=True,
-    L2_is_weight_decay=True,
-)
 
-if __name__ == "__main__":
 
-    formatted_data = process_PLOD(PLOD_LOCATION)
+def train(
+    use_gpu=False,
+    eval_batch_size=EVAL_BATCH_SIZE,
+    eval_limit=None,
+    eval_every=EVAL_EVERY,
+):
+    """Fine-tunes en_core_web_trf's transformer and a new NER component on PLOD,
+    and saves the model to `trained_model_output_path`
+
+    Args:
+        use_gpu (bool): Whether to train on the GPU, if one is available
+        eval_batch_size (int): Docs per batch when evaluating
+        eval_limit (Optional[int]): If given, validate on a fixed sample of this
+            many dev docs rather than the whole split
+        eval_every (int): Validate every this many epochs, and after the last
+    """
+    if use_gpu:
+        spacy.prefer_gpu()
+
+    # A fairly textbook Adam optimizer. We're not here to optimize the performance today
+    optimizer = Adam(
+        learn_rate=0.001,
+        beta1=0.9,
+        beta2=0.999,
+        eps=1e-08,
+        L2=1e-4,
+        grad_clip=1.0,
+        use_averages=True,
+        L2_is_weight_decay=True,
+    )
+
     nlp = spacy.load("en_core_web_trf", exclude=["ner"])
     ner = nlp.create_pipe("ner")
     nlp.add_pipe("ner", last=True)
 
+    # Training the model requires the data to be preprocessed into reference docs
+    # They're split and written to DocBin shards across all cores, and cached on
+    # disk so this is only slow on the first run
     # Really quick dirty hack for the purposes of local testing, only doing this because
     # its a one-off case_study
-    if TESTFLAG:
-        formatted_data = formatted_data[:10000]
-
-    # Training the model requires the data to be preprocessed and wrapped into an Example object
-    # Iterate through the well-formatted data, and wrap it into a model-ready Example object
-    examples = []
-    for text, annots in tqdm(formatted_data):
-        try:
-            examples.append(Example.from_dict(nlp.make_doc(text), annots))
-        except ValueError as e:
-            continue
+    limit = TEST_LIMIT if TESTFLAG else None
+    if not is_prepared(limit=limit):
+        meta = prepare_corpus(limit=limit)
+        print("Alignment:", json.dumps(meta["counts"], indent=2))
+
+    # Examples are streamed from the shards rather than held in memory
+    corpus_dir = Path(PLOD_CORPUS_DIR)
+
+    def train_data(epoch=None):
+        return iter_examples(nlp, corpus_dir / "train", shuffle_seed=epoch)
+
+    # The dev split is read, tokenized and scored once, see evaluation.py
+    dev_evaluator = CachedEvaluator(
+        nlp, corpus_dir / "dev", limit=eval_limit, batch_size=eval_batch_size
+    )
 
     ner.add_label("SF")
     ner.add_label("LF")
 
-    train_data, val_data = train_test_split(examples, test_size=0.3)
-    dev_data, test_data = train_test_split(val_data, test_size=0.5)
-
     # Number of traininig epochs
     n_iter = NUM_EPOCHS
 
@@ -65,17 +86,21 @@ if __name__ == "__main__":
     # Continue only with the selected pipelines:
     with nlp.select_pipes(enable=select_pipes):
 
-        nlp.initialize(lambda: train_data)
+        nlp.initialize(train_data)
 
         for i in range(n_iter):
-            random.shuffle(train_data)
-
             losses = {}  # for logging
 
-            # Again, we're not here to maximize performance, this is just a vague guess at batch sizes
-            # Cross-validation & hyperparameter tuning would be an extension goal
+            # Batches are segments of similar length, up to a token budget, so the
+            # transformer wastes little time on padding. The budget is still a vague
+            # guess. Cross-validation & hyperparameter tuning would be an extension goal
             for batch in tqdm(
-                minibatch(train_data, spacy.util.compounding(32, 128, 1.002))
+                length_bucketed_batches(
+                    train_data(epoch=i),
+                    lambda example: len(example.predicted),
+                    TRAIN_TOKEN_BUDGET,
+                    shuffle_seed=i,
+                )
             ):
 
                 nlp.update(batch, losses=losses, drop=0.5, sgd=optimizer)
@@ -86,17 +111,26 @@ if __name__ == "__main__":
 
             # For now, inspect the increasing performance (prec, rec, f1) on the dev set
 
-            with nlp.select_pipes(enable="ner"):
-                scores = nlp.evaluate(dev_data)
-
             print("Epoch", i)
             print("Training Loss:", losses)
-            print("Validation Scores:", scores)
+            if (i + 1) % eval_every == 0 or i == n_iter - 1:
+                with nlp.select_pipes(enable="ner"):
+                    scores = dev_evaluator.evaluate()
+                print("Validation Scores:", scores)
             print("----------------------------------")
 
+    test_evaluator = CachedEvaluator(
+        nlp, corpus_dir / "test", batch_size=eval_batch_size
+    )
     with nlp.select_pipes(enable="ner"):
-        test_scores = nlp.evaluate(test_data)
+        test_scores = test_evaluator.evaluate()
 
     print("Test Scores:", test_scores)
 
     nlp.to_disk(TRAINED_MODEL_OUTPUT_PATH)
+
+
+if __name__ == "__main__":
+    from cli import main
+
+    main(["train", *sys.argv[1:]])
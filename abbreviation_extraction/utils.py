@@ -1,22 +1,117 @@
-from typing import Dict
+from typing import IO, Dict, Iterator, List, Optional
+import gzip
+import json
 import lxml.etree as et
 import pandas as pd
 import ast
 
-from config import TARGET_ELEMENTS
+from config import ARTICLE_CHUNK_SIZE, TARGET_ELEMENTS
+from metrics import stage, timed_iter
 
 
-def read_articles(read_location: str) -> et._Element:
-    """Reads xml file from disk and returns the root node
+def open_articles(read_location: str) -> IO[bytes]:
+    """Opens an XML file for binary reading. Gzipped files (`.gz`) are
+    decompressed on the fly
 
     Args:
         read_location (str): Relative path to the file
 
     Returns:
-        et._Element: XML root element
+        IO[bytes]: File handle positioned at the start of the XML document
     """
-    xml_tree = et.parse(read_location)
-    return xml_tree.getroot()
+    if str(read_location).endswith(".gz"):
+        return gzip.open(read_location, "rb")
+    return open(read_location, "rb")
+
+
+def article_to_text(
+    article: et._Element, target_elements: Dict[str, str] = TARGET_ELEMENTS
+) -> List[Optional[str]]:
+    """Converts the desired nodes of a single article element to simple text
+
+    Args:
+        article (et._Element): The article's XML element
+        target_elements (dict(str, str)): XML element paths to extract
+
+    Returns:
+        List[Optional[str]]: The text of each target element, in order.
+            None where the element is missing
+    """
+    article_data_as_text = []
+
+    for element in map(article.find, target_elements.keys()):
+        if element is not None:  # xml tostring functionality is not nullsafe
+            element = et.tostring(
+                element, encoding="unicode", method="text", with_tail=False
+            )
+        article_data_as_text.append(element)
+
+    return article_data_as_text
+
+
+def iter_articles(
+    read_location: str, target_elements: Dict[str, str] = TARGET_ELEMENTS
+) -> Iterator[List[Optional[str]]]:
+    """Streams articles from an XML file one at a time with iterparse, so memory
+    stays flat regardless of the file size. Every child of the root element is
+    treated as an article, and is cleared once it has been processed
+
+    Args:
+        read_location (str): The file location to read articles from. May be gzipped
+
+        target_elements (dict(str, str)): A dictionary of XML element paths to extract
+            for each article. The keys are the XML element paths.
+
+    Yields:
+        List[Optional[str]]: The text of each target element for a single article
+    """
+    with open_articles(read_location) as xml_file:
+        depth = 0
+        for event, element in et.iterparse(xml_file, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                continue
+
+            depth -= 1
+            if depth != 1:  # Only the root's direct children are articles
+                continue
+
+            yield article_to_text(element, target_elements)
+
+            # Free the processed article, and any earlier siblings still
+            # referenced by the root
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+def iter_article_chunks(
+    read_location: str,
+    chunk_size: int = ARTICLE_CHUNK_SIZE,
+    target_elements: Dict[str, str] = TARGET_ELEMENTS,
+) -> Iterator[pd.DataFrame]:
+    """Streams articles from an XML file as dataframes of at most `chunk_size` rows
+
+    Args:
+        read_location (str): The file location to read articles from. May be gzipped
+        chunk_size (int): The maximum number of articles per dataframe
+        target_elements (dict(str, str)): XML element paths to extract, mapped to
+            the names of the dataframe's columns
+
+    Yields:
+        pandas.DataFrame: A dataframe with the same schema as `load_articles`
+    """
+    chunk = []
+    for article_data_as_text in timed_iter(
+        "parse_xml", iter_articles(read_location, target_elements)
+    ):
+        chunk.append(article_data_as_text)
+        if len(chunk) >= chunk_size:
+            yield pd.DataFrame(chunk, columns=target_elements.values())
+            chunk = []
+
+    if chunk:
+        yield pd.DataFrame(chunk, columns=target_elements.values())
 
 
 def load_articles(
@@ -35,20 +130,9 @@ def load_articles(
         pandas.DataFrame: The dataframe containing all articles from the file
     """
 
-    xml_root = read_articles(read_location)
-    extracted_article_data = []
-    for article in xml_root:
-        article_data_as_text = []
-
-        # Find the desired nodes and for each one convert their data to simple text
-        for element in map(article.find, target_elements.keys()):
-            if element is not None:  # xml tostring functionality is not nullsafe
-                element = et.tostring(
-                    element, encoding="unicode", method="text", with_tail=False
-                )
-            article_data_as_text.append(element)
-
-        extracted_article_data.append(article_data_as_text)
+    extracted_article_data = list(
+        timed_iter("parse_xml", iter_articles(read_location, target_elements))
+    )
 
     df = pd.DataFrame(extracted_article_data, columns=target_elements.values())
 
@@ -66,24 +150,36 @@ def clean_data(articles: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: DataFrame containing processed article information
     """
-    return articles.dropna(subset=["abstract"])
+    with stage("clean_data", len(articles)):
+        return articles.dropna(subset=["abstract"])
 
 
-def is_evaluatable(s):
+def parse_indexes(value) -> Optional[list]:
+    """Parses a PLOD index column entry, e.g. "[[10, 13], [20, 25]]", in one pass.
+    Well-formed entries are JSON, so are decoded with the json module. Anything
+    else falls back to Python literal parsing, as the notebook originally did
+
+    Args:
+        value: The raw column value
 
+    Returns:
+        Optional[list]: The parsed indexes, or None if the entry is malformed
+    """
+    if not isinstance(value, str):  # Missing entries are read in as NaN
+        return None
     try:
-        ast.literal_eval(s)
-        return True
+        return json.loads(value)
     except ValueError:
-        return False
+        pass
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return None
 
 
 def process_PLOD(path):
-    """A messy data processing function
-    compiled from the experimentation notebook
-    Would be tidied for prod
-
-    Processed PLOD data into a Spacy form
+    """Processes PLOD data into a Spacy form. Rows with malformed index
+    columns are dropped
 
     Args:
         path (str): file location of PLOD dataset TSV
@@ -93,36 +189,31 @@ def process_PLOD(path):
     df = pd.read_csv(path, encoding="utf-8", sep="\t")
     # Lowercase columns for easier manipulation
     df.columns = df.columns.str.lower()
-    df = df[
-        df["abbreviation_indexes"].apply(is_evaluatable)
-        & df["long-form_indexes"].apply(is_evaluatable)
-    ]
-
-    df["abbreviation_indexes"] = [
-        ast.literal_eval(each) for each in list(df["abbreviation_indexes"])
-    ]
-    df["long-form_indexes"] = [
-        ast.literal_eval(each) for each in list(df["long-form_indexes"])
-    ]
+    return format_PLOD(df)
 
-    reformatted_abbrevs = []
-    for doc_abbrevs in df["abbreviation_indexes"]:
-        temp = [(*indices, "SF") for indices in doc_abbrevs]
-        reformatted_abbrevs.append(temp)
 
-    reformatted_longs = []
-    for doc_abbrevs in df["long-form_indexes"]:
-        temp = [(*indices, "LF") for indices in doc_abbrevs]
-        reformatted_longs.append(temp)
+def format_PLOD(df):
+    """Converts rows of the PLOD TSV, with lowercased columns, into Spacy's form.
+    Rows with malformed index columns are dropped
 
-    df["sf"] = reformatted_abbrevs
-    df["lf"] = reformatted_longs
-
-    entities = [sf + lf for sf, lf in zip(reformatted_abbrevs, reformatted_longs)]
+    Args:
+        df (pd.DataFrame): PLOD rows, e.g. one chunk of the TSV
+    Returns:
+        List: List of sentences with their labelled entities as per Spacy's format
+    """
+    abbreviation_indexes = [parse_indexes(each) for each in df["abbreviation_indexes"]]
+    long_form_indexes = [parse_indexes(each) for each in df["long-form_indexes"]]
 
     formatted_data = []
-    for i, doc in enumerate(df["segment"]):
-        curr = (doc, {"entities": entities[i]})
-        formatted_data.append(curr)
+    for doc, doc_abbrevs, doc_longs in zip(
+        df["segment"], abbreviation_indexes, long_form_indexes
+    ):
+        if doc_abbrevs is None or doc_longs is None:
+            continue
+
+        entities = [(*indices, "SF") for indices in doc_abbrevs] + [
+            (*indices, "LF") for indices in doc_longs
+        ]
+        formatted_data.append((doc, {"entities": entities}))
 
     return formatted_data
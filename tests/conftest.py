@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# The package's modules import each other by their flat names, as when they are
+# run as scripts from abbreviation_extraction/
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "abbreviation_extraction"))
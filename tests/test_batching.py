@@ -0,0 +1,153 @@
+import random
+
+import pytest
+import spacy
+from spacy.language import Language
+
+from batching import iter_windows, length_bucketed_batches, padding_stats
+from batching import pipe_length_bucketed
+
+# How many docs each call of the recording component received
+BATCH_SIZES = []
+
+
+class BatchRecorder:
+    def __call__(self, doc):
+        BATCH_SIZES.append(1)
+        return doc
+
+    def pipe(self, docs, batch_size=None):
+        docs = list(docs)
+        BATCH_SIZES.append(len(docs))
+        yield from docs
+
+
+@Language.factory("record_batch_size")
+def make_batch_recorder(nlp, name):
+    return BatchRecorder()
+
+
+@pytest.fixture
+def nlp():
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    BATCH_SIZES.clear()
+    return nlp
+
+
+def make_texts(num_texts, seed=0):
+    rng = random.Random(seed)
+    return [
+        " ".join(f"word{i}" for i in range(rng.randint(1, 40))) + "."
+        for _ in range(num_texts)
+    ]
+
+
+def test_iter_windows_splits_by_count():
+    assert list(iter_windows(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(iter_windows([], 3)) == []
+
+
+def test_iter_windows_caps_tokens():
+    lengths = [4, 4, 4, 20, 1, 1, 9]
+    windows = list(iter_windows(lengths, 5, length=lambda n: n, max_tokens=10))
+
+    # The item over the cap gets a window to itself
+    assert windows == [[4, 4], [4], [20], [1, 1], [9]]
+    assert all(len(window) == 1 or sum(window) <= 10 for window in windows)
+
+
+@pytest.mark.parametrize("max_batch_size", [None, 3])
+def test_batches_keep_every_item_within_budget(max_batch_size):
+    rng = random.Random(0)
+    lengths = [rng.randint(1, 60) for _ in range(200)] + [150]
+
+    batches = list(
+        length_bucketed_batches(
+            range(len(lengths)),
+            lengths.__getitem__,
+            token_budget=100,
+            max_batch_size=max_batch_size,
+            window=50,
+        )
+    )
+
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    for batch in batches:
+        batch_lengths = [lengths[i] for i in batch]
+        assert len(batch) == 1 or max(batch_lengths) * len(batch) <= 100
+        assert max_batch_size is None or len(batch) <= max_batch_size
+
+
+def test_bucketing_pads_less_than_fixed_batches():
+    rng = random.Random(0)
+    lengths = [rng.randint(1, 60) for _ in range(500)]
+
+    bucketed = length_bucketed_batches(lengths, lambda n: n, token_budget=512)
+    fixed = iter_windows(lengths, 16)
+
+    assert (
+        padding_stats(bucketed)["padding_tokens"]
+        < padding_stats(fixed)["padding_tokens"]
+    )
+
+
+def test_shuffled_batches_hold_the_same_items():
+    lengths = list(range(1, 41))
+    kwargs = {"token_budget": 60, "window": 20}
+
+    ordered = list(length_bucketed_batches(lengths, lambda n: n, **kwargs))
+    shuffled = list(
+        length_bucketed_batches(lengths, lambda n: n, shuffle_seed=1, **kwargs)
+    )
+
+    assert shuffled != ordered
+    assert sorted(shuffled) == sorted(ordered)
+
+
+def test_padding_stats():
+    stats = padding_stats([[2, 4], [3]])
+
+    assert stats == {
+        "batches": 2,
+        "tokens": 9,
+        "padding_tokens": 2,
+        "padding_fraction": pytest.approx(2 / 11),
+    }
+
+
+def test_pipe_keeps_the_order_of_the_texts(nlp):
+    texts = make_texts(60)
+    nlp.add_pipe("record_batch_size")
+
+    docs = list(
+        pipe_length_bucketed(
+            nlp, texts, token_budget=80, window=25, max_window_tokens=400
+        )
+    )
+
+    assert [doc.text for doc in docs] == texts
+    assert all(doc.has_annotation("SENT_START") for doc in docs)
+    # Batched by the token budget, not one doc at a time
+    assert max(BATCH_SIZES) > 1
+    assert sum(BATCH_SIZES) == len(texts)
+
+
+def test_pipe_streams_its_texts(nlp):
+    texts = make_texts(100)
+    num_read = 0
+
+    def read_texts():
+        nonlocal num_read
+        for text in texts:
+            num_read += 1
+            yield text
+
+    docs = pipe_length_bucketed(
+        nlp, read_texts(), token_budget=80, window=10, max_window_tokens=1000
+    )
+    first = next(docs)
+
+    assert first.text == texts[0]
+    # Only the first window, and the text that ended it, were read
+    assert num_read <= 11
@@ -0,0 +1,40 @@
+import benchmark
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:       300 |        420 | io
+import time:        50 |         50 |       spacy.about
+import time:      4000 |       4050 |     spacy
+import time:       200 |       4250 |   models
+import time:       100 |       4350 | cli
+"""
+
+
+def test_parse_importtime_keeps_nested_entries():
+    entries = benchmark.parse_importtime(IMPORTTIME)
+    assert [(entry.module, entry.depth) for entry in entries] == [
+        ("_io", 1),
+        ("io", 0),
+        ("spacy.about", 3),
+        ("spacy", 2),
+        ("models", 1),
+        ("cli", 0),
+    ]
+    assert entries[3].self_us == 4000
+    assert entries[3].cumulative_us == 4050
+
+
+def test_top_level_imports():
+    imported_by = benchmark.top_level_imports(benchmark.parse_importtime(IMPORTTIME))
+    assert imported_by["_io"] == "io"
+    assert imported_by["spacy.about"] == "cli"
+    assert imported_by["cli"] == "cli"
+
+
+def test_time_startup_finds_indirect_heavy_imports():
+    # spaCy is only imported through models, never at the top level of the CLI
+    result = benchmark.time_startup(["ml"], 1)
+    assert "spacy" not in result["slowest_imports"]
+    assert "spacy" in result["heavy_modules"]
+    assert result["heavy_modules_imported_by"]["spacy"] == "models"
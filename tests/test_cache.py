@@ -0,0 +1,57 @@
+import itertools
+
+import pytest
+
+import cache as cache_module
+from cache import ResultCache
+from results import Abbreviation
+
+
+class Clock:
+    """Stands in for the time module, so every use of the cache is later"""
+
+    def __init__(self):
+        self.ticks = itertools.count()
+
+    def time(self):
+        return float(next(self.ticks))
+
+
+@pytest.fixture
+def result_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_module, "time", Clock())
+    result_cache = ResultCache(str(tmp_path / "results.sqlite"))
+    yield result_cache
+    result_cache.close()
+
+
+def result(key):
+    return [Abbreviation(f"Sentence {key} " + "x" * 1000, "SF", "short form")]
+
+
+def test_eviction_keeps_cache_under_limit_and_drops_least_recently_used(
+    result_cache,
+):
+    for key in map(str, range(200)):
+        result_cache.put_many({key: result(key)})
+    assert result_cache.evictions == 0
+
+    # The oldest result becomes the most recently used
+    result_cache.get_many(["0"])
+
+    result_cache.max_bytes = result_cache.size_bytes() // 2
+    result_cache.put_many({"new": result("new")})
+
+    assert result_cache.evictions > 0
+    assert result_cache.size_bytes() <= result_cache.max_bytes
+    remaining = result_cache.get_many(["0", "1", "199", "new"])
+    assert sorted(remaining) == ["0", "199", "new"]
+    assert remaining["0"] == result("0")
+
+
+def test_eviction_stops_when_cache_is_empty(result_cache):
+    result_cache.max_bytes = 0
+    result_cache.put_many({"only": result("only")})
+
+    assert result_cache.evictions == 1
+    assert result_cache.get_many(["only"]) == {}
@@ -0,0 +1,29 @@
+import pandas as pd
+
+from checkpoint import ExtractorCheckpoint, RunManifest
+
+
+def articles(abstracts):
+    return pd.DataFrame(
+        {
+            "PMID": list(abstracts),
+            "article_title": "Title",
+            "abstract": list(abstracts.values()),
+        }
+    )
+
+
+def test_incremental_checkpoint_reports_changed_articles(tmp_path):
+    manifest = RunManifest(str(tmp_path / "manifest.sqlite"))
+    checkpoint = ExtractorCheckpoint(manifest, "rule_based", incremental=True)
+
+    first_run = checkpoint.pending(articles({"1": "First.", "2": "Second."}))
+    assert checkpoint.superseded(first_run) == []
+    checkpoint.mark_done(first_run)
+
+    second_run = checkpoint.pending(
+        articles({"1": "First.", "2": "Second, revised.", "3": "Third."})
+    )
+    assert second_run["PMID"].tolist() == ["2", "3"]
+    assert checkpoint.superseded(second_run) == ["2"]
+    manifest.close()
@@ -0,0 +1,68 @@
+import pytest
+
+import data
+from data import CompactConll, CompactConllWriter, concat_conll_files, load_conll
+
+DOCS = [
+    (
+        ["Magnetic", "resonance", "imaging", "(", "MRI", ")"],
+        ["B-LF", "I-LF", "I-LF", "O", "B-SF", "O"],
+    ),
+    (
+        ["β-blockers", "(", "BB", ")", "reduce", "mortality"],
+        ["B-LF", "O", "B-SF", "O", "O", "O"],
+    ),
+    (["Naïve"], ["O"]),
+    ([], []),
+    (["IL-6", "levels", "rose"], ["B-SF", "O", "O"]),
+]
+
+
+def write_compact(path, docs):
+    with CompactConllWriter(str(path)) as writer:
+        for tokens, tags in docs:
+            writer.write(tokens, tags)
+
+
+@pytest.mark.parametrize("flush_size", [data.FLUSH_SIZE, 2])
+def test_compact_conll_round_trip(tmp_path, monkeypatch, flush_size):
+    # A tiny flush size appends the arrays to their files part way through
+    monkeypatch.setattr(data, "FLUSH_SIZE", flush_size)
+    write_compact(tmp_path / "compact", DOCS)
+
+    compact = CompactConll(str(tmp_path / "compact"))
+    assert len(compact) == len(DOCS)
+    assert list(compact) == DOCS
+    assert compact[1] == DOCS[1]
+    assert compact.tags == ["B-LF", "I-LF", "O", "B-SF"]
+    with pytest.raises(IndexError):
+        compact[len(DOCS)]
+
+
+def test_empty_compact_conll(tmp_path):
+    write_compact(tmp_path / "compact", [])
+
+    assert list(CompactConll(str(tmp_path / "compact"))) == []
+
+
+def test_concat_writes_matching_conll_and_compact_forms(tmp_path):
+    split = tmp_path / "train.conll"
+    split.write_text(
+        "Body NN B-LF\nmass NN I-LF\nindex NN I-LF\n( ( B-O\nBMI NN B-AC\n) ) B-O\n\n"
+        "No DT B-O\nabbreviations NNS B-O\n",
+        encoding="utf-8",
+    )
+    out = tmp_path / "all.conll"
+    compact_out = tmp_path / "compact"
+
+    assert concat_conll_files(str(out), [str(split)], str(compact_out)) == 2
+
+    expected = [
+        (
+            ["Body", "mass", "index", "(", "BMI", ")"],
+            ["B-LF", "I-LF", "I-LF", "O", "B-SF", "O"],
+        ),
+        (["No", "abbreviations"], ["O", "O"]),
+    ]
+    assert list(load_conll(str(out))) == expected
+    assert list(load_conll(str(compact_out))) == expected
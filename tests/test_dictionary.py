@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+from dictionary import AbbreviationDictionary, DictionaryEntry
+from results import DEFINITION, OUTPUT_COLUMNS, PROPAGATED, SOURCE_COLUMN
+
+
+def abbreviations(rows):
+    """Output rows from (PMID, short form, long form)"""
+    return pd.DataFrame(
+        [("Title", pmid, "A sentence.", short, long) for pmid, short, long in rows],
+        columns=OUTPUT_COLUMNS,
+    )
+
+
+@pytest.fixture
+def dictionary(tmp_path):
+    with AbbreviationDictionary(str(tmp_path / "dictionary.sqlite")) as dictionary:
+        yield dictionary
+
+
+def test_adding_a_pmid_again_replaces_its_entries(dictionary):
+    dictionary.add(
+        abbreviations(
+            [
+                ("5", "MRI", "magnetic resonance imaging"),
+                ("5", "MRI", "magnetic resonance imaging"),
+                ("12", "MRI", "magnetic resonance imaging"),
+                ("12", "CT", "computed tomography"),
+            ]
+        ),
+        ["5", "12"],
+    )
+    assert dictionary.lookup("MRI") == [
+        DictionaryEntry("MRI", "magnetic resonance imaging", 3, "5", "12")
+    ]
+
+    # PMID 12 was revised: it now defines MRI differently and no longer has CT
+    dictionary.add(abbreviations([("12", "MRI", "magnetic resonance images")]), ["12"])
+
+    assert dictionary.lookup("MRI") == [
+        DictionaryEntry("MRI", "magnetic resonance imaging", 2, "5", "5"),
+        DictionaryEntry("MRI", "magnetic resonance images", 1, "12", "12"),
+    ]
+    assert dictionary.lookup("CT") == []
+    assert len(dictionary) == 2
+    assert dictionary.pmids("MRI", "magnetic resonance imaging") == ["5"]
+
+
+def test_adding_a_pmid_without_abbreviations_clears_it(dictionary):
+    dictionary.add(abbreviations([("7", "CT", "computed tomography")]), ["7"])
+    dictionary.add(abbreviations([]), ["7"])
+
+    assert len(dictionary) == 0
+
+
+def test_adding_without_pmids_only_adds(dictionary):
+    dictionary.add(abbreviations([("7", "CT", "computed tomography")]))
+    dictionary.add(abbreviations([("7", "CT", "computed tomography")]))
+
+    assert dictionary.lookup("CT")[0].frequency == 2
+
+
+def test_propagated_rows_are_not_counted(dictionary):
+    rows = abbreviations([("9", "CT", "computed tomography")] * 3)
+    rows[SOURCE_COLUMN] = [DEFINITION, PROPAGATED, PROPAGATED]
+    dictionary.add(rows, ["9"])
+
+    assert dictionary.lookup("CT")[0].frequency == 1
@@ -0,0 +1,99 @@
+import spacy
+from spacy.tokens import DocBin
+from spacy.training import Example
+
+from evaluation import CachedEvaluator, doc_entities, doc_pairs, prf
+from models import heuristic_abbreviation_match
+
+TEXTS = [
+    "We measured tumor necrosis factor (TNF) in serum.",
+    # Whole-segment pairing would pair the long form ending the first sentence
+    # with the short form starting the second
+    "Levels rose after interleukin 6. IL-6 was then measured again.",
+    "Both tumor necrosis factor (TNF) and interleukin 6 (IL-6) fell. TNF rose.",
+    "No abbreviations here.",
+]
+
+PATTERNS = [
+    {"label": "LF", "pattern": "tumor necrosis factor"},
+    {"label": "LF", "pattern": "interleukin 6"},
+    {"label": "SF", "pattern": "TNF"},
+    {"label": "SF", "pattern": [{"TEXT": "IL-6"}]},
+]
+
+
+def make_pipeline():
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns(PATTERNS)
+    return nlp
+
+
+def write_split(nlp, split_dir):
+    # Gold annotations differ from the ruler's on purpose: the last text's second
+    # TNF is left out
+    references = []
+    for index, doc in enumerate(nlp.pipe(TEXTS)):
+        reference = nlp.make_doc(doc.text)
+        ents = list(doc.ents)
+        if index == 2:
+            ents = ents[:-1]
+        reference.ents = [
+            reference.char_span(ent.start_char, ent.end_char, ent.label_)
+            for ent in ents
+        ]
+        references.append(reference)
+    split_dir.mkdir()
+    DocBin(docs=references).to_disk(split_dir / "shard.spacy")
+    return references
+
+
+def test_cached_evaluation_matches_uncached(tmp_path):
+    nlp = make_pipeline()
+    references = write_split(nlp, tmp_path / "dev")
+
+    # As train.py validates, with only the entity component enabled
+    evaluator = CachedEvaluator(nlp, tmp_path / "dev", batch_size=2)
+    with nlp.select_pipes(enable="entity_ruler"):
+        cached = evaluator.evaluate()
+
+    uncached = nlp.evaluate(
+        [Example(nlp.make_doc(reference.text), reference) for reference in references]
+    )
+    for key in ("ents_p", "ents_r", "ents_f"):
+        assert cached[key] == uncached[key]
+    for label in ("SF", "LF"):
+        for key in ("p", "r", "f"):
+            assert cached["ents_per_type"][label][key] == (
+                uncached["ents_per_type"][label][key]
+            )
+
+    # The pairs BertAbbreviationExtractor would output, from the full pipeline
+    num_correct = num_predicted = num_gold = 0
+    for doc, reference in zip(nlp.pipe(TEXTS), references):
+        sentences = [(sent.start_char, sent.end_char) for sent in doc.sents]
+        pairs = {
+            (sf.start_char, sf.end_char, lf.start_char, lf.end_char)
+            for sent in doc.sents
+            for sf, lf in heuristic_abbreviation_match(sent.ents)
+        }
+        gold_pairs = doc_pairs(reference, sentences)
+        num_correct += len(pairs & gold_pairs)
+        num_predicted += len(pairs)
+        num_gold += len(gold_pairs)
+    pair_scores = prf(num_correct, num_predicted, num_gold)
+    assert num_predicted == 3
+    assert (cached["pairs_p"], cached["pairs_r"], cached["pairs_f"]) == (
+        pair_scores["p"],
+        pair_scores["r"],
+        pair_scores["f"],
+    )
+
+
+def test_doc_pairs_stay_within_sentences():
+    nlp = make_pipeline()
+    doc = nlp(TEXTS[1])
+    assert len(doc_entities(doc)) == 2
+    assert doc_pairs(doc) == set()
+    assert len(doc_pairs(doc, [(0, len(doc.text))])) == 1
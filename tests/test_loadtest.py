@@ -0,0 +1,70 @@
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+
+import pytest
+
+from loadtest import load_test
+
+
+def serve(status):
+    """A service stand-in that answers every request with `status`, and records
+    the size of each batch it is sent"""
+    batch_sizes = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            batch_sizes.append(len(body.get("abstracts", [body.get("abstract")])))
+            self.send_response(status)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, batch_sizes
+
+
+@pytest.fixture
+def service(request):
+    server, batch_sizes = serve(request.param)
+    yield lambda: HTTPConnection(*server.server_address), batch_sizes
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("service", [200], indirect=True)
+def test_batches_larger_than_the_abstracts(service):
+    connect, batch_sizes = service
+    result = load_test(connect, ["One (O).", "Two (T)."], [], 2, 0.2, batch_size=5)
+
+    assert result["requests"] > 0
+    assert result["failed_requests"] == 0
+    assert result["p50_ms"] is not None
+    assert set(batch_sizes) == {5}
+
+
+@pytest.mark.parametrize("service", [500], indirect=True)
+def test_every_request_failing_is_reported(service):
+    connect, _ = service
+    result = load_test(connect, ["One (O)."], [], 2, 0.2)
+
+    assert result["requests"] == 0
+    assert result["failed_requests"] > 0
+    assert list(result["errors"]) == ["500"]
+    assert result["p50_ms"] is None and result["p99_ms"] is None
+
+
+def test_unreachable_service_is_reported():
+    def connect():
+        return HTTPConnection("127.0.0.1", 1, timeout=1)
+
+    result = load_test(connect, ["One (O)."], [], 1, 0.1)
+
+    assert result["requests"] == 0
+    assert result["errors"]["ConnectionRefusedError"] > 0
@@ -0,0 +1,53 @@
+from collections import Counter, defaultdict
+
+import pandas as pd
+import pytest
+
+from fixtures import write_articles_xml
+from main import count_difference, extract_chunk_parallel, get_abbreviations, open_pool
+from rules import RegexAbbreviationExtractor
+from utils import clean_data, load_articles
+
+
+@pytest.fixture(scope="module")
+def cleaned_articles(tmp_path_factory):
+    path = tmp_path_factory.mktemp("articles") / "articles.xml"
+    write_articles_xml(str(path), 60)
+    return clean_data(load_articles(str(path)))
+
+
+def test_count_difference_keeps_unchanged_keys():
+    difference = count_difference(Counter(hits=3, misses=8), Counter(hits=3, misses=2))
+
+    assert difference == Counter(hits=0, misses=6)
+    assert sorted(difference) == ["hits", "misses"]
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_parallel_extraction_matches_serial(tmp_path, cleaned_articles, cached):
+    serial = get_abbreviations(
+        RegexAbbreviationExtractor(), cleaned_articles, show_progress=False
+    )
+
+    worker_stats = defaultdict(lambda: [0, 0.0])
+    cache_stats = Counter(hits=0, misses=0)
+    cache_path = str(tmp_path / "cache.sqlite") if cached else None
+    with open_pool(RegexAbbreviationExtractor, 2, cache_path=cache_path) as pool:
+        parallel = extract_chunk_parallel(
+            pool,
+            cleaned_articles,
+            2,
+            worker_stats,
+            cache_stats,
+            show_progress=False,
+        )
+
+    # Shards' categorical columns have different categories, so concatenating
+    # them gives object columns. The values are what must match
+    pd.testing.assert_frame_equal(parallel.astype(object), serial.astype(object))
+    assert sum(num_docs for num_docs, _ in worker_stats.values()) == len(
+        cleaned_articles
+    )
+    # Both keys are reported even when one of them stays at zero
+    expected_misses = len(cleaned_articles) if cached else 0
+    assert dict(cache_stats) == {"hits": 0, "misses": expected_misses}
@@ -0,0 +1,38 @@
+import threading
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def enabled_metrics():
+    was_enabled = metrics.ENABLED
+    metrics.enable()
+    metrics.reset()
+    yield
+    metrics.reset()
+    if not was_enabled:
+        metrics.disable()
+
+
+def test_reset_while_threads_record(enabled_metrics):
+    def record_stages():
+        for _ in range(2000):
+            with metrics.stage("worker", 1):
+                pass
+
+    threads = [threading.Thread(target=record_stages) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for _ in range(200):
+        metrics.reset()
+        metrics.report()
+    for thread in threads:
+        thread.join()
+
+    metrics.reset()
+    assert metrics.snapshot() == {}
+    with metrics.stage("after_reset", 3):
+        pass
+    assert metrics.report()["after_reset"]["items"] == 3
@@ -0,0 +1,132 @@
+from functools import partial
+import time
+
+import pandas as pd
+import pytest
+
+import pipeline
+from checkpoint import ExtractorCheckpoint, RunManifest
+from fixtures import write_articles_xml
+from main import get_abbreviations
+from pipeline import PipelineStage, run_pipeline
+from rules import RegexAbbreviationExtractor
+from sinks import OutputSink
+from utils import clean_data, load_articles
+
+CHUNK_SIZE = 5
+
+
+class MemorySink(OutputSink):
+    """Keeps the chunks written to it, optionally taking a while to write each"""
+
+    def __init__(self, write_seconds: float = 0.0) -> None:
+        super().__init__("memory")
+        self.chunks = []
+        self.write_seconds = write_seconds
+
+    def write_chunk(self, abbreviations: pd.DataFrame) -> None:
+        time.sleep(self.write_seconds)
+        self.chunks.append(abbreviations)
+
+    def output(self) -> pd.DataFrame:
+        return pd.concat(self.chunks, ignore_index=True).astype(object)
+
+
+@pytest.fixture(scope="module")
+def articles_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("articles") / "articles.xml"
+    write_articles_xml(str(path), 60)
+    return str(path)
+
+
+@pytest.fixture
+def chunks_read(monkeypatch):
+    """Counts the calls to the article reader, and the chunks it has produced"""
+    counts = {"calls": 0, "chunks": 0}
+    iter_article_chunks = pipeline.iter_article_chunks
+
+    def counted_chunks(*args, **kwargs):
+        counts["calls"] += 1
+        for chunk in iter_article_chunks(*args, **kwargs):
+            counts["chunks"] += 1
+            yield chunk
+
+    monkeypatch.setattr(pipeline, "iter_article_chunks", counted_chunks)
+    return counts
+
+
+def extract_with(extractor):
+    return partial(get_abbreviations, extractor, show_progress=False)
+
+
+def test_stages_share_one_pass_and_match_sequential_extraction(
+    articles_path, chunks_read
+):
+    extractors = {
+        "Short form first": RegexAbbreviationExtractor(),
+        "Long form first": RegexAbbreviationExtractor(short_form_first=False),
+    }
+    sinks = {name: MemorySink() for name in extractors}
+
+    run_pipeline(
+        articles_path,
+        [
+            PipelineStage(name, extract_with(extractor), sinks[name])
+            for name, extractor in extractors.items()
+        ],
+        chunk_size=CHUNK_SIZE,
+        queue_size=2,
+    )
+
+    assert chunks_read["calls"] == 1
+    cleaned_articles = clean_data(load_articles(articles_path))
+    for name, extractor in extractors.items():
+        expected = get_abbreviations(extractor, cleaned_articles, show_progress=False)
+        assert len(expected)
+        pd.testing.assert_frame_equal(sinks[name].output(), expected.astype(object))
+
+
+def test_slow_writer_holds_back_reading(articles_path, chunks_read):
+    sink = MemorySink(write_seconds=0.02)
+    chunks_read_per_write = []
+    write_chunk = sink.write_chunk
+
+    def recorded_write(abbreviations):
+        chunks_read_per_write.append(chunks_read["chunks"])
+        write_chunk(abbreviations)
+
+    sink.write_chunk = recorded_write
+    stage = PipelineStage(
+        "Rule-based", extract_with(RegexAbbreviationExtractor()), sink
+    )
+    run_pipeline(articles_path, [stage], chunk_size=CHUNK_SIZE, queue_size=1)
+
+    assert len(chunks_read_per_write) == chunks_read["chunks"] == 12
+    # While a chunk is written, at most one more is queued for writing, one is
+    # being extracted, one is queued for extraction and one waits on the reader
+    for written, read in enumerate(chunks_read_per_write):
+        assert read - written <= 5
+
+
+def test_checkpointed_stage_skips_done_articles(articles_path, tmp_path):
+    manifest = RunManifest(str(tmp_path / "manifest.sqlite"))
+    extracted = []
+
+    def extract(cleaned_articles):
+        extracted.extend(cleaned_articles["PMID"])
+        return get_abbreviations(
+            RegexAbbreviationExtractor(), cleaned_articles, show_progress=False
+        )
+
+    for _ in range(2):
+        stage = PipelineStage(
+            "Rule-based",
+            extract,
+            MemorySink(),
+            ExtractorCheckpoint(manifest, "rule_based"),
+        )
+        run_pipeline(articles_path, [stage], chunk_size=CHUNK_SIZE)
+
+    manifest.close()
+    # Every article was extracted by the first run only
+    assert sorted(extracted) == sorted(clean_data(load_articles(articles_path))["PMID"])
@@ -0,0 +1,86 @@
+import pytest
+
+from models import SimpleAbbreviationExtractor
+from propagation import PropagatingExtractor
+from results import DEFINITION, PROPAGATED
+from rules import RegexAbbreviationExtractor
+
+
+@pytest.fixture(scope="module")
+def spacy_extractor():
+    return SimpleAbbreviationExtractor("sentencizer")
+
+
+def propagated_rows(extractor, text, corpus_long_forms=None):
+    propagating = PropagatingExtractor(extractor, corpus_long_forms)
+    (rows,) = propagating.find_abbreviations_batch([text])
+    return [row for row in rows if row.source == PROPAGATED]
+
+
+def test_propagates_later_mentions_only():
+    text = (
+        "HF was common. Patients with heart failure (HF) were enrolled. "
+        "HF and HF again. Outcomes were unrelated."
+    )
+    propagating = PropagatingExtractor(RegexAbbreviationExtractor())
+    (rows,) = propagating.find_abbreviations_batch([text])
+
+    assert [row.source for row in rows] == [DEFINITION, PROPAGATED]
+    definition, propagated = rows
+    assert definition.sentence_index == 1
+    # One row per sentence, for the first mention after the definition
+    assert propagated.sentence == "HF and HF again."
+    assert propagated.sentence_index == 2
+    assert text[propagated.short_form_start : propagated.short_form_end] == "HF"
+    assert propagated.short_form_start == text.index("HF and")
+    # The long form's offsets point at the definition
+    assert (propagated.long_form_start, propagated.long_form_end) == (
+        definition.long_form_start,
+        definition.long_form_end,
+    )
+
+
+def test_uses_the_extractors_sentences(spacy_extractor):
+    # spaCy's sentencizer splits before "then", the regex engine doesn't, as it
+    # needs a capital to start a sentence
+    text = "Tumor necrosis factor (TNF) was measured. Levels rose. then TNF fell."
+    (propagated,) = propagated_rows(spacy_extractor, text)
+    assert propagated.sentence == "then TNF fell."
+    assert propagated.sentence_index == 2
+
+    (propagated,) = propagated_rows(RegexAbbreviationExtractor(), text)
+    assert propagated.sentence == "Levels rose. then TNF fell."
+    assert propagated.sentence_index == 1
+
+
+def test_corpus_mode_skips_short_and_common_short_forms(spacy_extractor):
+    corpus_long_forms = {
+        "NO": "nitric oxide",
+        "AND": "autosomal nucleotide deficiency",
+        "IT": "immunotherapy",
+        "CT": "computed tomography",
+        "MRI": "magnetic resonance imaging",
+    }
+    # Nothing is defined here, so the prefilter skips the text and its sentences
+    # come from the extractor's own segmentation
+    text = "NO change was seen AND IT was stable. MRI and CT were normal. then MRI."
+    rows = propagated_rows(spacy_extractor, text, corpus_long_forms)
+    assert [(row.short_form, row.sentence_index) for row in rows] == [
+        ("MRI", 1),
+        ("MRI", 2),
+    ]
+    assert rows[1].sentence == "then MRI."
+    assert (rows[0].long_form, rows[0].long_form_start) == (
+        "magnetic resonance imaging",
+        -1,
+    )
+
+
+def test_document_definitions_resolve_at_any_length():
+    text = "Computed tomography (CT) was used. CT was normal."
+    rows = propagated_rows(
+        RegexAbbreviationExtractor(), text, {"CT": "cycle threshold"}
+    )
+    assert [(row.short_form, row.long_form) for row in rows] == [
+        ("CT", "Computed tomography")
+    ]
@@ -0,0 +1,103 @@
+import pandas as pd
+import pytest
+
+from benchmark import legacy_result_assembly
+from main import get_abbreviations
+from models import SimpleAbbreviationExtractor
+from results import PROPAGATED, Abbreviation, AbbreviationTable
+from rules import RegexAbbreviationExtractor
+
+# The first sentence holds no abbreviation, the second and third are the same
+# sentence, and "MRI" is mentioned before the parentheses that define it
+ABSTRACT = (
+    "Imaging was done twice. "
+    "The MRI used magnetic resonance imaging (MRI) scans. "
+    "The MRI used magnetic resonance imaging (MRI) scans."
+)
+
+
+@pytest.mark.parametrize(
+    "extractor",
+    [
+        RegexAbbreviationExtractor(short_form_first=False),
+        SimpleAbbreviationExtractor("sentencizer"),
+    ],
+    ids=["regex", "spacy"],
+)
+def test_offsets_locate_repeated_sentences_and_short_forms(extractor):
+    articles = pd.DataFrame(
+        {"PMID": ["1"], "article_title": ["Title"], "abstract": [ABSTRACT]}
+    )
+    output = get_abbreviations(
+        extractor, articles, show_progress=False, layout="offsets", sentences=True
+    )
+
+    definition = "The MRI used magnetic resonance imaging (MRI) scans."
+    second_start = ABSTRACT.rindex(definition)
+    assert list(output["sentence_index"]) == [1, 2]
+    assert list(output["sentence_start"]) == [ABSTRACT.index(definition), second_start]
+    for row in output.itertuples():
+        assert ABSTRACT[row.sentence_start : row.sentence_end] == definition
+        assert ABSTRACT[row.short_form_start : row.short_form_end] == "MRI"
+        assert ABSTRACT[row.long_form_start : row.long_form_end] == (
+            "magnetic resonance imaging"
+        )
+        # The parenthesised mention, not the one before the long form
+        assert ABSTRACT[row.short_form_start - 1] == "("
+        assert row.short_form_start > row.long_form_start
+
+
+def test_table_interns_text_and_skips_articles_without_abbreviations():
+    definition = Abbreviation("A sentence (AS).", "AS", "A sentence")
+    mention = Abbreviation("AS again.", "AS", "A sentence", source=PROPAGATED)
+    table = AbbreviationTable()
+    table.extend("Title", "1", [definition, mention, definition])
+    table.extend("Unused title", "2", [])
+    table.extend(None, "3", [definition])
+
+    output = table.to_frame()
+    assert len(table) == 4
+    assert list(output["PMID"]) == ["1", "1", "1", "3"]
+    assert list(output["sentence"].cat.categories) == [
+        "A sentence (AS).",
+        "AS again.",
+    ]
+    assert list(output["sentence"].cat.codes) == [0, 1, 0, 0]
+    # Titles are only kept for articles with abbreviations
+    assert list(output["article_title"].cat.categories) == ["Title"]
+    assert pd.isna(output["article_title"][3])
+    assert list(output["source"]) == [
+        "definition",
+        "propagated",
+        "definition",
+        "definition",
+    ]
+
+
+def test_table_matches_legacy_assembly():
+    extractor = RegexAbbreviationExtractor()
+    articles = pd.DataFrame(
+        {
+            "PMID": ["1", "2", "3", "4"],
+            "article_title": ["First", "Second", None, "First"],
+            "abstract": [
+                ABSTRACT,
+                "Nothing is abbreviated here.",
+                "Reactive oxygen species (ROS) rose.",
+                "Reactive oxygen species (ROS) rose. Levels of nitric oxide (NO) "
+                "fell.",
+            ],
+        }
+    )
+    abbreviations = [
+        extractor.find_abbreviations(text) for text in articles["abstract"]
+    ]
+
+    output = get_abbreviations(extractor, articles, show_progress=False)
+    legacy = legacy_result_assembly(abbreviations, articles)
+    assert len(output) == 5
+    pd.testing.assert_frame_equal(
+        output.drop(columns="source").astype(object),
+        legacy.astype(object),
+        check_dtype=False,
+    )
@@ -0,0 +1,123 @@
+import random
+
+import pytest
+
+from fixtures import make_abstract, write_articles_xml
+from models import SimpleAbbreviationExtractor
+from rules import RegexAbbreviationExtractor
+from utils import clean_data, load_articles
+
+ABSTRACTS = [
+    "Magnetic resonance imaging (MRI) was performed in all patients. "
+    "Results were confirmed by MRI.",
+    "We studied tumor necrosis factor-alpha (TNF-alpha) levels. "
+    "The body mass index (BMI) was recorded (n = 12).",
+    "Patients with chronic obstructive pulmonary disease (COPD) and heart failure "
+    "(HF) were enrolled. Some used inhaled corticosteroids (ICS).",
+    "The World Health Organization (WHO) reported cases (see Table 1). "
+    "Polymerase chain reaction (PCR) confirmed it.",
+    "No abbreviations here at all.",
+    "",
+]
+
+# Text where sentence splitting and tokenization are easy to get wrong. The spaCy
+# engine is the reference: the regex engine has to split the same sentences and
+# find the same parenthesised groups
+REFERENCE_ABSTRACTS = ABSTRACTS + [
+    "The U.S. Food and Drug Administration (FDA) approved it. Trials followed.",
+    "Reactive oxygen species (ROS)/nitric oxide (NO) levels rose.",
+    "Samples came from the U.K. Magnetic resonance imaging (MRI) was done.",
+    "Ph.D. Students measured body mass index (BMI) in vitamin a. Then it rose.",
+    "Interleukin 6 (IL-6)-mediated tumor necrosis factor (TNF), rose (n = 4).",
+    "Mr. Smith had heart failure (HF). St. Louis reported chronic kidney "
+    "disease (CKD) [computed tomography (CT)].",
+    "Nitric oxide (NO)'s metabolites rose. Patients (aged 40-60) enrolled.",
+]
+
+
+@pytest.fixture(scope="module", params=["sentencizer", "full"])
+def spacy_extractor(request):
+    if request.param == "full":  # The default, which needs en_core_web_md
+        pytest.importorskip("en_core_web_md")
+    # Without the prefilter, so every abstract's sentences are compared
+    return SimpleAbbreviationExtractor(request.param, prefilter=False)
+
+
+@pytest.fixture(scope="module")
+def regex_extractor():
+    return RegexAbbreviationExtractor(short_form_first=False, prefilter=False)
+
+
+def rows_and_sentences(extractor, abstracts):
+    return list(extractor.find_abbreviations_and_sentences(abstracts))
+
+
+def test_regex_matches_spacy_on_reference_abstracts(spacy_extractor, regex_extractor):
+    regex_results = rows_and_sentences(regex_extractor, REFERENCE_ABSTRACTS)
+    spacy_results = rows_and_sentences(spacy_extractor, REFERENCE_ABSTRACTS)
+    for abstract, regex_result, spacy_result in zip(
+        REFERENCE_ABSTRACTS, regex_results, spacy_results
+    ):
+        # Whole rows: sentence text, index and offsets as well as the pair
+        assert regex_result == spacy_result, abstract
+
+
+def test_regex_rows(regex_extractor):
+    rows = list(regex_extractor.find_abbreviations_batch(REFERENCE_ABSTRACTS))
+    assert [row[:3] for row in rows[1]] == [
+        (
+            "We studied tumor necrosis factor-alpha (TNF-alpha) levels.",
+            "TNF-alpha",
+            "tumor necrosis factor-alpha",
+        ),
+        ("The body mass index (BMI) was recorded (n = 12).", "BMI", "body mass index"),
+    ]
+    # Not split after "U.S."
+    assert [row[:3] for row in rows[6]] == [
+        (
+            "The U.S. Food and Drug Administration (FDA) approved it.",
+            "FDA",
+            "Food and Drug Administration",
+        )
+    ]
+    # "(ROS)/nitric" is a single token to spaCy, so isn't parenthesised
+    assert [row.short_form for row in rows[7]] == ["NO"]
+
+
+def test_regex_matches_spacy_on_fixture_abstracts(spacy_extractor, regex_extractor):
+    rng = random.Random(0)
+    abstracts = [make_abstract(rng) for _ in range(200)]
+
+    regex_results = rows_and_sentences(regex_extractor, abstracts)
+    assert regex_results == rows_and_sentences(spacy_extractor, abstracts)
+    assert sum(len(rows) for rows, _ in regex_results) > 0
+
+
+@pytest.fixture(scope="module")
+def fixture_abstracts(tmp_path_factory):
+    path = tmp_path_factory.mktemp("articles") / "articles.xml"
+    write_articles_xml(str(path), 200)
+    abstracts = list(clean_data(load_articles(str(path)))["abstract"])
+    # Abstracts and sentences the prefilter skips
+    return abstracts + [
+        "No parentheses at all. None here either.",
+        "Only a closing one) here. Then (an opening one.",
+    ]
+
+
+@pytest.mark.parametrize(
+    "extractor_class, kwargs",
+    [
+        (SimpleAbbreviationExtractor, {"sentence_segmenter": "sentencizer"}),
+        (RegexAbbreviationExtractor, {}),
+    ],
+)
+def test_prefilter_drops_no_pairs(fixture_abstracts, extractor_class, kwargs):
+    filtered = extractor_class(**kwargs, prefilter=True)
+    unfiltered = extractor_class(**kwargs, prefilter=False)
+
+    filtered_rows = list(filtered.find_abbreviations_batch(fixture_abstracts))
+    assert filtered_rows == list(unfiltered.find_abbreviations_batch(fixture_abstracts))
+    assert filtered.prefilter_stats["docs_skipped"] > 0
+    assert filtered.prefilter_stats["sentences_skipped"] > 0
+    assert unfiltered.prefilter_stats["docs_skipped"] == 0
@@ -0,0 +1,102 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from results import OUTPUT_COLUMNS
+from sinks import open_sink, read_output_chunks
+
+
+def abbreviations(pmids, sentence="A sentence (AS)."):
+    return pd.DataFrame(
+        {
+            "article_title": [f"Title {pmid}" for pmid in pmids],
+            "PMID": pmids,
+            "sentence": sentence,
+            "short_form": "AS",
+            "long_form": "A sentence",
+        },
+        columns=OUTPUT_COLUMNS,
+    )
+
+
+def read_rows(path):
+    output = pd.concat(read_output_chunks(str(path)), ignore_index=True)
+    return output.astype(str).values.tolist()
+
+
+def output_path(tmp_path, output_format):
+    return tmp_path / ("out.tsv" if output_format == "tsv" else "out")
+
+
+@pytest.mark.parametrize("output_format", ["tsv", "parquet"])
+def test_resumed_sink_appends_to_existing_output(tmp_path, output_format):
+    path = output_path(tmp_path, output_format)
+    with open_sink(str(path), output_format) as sink:
+        sink.write(abbreviations(["1", "2"]))
+        sink.write(abbreviations(["3"]))
+
+    with open_sink(str(path), output_format, append=True) as sink:
+        sink.write(abbreviations(["4"]))
+
+    expected = abbreviations(["1", "2", "3", "4"]).values.tolist()
+    assert read_rows(path) == expected
+    if output_format == "tsv":
+        # The header is only written once
+        assert path.read_text().count("short_form") == 1
+    else:
+        assert sorted(part.name for part in path.glob("*.parquet")) == [
+            "part-00000.parquet",
+            "part-00001.parquet",
+            "part-00002.parquet",
+        ]
+
+
+@pytest.mark.parametrize("output_format", ["tsv", "parquet"])
+def test_resumed_sink_with_nothing_to_write_keeps_output(tmp_path, output_format):
+    path = output_path(tmp_path, output_format)
+    with open_sink(str(path), output_format) as sink:
+        sink.write(abbreviations(["1"]))
+
+    with open_sink(str(path), output_format, append=True):
+        pass
+
+    assert read_rows(path) == abbreviations(["1"]).values.tolist()
+
+
+@pytest.mark.parametrize("output_format", ["tsv", "parquet"])
+def test_fresh_sink_replaces_existing_output(tmp_path, output_format):
+    path = output_path(tmp_path, output_format)
+    with open_sink(str(path), output_format) as sink:
+        sink.write(abbreviations(["1", "2"]))
+
+    with open_sink(str(path), output_format) as sink:
+        sink.write(abbreviations(["3"]))
+
+    assert read_rows(path) == abbreviations(["3"]).values.tolist()
+
+
+def test_resumed_tsv_sink_appends_to_missing_file(tmp_path):
+    path = Path(tmp_path) / "new.tsv"
+    with open_sink(str(path), "tsv", append=True) as sink:
+        sink.write(abbreviations(["1"]))
+
+    assert read_rows(path) == abbreviations(["1"]).values.tolist()
+
+
+@pytest.mark.parametrize("output_format", ["tsv", "parquet"])
+def test_remove_pmids_drops_only_their_rows(tmp_path, output_format):
+    path = output_path(tmp_path, output_format)
+    with open_sink(str(path), output_format) as sink:
+        sink.write(abbreviations(["1", "2"]))
+        sink.write(abbreviations(["3", "2"]))
+
+    with open_sink(str(path), output_format, append=True) as sink:
+        sink.remove_pmids(["2", "missing"])
+        sink.write(abbreviations(["2"], sentence="A new sentence (ANS)."))
+
+    expected = (
+        abbreviations(["1", "3"]).values.tolist()
+        + abbreviations(["2"], sentence="A new sentence (ANS).").values.tolist()
+    )
+    assert read_rows(path) == expected
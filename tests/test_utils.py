@@ -0,0 +1,120 @@
+import gzip
+
+import lxml.etree as et
+import pandas as pd
+import pytest
+
+from config import TARGET_ELEMENTS
+from utils import iter_article_chunks, load_articles
+
+# Nested markup in titles and abstracts, tails after the extracted elements, an
+# article without an abstract, and nesting under MedlineCitation that isn't an
+# article
+ARTICLES_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<PubmedArticleSet>
+  <PubmedArticle>
+    <MedlineCitation>
+      <PMID>1</PMID>
+      <Article>
+        <ArticleTitle>Effects of <i>in vitro</i> <sup>2</sup>H labelling</ArticleTitle>
+        <Abstract>
+          <AbstractText>Magnetic resonance imaging (<b>MRI</b>) was <i>used</i>.
+          </AbstractText>tail text
+        </Abstract>
+      </Article>
+    </MedlineCitation>
+  </PubmedArticle>
+  <PubmedArticle>
+    <MedlineCitation>
+      <PMID>2</PMID>
+      <Article>
+        <ArticleTitle>No abstract</ArticleTitle>
+      </Article>
+      <CommentsCorrectionsList>
+        <CommentsCorrections><PMID>99</PMID></CommentsCorrections>
+      </CommentsCorrectionsList>
+    </MedlineCitation>
+  </PubmedArticle>
+  <PubmedArticle>
+    <MedlineCitation>
+      <PMID>3</PMID>
+      <Article>
+        <ArticleTitle>Naïve β-blockers</ArticleTitle>
+        <Abstract>
+          <AbstractText>β-blockers (BB) &amp; angiotensin <sub>II</sub>.</AbstractText>
+          <AbstractText>A second section is ignored.</AbstractText>
+        </Abstract>
+      </Article>
+    </MedlineCitation>
+  </PubmedArticle>
+  <PubmedArticle>
+    <MedlineCitation>
+      <PMID>4</PMID>
+      <Article>
+        <ArticleTitle>Last</ArticleTitle>
+        <Abstract><AbstractText>Reactive oxygen species (ROS).</AbstractText></Abstract>
+      </Article>
+    </MedlineCitation>
+  </PubmedArticle>
+</PubmedArticleSet>
+""".encode()
+
+
+def whole_file_articles(path) -> pd.DataFrame:
+    """Loads the articles the way the project did before streaming: parsing the
+    whole file, then reading each of the root's children"""
+    rows = []
+    for article in et.parse(str(path)).getroot():
+        row = []
+        for element in map(article.find, TARGET_ELEMENTS.keys()):
+            if element is not None:
+                element = et.tostring(
+                    element, encoding="unicode", method="text", with_tail=False
+                )
+            row.append(element)
+        rows.append(row)
+    return pd.DataFrame(rows, columns=TARGET_ELEMENTS.values())
+
+
+def table_rows(articles: pd.DataFrame):
+    """The values of each row, with None for missing ones. A chunk without any
+    abstracts infers another dtype for them, with another missing value"""
+    return [
+        [None if pd.isna(value) else value for value in row]
+        for row in articles.itertuples(index=False)
+    ]
+
+
+@pytest.fixture
+def articles_path(tmp_path):
+    path = tmp_path / "articles.xml"
+    path.write_bytes(ARTICLES_XML)
+    return path
+
+
+def test_streamed_articles_match_whole_file_parse(articles_path):
+    articles = load_articles(str(articles_path))
+
+    pd.testing.assert_frame_equal(articles, whole_file_articles(articles_path))
+    assert articles["PMID"].tolist() == ["1", "2", "3", "4"]
+    assert articles["article_title"][0] == "Effects of in vitro 2H labelling"
+    assert pd.isna(articles["abstract"][1])
+
+
+def test_gzipped_articles_match_plain(articles_path, tmp_path):
+    gzipped_path = tmp_path / "articles.xml.gz"
+    gzipped_path.write_bytes(gzip.compress(ARTICLES_XML))
+
+    pd.testing.assert_frame_equal(
+        load_articles(str(gzipped_path)), whole_file_articles(articles_path)
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 4, 10])
+def test_chunks_split_articles_without_losing_any(articles_path, chunk_size):
+    chunks = list(iter_article_chunks(str(articles_path), chunk_size))
+
+    assert [len(chunk) for chunk in chunks[:-1]] == [chunk_size] * (len(chunks) - 1)
+    assert 0 < len(chunks[-1]) <= chunk_size
+    rows = [row for chunk in chunks for row in table_rows(chunk)]
+    assert rows == table_rows(whole_file_articles(articles_path))